@@ -23,9 +23,9 @@ class AudioStreamInlineModelAdmin(admin.TabularInline):
 
 
 class AudioAdmin(BaseMediaFileAdminMixin, admin.ModelAdmin):
-    list_display = ('title', 'file', 'date_added', 'audio_codec', 'bitrate')
+    list_display = ('title', 'file', 'date_added', 'audio_codec', 'bitrate', 'playable_streams')
     readonly_fields = ('audio_codec', 'audio_bitrate', 'audio_channels',
-                       'bitrate', 'size', 'duration')
+                       'bitrate', 'size', 'duration', 'parent', 'clip_start', 'clip_end')
     inlines = (AudioStreamInlineModelAdmin,)
     prepopulated_fields = {'slug': ('title',)}
     search_fields = ('title', 'slug')
@@ -40,4 +40,8 @@ class AudioAdmin(BaseMediaFileAdminMixin, admin.ModelAdmin):
         (_('Audio stream'), {
             'fields': ('audio_codec', 'audio_bitrate', 'audio_channels'),
         }),
+        (_('Clip'), {
+            'fields': ('parent', 'clip_start', 'clip_end'),
+            'classes': ('collapse',),
+        }),
     )
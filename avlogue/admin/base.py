@@ -1,8 +1,12 @@
 from functools import partial
 
 from django import forms
+from django.contrib.admin import helpers
+from django.db.models import Case, Count, When
+from django.template.response import TemplateResponse
 from django.utils.translation import ugettext_lazy as _
 
+from avlogue import tasks
 from avlogue.models import VideoFormatSet, Video, AudioFormatSet
 from avlogue.utils import media_file_convert_action
 
@@ -11,7 +15,48 @@ class BaseStreamForm(forms.ModelForm):
     update = forms.BooleanField(label=_('Update'), required=False)
 
 
+class ClipForm(forms.Form):
+    start = forms.FloatField(label=_('Start (seconds)'), min_value=0)
+    end = forms.FloatField(label=_('End (seconds)'), min_value=0)
+    title = forms.CharField(label=_('Title'), max_length=50, required=False)
+
+    def __init__(self, *args, **kwargs):
+        self.media_files_count = kwargs.pop('media_files_count', 1)
+        super(ClipForm, self).__init__(*args, **kwargs)
+
+    def clean_title(self):
+        # Titles are unique, clips of several media files get titles of their sources
+        title = self.cleaned_data['title']
+        if title and self.media_files_count > 1:
+            raise forms.ValidationError(_('Title can be set only for a clip of one media file.'))
+        return title
+
+    def clean(self):
+        cleaned_data = super(ClipForm, self).clean()
+        start, end = cleaned_data.get('start'), cleaned_data.get('end')
+        if start is not None and end is not None and start >= end:
+            raise forms.ValidationError(_('Clip start must be less than clip end.'))
+        return cleaned_data
+
+
 class BaseMediaFileAdminMixin(object):
+    actions = ['create_clip']
+
+    def get_queryset(self, request):
+        """
+        Annotates media files with the number of playable streams.
+        """
+        queryset = super(BaseMediaFileAdminMixin, self).get_queryset(request)
+        stream_model = self.model._meta.get_field('streams').related_model
+        return queryset.annotate(playable_streams_count=Count(Case(
+            When(streams__status=stream_model.CONVERSION_SUCCESSFUL, then=1))))
+
+    def playable_streams(self, obj):
+        return obj.playable_streams_count
+
+    playable_streams.short_description = _('Playable streams')
+    playable_streams.admin_order_field = 'playable_streams_count'
+
     def save_formset(self, request, form, formset, change):
         """
         Runs encoding of the selected streams.
@@ -33,3 +78,27 @@ class BaseMediaFileAdminMixin(object):
             desc = _('Make/update streams for %(format_set)s format set.') % {'format_set': format_set.name}
             actions[name] = (action, name, desc)
         return actions
+
+    def create_clip(self, request, queryset):
+        """
+        Creates clips of the selected media files by tasks.
+        """
+        form = ClipForm(request.POST if 'apply' in request.POST else None, media_files_count=queryset.count())
+        if form.is_valid():
+            for pk in queryset.values_list('pk', flat=True):
+                tasks.create_clip.delay(self.model, pk, form.cleaned_data['start'], form.cleaned_data['end'],
+                                        title=form.cleaned_data['title'] or None)
+            self.message_user(request, _('Clips will be created soon.'))
+            return None
+
+        context = dict(
+            self.admin_site.each_context(request),
+            title=_('Create clip'),
+            form=form,
+            queryset=queryset,
+            opts=self.model._meta,
+            action_checkbox_name=helpers.ACTION_CHECKBOX_NAME,
+        )
+        return TemplateResponse(request, 'avlogue/admin/create_clip.html', context)
+
+    create_clip.short_description = _('Create clip from selected media files')
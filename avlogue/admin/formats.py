@@ -17,6 +17,9 @@ class VideoFormatAdmin(admin.ModelAdmin):
         (_('Audio stream'), {
             'fields': ('audio_codec', 'audio_bitrate', 'audio_channels', 'audio_codec_params'),
         }),
+        (_('Speed presets'), {
+            'fields': ('video_speed_presets', 'deadline_class'),
+        }),
     )
 
 
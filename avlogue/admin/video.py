@@ -16,7 +16,8 @@ class VideoStreamInlineModelAdmin(admin.TabularInline):
     form = VideoStreamModelForm
 
     extra = 0
-    fields = ('file', 'status', 'resolution', 'bitrate', 'size', 'created', 'update',)
+    fields = ('file', 'status', 'resolution', 'bitrate', 'target_video_bitrate', 'speed_preset', 'size', 'created',
+              'update',)
     readonly_fields = tuple(set(fields) - set(('update',)))
 
     def has_add_permission(self, request):
@@ -25,10 +26,10 @@ class VideoStreamInlineModelAdmin(admin.TabularInline):
 
 class VideoAdmin(BaseMediaFileAdminMixin, admin.ModelAdmin):
     list_display = ('admin_thumbnail', 'title', 'file', 'date_added', 'resolution', 'video_codec', 'audio_codec',
-                    'bitrate')
+                    'bitrate', 'playable_streams')
     readonly_fields = ('video_codec', 'video_bitrate', 'video_height', 'video_width',
                        'audio_codec', 'audio_bitrate', 'audio_channels',
-                       'bitrate', 'size', 'duration', 'resolution')
+                       'bitrate', 'size', 'duration', 'resolution', 'complexity', 'parent', 'clip_start', 'clip_end')
     list_display_links = ('admin_thumbnail', 'title',)
     inlines = (VideoStreamInlineModelAdmin,)
     prepopulated_fields = {'slug': ('title',)}
@@ -42,9 +43,13 @@ class VideoAdmin(BaseMediaFileAdminMixin, admin.ModelAdmin):
             'fields': ('duration', 'bitrate', 'size')
         }),
         (_('Video stream'), {
-            'fields': ('video_codec', 'video_bitrate', 'resolution'),
+            'fields': ('video_codec', 'video_bitrate', 'resolution', 'complexity'),
         }),
         (_('Audio stream'), {
             'fields': ('audio_codec', 'audio_bitrate', 'audio_channels'),
         }),
+        (_('Clip'), {
+            'fields': ('parent', 'clip_start', 'clip_end'),
+            'classes': ('collapse',),
+        }),
     )
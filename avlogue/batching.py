@@ -0,0 +1,239 @@
+"""
+AVlogue micro-batched encoding of short audio streams.
+
+Task overhead dominates conversions of short audio clips. With AVLOGUE_AUDIO_BATCH_ENABLED streams of the audio files,
+which are not longer than AVLOGUE_AUDIO_BATCH_MAX_DURATION, are not converted by their own encode_stream tasks:
+encode_audio_batch task claims a batch of the queued streams by one update, encodes them by
+AVLOGUE_AUDIO_BATCH_CONCURRENCY parallel encoder processes and records the results by one update.
+Signals are not sent by the queryset updates, so player cache, streams versions and manifests are updated here.
+"""
+import logging
+import os
+from multiprocessing.pool import ThreadPool
+
+from django.core import files
+from django.db import connections, models, transaction
+from django.utils.text import slugify
+from django.utils.timezone import now
+
+from avlogue import deletion
+from avlogue import governor
+from avlogue import mezzanine
+from avlogue import player_cache
+from avlogue import scratch
+from avlogue import settings
+from avlogue import tasks
+from avlogue import utils
+from avlogue.encoders import default_encoder
+
+logger = logging.getLogger('avlogue')
+
+SUCCESSFUL = 'successful'
+FAILED = 'failed'
+POSTPONED = 'postponed'
+
+RESULT_FIELDS = ('status', 'conversion_task_id', 'file', 'content_type', 'url', 'bitrate', 'duration', 'size',
+                 'audio_codec', 'audio_bitrate', 'audio_channels')
+
+
+def is_batched(stream):
+    """
+    Returns True if the stream is encoded by a batch.
+
+    :param stream:
+    :type stream: avlogue.models.BaseStream
+    :rtype: bool
+    """
+    from avlogue.models import AudioStream
+
+    if not settings.AUDIO_BATCH_ENABLED or not isinstance(stream, AudioStream):
+        return False
+    duration = stream.media_file.duration
+    return duration is not None and duration <= settings.AUDIO_BATCH_MAX_DURATION
+
+
+def get_claim_id(task_id, stream_pk):
+    # Conversion task id is unique, so the batch task id is combined with the stream pk
+    return '{}:{}'.format(task_id, stream_pk)
+
+
+def is_claimed(stream):
+    """
+    Returns True if the stream is being encoded by a batch.
+    """
+    return stream.status == stream.CONVERSION_IN_PROGRESS and ':' in (stream.conversion_task_id or '')
+
+
+def schedule_batch():
+    """
+    Queues a batch task after the commit. One task is queued per transaction, whatever number of streams is queued.
+    On Django 1.8 the task is queued right away, so convert() inside a transaction queues a batch, which cannot see
+    the uncommitted stream yet. Such streams are left to the periodic run.
+    """
+    utils.on_commit_once(tasks.encode_audio_batch.delay)
+
+
+def get_queued_streams():
+    """
+    Returns queryset of the streams waiting for a batch.
+    """
+    from avlogue.models import AudioStream
+
+    return AudioStream.objects.filter(status=AudioStream.CONVERSION_PREPARATION, conversion_task_id__isnull=True,
+                                      media_file__duration__lte=settings.AUDIO_BATCH_MAX_DURATION)
+
+
+def claim_streams(task_id, batch_size=None):
+    """
+    Marks a batch of the queued streams as being converted by the task.
+
+    :param task_id: batch task id
+    :param batch_size: maximal number of the streams, AVLOGUE_AUDIO_BATCH_SIZE by default
+    :return: list of the claimed streams
+    :rtype: list
+    """
+    from avlogue.models import AudioStream
+
+    if not settings.AUDIO_BATCH_ENABLED:
+        return []
+    batch_size = batch_size or settings.AUDIO_BATCH_SIZE
+    pks = list(get_queued_streams().order_by('pk').values_list('pk', flat=True)[:batch_size])
+    if not pks:
+        return []
+    # Streams could be claimed by another batch or converted again meanwhile, only the queued ones are updated
+    utils.bulk_update(get_queued_streams(), (AudioStream(pk=pk, status=AudioStream.CONVERSION_IN_PROGRESS,
+                                                         conversion_task_id=get_claim_id(task_id, pk)) for pk in pks),
+                      ('status', 'conversion_task_id'))
+    streams = list(AudioStream.objects.filter(conversion_task_id__in=[get_claim_id(task_id, pk) for pk in pks])
+                   .select_related('media_file', 'format').order_by('pk'))
+    streams_updated(streams)
+    return streams
+
+
+def _encode(stream):
+    # Streams are encoded in threads, they use no database queries here
+    try:
+        encode_format = stream.get_encode_format()
+        estimated_size = scratch.estimate_output_size(stream.media_file, encode_format)
+        output_filename = os.path.splitext(os.path.basename(stream.media_file.file.name))[0]
+        output_filename = '{}_{}.{}'.format(output_filename, slugify(stream.format.name), stream.format.container)
+
+        with scratch.scratch_directory(estimated_size) as scratch_dir, \
+                governor.encode_slot(encode_format) as threads:
+            scratch.check_storage_space(settings.MEDIA_STREAMS_STORAGE, estimated_size)
+            output_file = os.path.join(scratch_dir, output_filename)
+            input_file = mezzanine.get_input_file(stream.media_file, threads=threads)
+            default_encoder.encode(stream.media_file, output_file, encode_format, input_file=input_file,
+                                   threads=threads)
+
+            stream_file_info = default_encoder.get_file_info(output_file, 'audio')
+            for field_name, value in stream_file_info.items():
+                setattr(stream, field_name, value)
+            with open(output_file, 'rb') as f:
+                stream.file.save(output_filename, files.File(f), save=False)
+        stream.update_content_type()
+        stream.url = stream.file.url if settings.STORE_FILE_URLS else None
+        return SUCCESSFUL
+    except (scratch.ScratchSpaceError, governor.GovernorBusy, mezzanine.MezzanineBusy) as e:
+        logger.info('Conversion of {} is postponed: {}'.format(repr(stream), str(e)))
+        return POSTPONED
+    except Exception as e:
+        logger.error('Conversion of {} failed.\nException:\n{}'.format(repr(stream), str(e)))
+        return FAILED
+    finally:
+        # Governor cache could open a connection of the thread
+        connections.close_all()
+
+
+def encode_streams(streams):
+    """
+    Encodes the streams by AVLOGUE_AUDIO_BATCH_CONCURRENCY parallel encoder processes.
+
+    :param streams: claimed streams
+    :return: list of the results: SUCCESSFUL, FAILED or POSTPONED
+    :rtype: list
+    """
+    concurrency = settings.AUDIO_BATCH_CONCURRENCY
+    if settings.GOVERNOR_ENABLED:
+        # Conversions over the worker limit would be postponed
+        concurrency = min(concurrency, settings.GOVERNOR_WORKER_ENCODES)
+    pool = ThreadPool(max(1, min(concurrency, len(streams))))
+    try:
+        return pool.map(_encode, streams)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def record_results(task_id, streams, results):
+    """
+    Records states and file info of the encoded streams by one update. Results of the streams,
+    which have been converted again or deleted meanwhile, are dropped.
+
+    :return: list of the updated streams
+    :rtype: list
+    """
+    from avlogue.models import AudioStream
+
+    for stream, result in zip(streams, results):
+        if result == SUCCESSFUL:
+            stream.status = stream.CONVERSION_SUCCESSFUL
+            stream.conversion_task_id = None
+        elif result == FAILED:
+            stream.status = stream.CONVERSION_FAILURE
+        else:
+            # Stream is claimed by a later batch
+            stream.status = stream.CONVERSION_PREPARATION
+            stream.conversion_task_id = None
+
+    claim_ids = [get_claim_id(task_id, stream.pk) for stream in streams]
+    with transaction.atomic():
+        queryset = AudioStream.objects.filter(conversion_task_id__in=claim_ids)
+        claimed_pks = set(queryset.select_for_update().values_list('pk', flat=True))
+        updated = [stream for stream in streams if stream.pk in claimed_pks]
+        utils.bulk_update(queryset, updated, RESULT_FIELDS)
+
+    for stream, result in zip(streams, results):
+        if stream.pk in claimed_pks:
+            stream._old_file_name = stream.file.name
+        elif result == SUCCESSFUL:
+            logger.info('Conversion result of {} is dropped, stream has been changed.'.format(repr(stream)))
+            deletion.delete_files(stream.file.storage, [stream.file.name])
+    streams_updated(updated)
+    return updated
+
+
+def streams_updated(streams):
+    """
+    Invalidates player cache, increments streams versions and writes manifests of the media files
+    of the streams updated by a queryset update.
+    """
+    from avlogue import models as avlogue_models
+
+    media_file_streams = dict((stream.media_file_id, stream) for stream in streams)
+    if not media_file_streams:
+        return
+    for media_file_id in media_file_streams.keys():
+        player_cache.invalidate(avlogue_models.Audio, media_file_id)
+    avlogue_models.Audio.objects.filter(pk__in=list(media_file_streams.keys())).update(
+        streams_version=models.F('streams_version') + 1, streams_modified=now())
+    for stream in media_file_streams.values():
+        avlogue_models.update_manifest(avlogue_models.AudioStream, stream)
+
+
+def encode_batch(task_id, batch_size=None):
+    """
+    Claims, encodes and records a batch of the queued streams.
+
+    :param task_id: batch task id
+    :param batch_size: maximal number of the streams, AVLOGUE_AUDIO_BATCH_SIZE by default
+    :return: number of the claimed streams and number of the postponed ones
+    :rtype: tuple
+    """
+    streams = claim_streams(task_id, batch_size)
+    if not streams:
+        return 0, 0
+    logger.info('Encode batch of {} audio streams.'.format(len(streams)))
+    results = encode_streams(streams)
+    record_results(task_id, streams, results)
+    return len(streams), results.count(POSTPONED)
@@ -0,0 +1,108 @@
+"""
+AVlogue client hints.
+
+Player sources are ordered by constraints derived from Save-Data, Downlink, ECT and Viewport-Width request headers,
+so browsers of constrained clients pick a small stream first. Browsers send Downlink, ECT and Viewport-Width only
+to the sites which advertise them by Accept-CH header, see avlogue.middleware.ClientHintsMiddleware.
+"""
+from avlogue import settings
+
+CLIENT_HINTS = ('Save-Data', 'Downlink', 'ECT', 'Viewport-Width')
+
+
+def get_client_hints(request):
+    """
+    Returns client hints of the request.
+
+    :param request:
+    :rtype: dict
+    """
+    meta = request.META
+    hints = {
+        'save_data': meta.get('HTTP_SAVE_DATA', '').strip().lower() == 'on',
+        'ect': meta.get('HTTP_ECT', '').strip().lower() or None,
+        'downlink': None,
+        'viewport_width': None,
+    }
+    try:
+        # Downlink is in megabits per second
+        hints['downlink'] = float(meta['HTTP_DOWNLINK'])
+    except (KeyError, ValueError):
+        pass
+    try:
+        hints['viewport_width'] = int(meta['HTTP_VIEWPORT_WIDTH'])
+    except (KeyError, ValueError):
+        pass
+    return hints
+
+
+def _quantize_bitrate(bitrate):
+    # Rounds bitrate down to the nearest step, so the number of cached player variants is limited
+    steps = sorted(settings.PLAYER_BITRATE_STEPS)
+    if bitrate >= steps[-1]:
+        # Client is not constrained
+        return None
+    lower_steps = [step for step in steps if step <= bitrate]
+    return lower_steps[-1] if lower_steps else steps[0]
+
+
+def get_constraints(request):
+    """
+    Returns maximal bitrate and video width of the streams, which fit the client, or None if the client
+    is not constrained. Constraints are quantized by AVLOGUE_PLAYER_BITRATE_STEPS and
+    AVLOGUE_PLAYER_VIEWPORT_WIDTH_STEPS settings.
+
+    :param request:
+    :return: maximal bitrate and maximal video width, any of them can be None
+    :rtype: tuple
+    """
+    # Response depends on the client hints, ClientHintsMiddleware adds them to Vary header
+    request.avlogue_client_hints_used = True
+    hints = get_client_hints(request)
+
+    bitrates = []
+    if hints['save_data']:
+        bitrates.append(settings.PLAYER_SAVE_DATA_MAX_BITRATE)
+    if hints['ect'] in settings.PLAYER_ECT_MAX_BITRATES:
+        bitrates.append(settings.PLAYER_ECT_MAX_BITRATES[hints['ect']])
+    if hints['downlink'] is not None:
+        bitrates.append(int(hints['downlink'] * 1000000 * settings.PLAYER_DOWNLINK_USAGE))
+    max_bitrate = _quantize_bitrate(min(bitrates)) if bitrates else None
+
+    max_width = None
+    if hints['viewport_width'] is not None:
+        # Rounds up, so streams are not scaled up on the client
+        wider_steps = [step for step in sorted(settings.PLAYER_VIEWPORT_WIDTH_STEPS)
+                       if step >= hints['viewport_width']]
+        max_width = wider_steps[0] if wider_steps else None
+
+    if max_bitrate is None and max_width is None:
+        return None
+    return max_bitrate, max_width
+
+
+def order_streams(streams, constraints):
+    """
+    Orders streams for the constrained client: streams, which fit the constraints, from the best to the worst,
+    then other streams from the smallest one. With AVLOGUE_PLAYER_LIMIT_SOURCES streams, which don't fit
+    the constraints, are skipped, but the smallest stream is left if none fits.
+
+    :param streams: list of streams
+    :param constraints: maximal bitrate and video width
+    :type constraints: tuple
+    :return: list of streams
+    :rtype: list
+    """
+    max_bitrate, max_width = constraints
+
+    def fits(stream):
+        if max_bitrate is not None and (stream.bitrate or 0) > max_bitrate:
+            return False
+        width = getattr(stream, 'video_width', None)
+        return max_width is None or width is None or width <= max_width
+
+    fitting_streams = sorted((s for s in streams if fits(s)), key=lambda s: s.bitrate or 0, reverse=True)
+    other_streams = sorted((s for s in streams if not fits(s)), key=lambda s: s.bitrate or 0)
+    if settings.PLAYER_LIMIT_SOURCES:
+        return fitting_streams or other_streams[:1]
+    return fitting_streams + other_streams
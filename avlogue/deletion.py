@@ -0,0 +1,127 @@
+"""
+AVlogue storage files deletion.
+
+With AVLOGUE_ASYNC_DELETION_ENABLED files are not deleted in the request: a PendingDeletion tombstone is created
+for every file in the current transaction, and a celery task deletes the files in batches after the commit.
+Tombstones of the files, which couldn't be deleted, are retried later, run delete_pending_files task periodically
+to retry them and to delete files of the tasks lost by a crash. Files, which are referenced again when the task
+runs (e.g. a replacement saved under the same name by a storage that overwrites files), are not deleted.
+On Django 1.8 the task is queued right away, files of the uncommitted tombstones are deleted by the periodic run.
+"""
+import datetime
+import logging
+from collections import defaultdict
+
+from django.utils.timezone import now
+
+from avlogue import orphans
+from avlogue import settings
+from avlogue import tasks
+from avlogue import utils
+
+logger = logging.getLogger('avlogue')
+
+
+def get_storages():
+    """
+    Returns storages by their keys stored in PendingDeletion.
+    """
+    return {'media': settings.MEDIA_STORAGE, 'streams': settings.MEDIA_STREAMS_STORAGE}
+
+
+def get_storage_key(storage):
+    for key, key_storage in sorted(get_storages().items()):
+        if key_storage is storage:
+            return key
+    raise ValueError('Unknown storage: {}'.format(repr(storage)))
+
+
+def delete_files(storage, names):
+    """
+    Deletes files from the storage, asynchronously after the commit if AVLOGUE_ASYNC_DELETION_ENABLED.
+
+    :param storage: media files or streams storage
+    :param names: file names
+    :type names: list
+    """
+    names = [name for name in names if name]
+    if not names:
+        return
+    if not settings.ASYNC_DELETION_ENABLED:
+        for name in names:
+            storage.delete(name)
+        return
+
+    from avlogue.models import PendingDeletion
+
+    storage_key = get_storage_key(storage)
+    PendingDeletion.objects.bulk_create(PendingDeletion(storage=storage_key, name=name) for name in names)
+    # One task is run per transaction, whatever number of files is deleted in it
+    utils.on_commit_once(tasks.delete_pending_files.delay)
+
+
+def _delete_from_storage(storage, names):
+    """
+    Deletes files by the bulk delete API of the storage if it has one.
+    Returns errors of the files, which haven't been deleted.
+    """
+    if hasattr(storage, 'delete_many'):
+        # Storage bulk delete API, it returns dict of errors by the file names
+        try:
+            return storage.delete_many(names) or {}
+        except Exception as e:
+            return dict((name, str(e)) for name in names)
+
+    errors = {}
+    for name in names:
+        try:
+            storage.delete(name)
+        except Exception as e:
+            errors[name] = str(e)
+    return errors
+
+
+def delete_pending_files():
+    """
+    Deletes files of the due tombstones in batches. Failed deletions are retried with an exponential backoff.
+    Tombstones of the names referenced again are dropped without deleting the files.
+
+    :return: number of deleted files
+    :rtype: int
+    """
+    from avlogue.models import PendingDeletion
+
+    storages = get_storages()
+    deleted_count = 0
+    while True:
+        batch = list(PendingDeletion.objects.filter(next_attempt__lte=now())
+                     .order_by('pk')[:settings.ASYNC_DELETION_BATCH_SIZE])
+        if not batch:
+            break
+
+        referenced = orphans.is_referenced([tombstone.name for tombstone in batch])
+        if referenced:
+            logger.info('Files {} are referenced again, they are not deleted.'.format(', '.join(sorted(referenced))))
+            PendingDeletion.objects.filter(pk__in=[t.pk for t in batch if t.name in referenced]).delete()
+
+        tombstones = defaultdict(list)
+        for tombstone in batch:
+            if tombstone.name not in referenced:
+                tombstones[tombstone.storage].append(tombstone)
+        for storage_key, storage_tombstones in tombstones.items():
+            errors = _delete_from_storage(storages[storage_key], [t.name for t in storage_tombstones])
+            PendingDeletion.objects.filter(pk__in=[t.pk for t in storage_tombstones if t.name not in errors]) \
+                .delete()
+            deleted_count += len(storage_tombstones) - len(errors)
+            for tombstone in storage_tombstones:
+                if tombstone.name in errors:
+                    logger.error('Deletion of {} failed: {}'.format(tombstone.name, errors[tombstone.name]))
+                    tombstone.attempts += 1
+                    tombstone.error = errors[tombstone.name]
+                    tombstone.next_attempt = now() + datetime.timedelta(
+                        seconds=settings.ASYNC_DELETION_RETRY_DELAY * 2 ** min(tombstone.attempts - 1, 10))
+                    tombstone.save(update_fields=['attempts', 'error', 'next_attempt'])
+
+        if len(batch) < settings.ASYNC_DELETION_BATCH_SIZE:
+            break
+    return deleted_count
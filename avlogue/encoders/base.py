@@ -16,7 +16,19 @@ class BaseEncoder(object):
         """
         raise NotImplementedError  # pragma: no cover
 
-    def encode(self, media_file, output_file, encode_format):
+    def probe_headers(self, input_file):
+        """
+        Returns types of the streams found in the beginning of a media file.
+        Used to reject invalid files before the whole file is uploaded.
+
+        :param input_file: beginning of a media file
+        :type input_file: django.core.files.File
+        :return: set of stream types ('video', 'audio') or None if the headers are placed at the end of the file
+        :rtype: set
+        """
+        raise NotImplementedError  # pragma: no cover
+
+    def encode(self, media_file, output_file, encode_format, input_file=None, threads=None):
         """
         Encodes media_file to specified encode_format.
 
@@ -26,6 +38,10 @@ class BaseEncoder(object):
         :type output_file: str
         :param encode_format:
         :type encode_format: avlogue.models.BaseFormat
+        :param input_file: file path to be encoded instead of the media_file file, e.g. mezzanine file
+        :type input_file: str
+        :param threads: number of encoder threads, the encoder picks it itself if it is None
+        :type threads: int
         """
         raise NotImplementedError  # pragma: no cover
 
@@ -39,3 +55,43 @@ class BaseEncoder(object):
         :type output_file: str
         """
         raise NotImplementedError  # pragma: no cover
+
+    def extract_clip(self, input_file, output_file, start, end):
+        """
+        Extracts part of media file between start and end.
+
+        :param input_file: input file path
+        :type input_file: str
+        :param output_file: output file path
+        :type output_file: str
+        :param start: clip start in seconds
+        :type start: float
+        :param end: clip end in seconds
+        :type end: float
+        :return: start and end of the extracted clip, they could be moved to keyframes
+        :rtype: tuple
+        """
+        raise NotImplementedError  # pragma: no cover
+
+    def create_mezzanine(self, input_file, output_file, threads=None):
+        """
+        Encodes media file to a fast-decoding intermediate file.
+
+        :param input_file: input file path
+        :type input_file: str
+        :param output_file: output file path
+        :type output_file: str
+        :param threads: number of encoder threads, the encoder picks it itself if it is None
+        :type threads: int
+        """
+        raise NotImplementedError  # pragma: no cover
+
+    def get_complexity(self, input_file):
+        """
+        Returns complexity of the video, 1.0 is a complexity of a reference content.
+
+        :param input_file: input file path
+        :type input_file: str
+        :rtype: float
+        """
+        raise NotImplementedError  # pragma: no cover
@@ -1,9 +1,16 @@
+import errno
 import json
 import logging
 import os
+import re
 import subprocess
+import threading
+
+from django.utils import six
 
 from avlogue import settings
+from avlogue.encoders import headers
+from avlogue.encoders import process
 from avlogue.encoders.base import BaseEncoder
 from avlogue.encoders.exceptions import GetFileInfoError, EncodeError, CreatePreviewError
 
@@ -36,26 +43,123 @@ class FFMpegEncoder(BaseEncoder):
     FFMpeg encoder.
     """
 
-    def _probe(self, input_file):
+    #: Max distance in seconds between a clip boundary and a keyframe to consider them aligned.
+    keyframe_tolerance = 0.01
+
+    #: ffmpeg profile names of the ffprobe h264 profiles.
+    h264_profiles = {
+        'Baseline': 'baseline',
+        'Constrained Baseline': 'baseline',
+        'Main': 'main',
+        'High': 'high',
+        'High 10': 'high10',
+        'High 4:2:2': 'high422',
+        'High 4:4:4 Predictive': 'high444',
+    }
+
+    def _execute(self, cmd, error_cls, description, operation=process.ENCODE):
+        """
+        Executes command and raises error_cls if it writes errors.
+        :param cmd:
+        :param error_cls:
+        :param description: command description for log messages
+        :param operation: operation of the process policy
+        :return: command output
+        """
+        logger.debug('{} command: {}'.format(description, cmd))
+
+        p = process.popen(cmd, operation, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        output, errors = p.communicate()
+        if errors:
+            logger.error('{} error: {}.\nCommand: {}.'.format(description, errors, cmd))
+            raise error_cls(errors, cmd)
+        return output
+
+    def _probe(self, input_file, strict=True):
         """
         Executes ffprobe to get streams info.
-        :param input_file:
+        :param input_file: file path or file object, file object is fed to ffprobe through a pipe
+        :param strict: raise FFProbeError on any ffprobe error, otherwise only if nothing was probed,
+                       e.g. errors about truncated file are ignored
         :return:
         """
-        cmd = (settings.FFPROBE_EXECUTABLE, input_file, '-loglevel', 'error',
+        is_file_object = not isinstance(input_file, six.string_types)
+        cmd = (settings.FFPROBE_EXECUTABLE, 'pipe:0' if is_file_object else input_file, '-loglevel', 'error',
                '-show_streams', '-show_format', '-print_format', 'json')
 
         logger.debug('ffprobe command: {}'.format(cmd))
 
-        p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        output, errors = p.communicate()
-        if errors:
+        if is_file_object:
+            read_fd, write_fd = os.pipe()
+            try:
+                # Write end of the pipe is inheritable on python 2, ffprobe would never get EOF if it inherited it
+                p = process.popen(cmd, process.PROBE, stdin=read_fd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                  close_fds=True)
+            except OSError:
+                os.close(write_fd)
+                raise
+            finally:
+                os.close(read_fd)
+            writer = threading.Thread(target=self._write_pipe, args=(write_fd, input_file))
+            writer.daemon = True
+            writer.start()
+            output, errors = p.communicate()
+            writer.join()
+        else:
+            p = process.popen(cmd, process.PROBE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            output, errors = p.communicate()
+        if errors and (strict or not output):
             logger.error('ffprobe error: {}.\ncmd={}'.format(errors, cmd))
             raise FFProbeError(errors, cmd)
         if isinstance(output, bytes):
             output = output.decode('utf-8')
         return json.loads(output)
 
+    def _write_pipe(self, fd, input_file):
+        """
+        Writes file chunks into the pipe until ffprobe stops reading or PIPE_PROBE_MAX_SIZE is reached.
+        :param fd: pipe file descriptor, it is closed after writing
+        :param input_file: django File
+        :return:
+        """
+        written = 0
+        max_size = settings.PIPE_PROBE_MAX_SIZE
+        try:
+            for chunk in input_file.chunks():
+                view = memoryview(chunk)[:max_size - written]
+                written += len(view)
+                while view:
+                    view = view[os.write(fd, view):]
+                if written >= max_size:
+                    break
+        except OSError as e:
+            # ffprobe has read the headers and closed the pipe
+            if e.errno != errno.EPIPE:
+                logger.error('ffprobe pipe writing error: {}'.format(e))
+        finally:
+            os.close(fd)
+
+    def probe_headers(self, input_file):
+        """
+        Returns types of the streams found in the beginning of a media file.
+
+        :param input_file: beginning of a media file
+        :type input_file: django.core.files.File
+        :return: set of stream types ('video', 'audio') or None if the headers are placed at the end of the file
+        :rtype: set
+        """
+        input_file.seek(0)
+        data = input_file.read(settings.PIPE_PROBE_MAX_SIZE)
+        input_file.seek(0)
+        if settings.NATIVE_FILE_INFO_ENABLED:
+            info = headers.parse_file_info(data, len(data))
+            if info is not None:
+                return set(t for t in ('video', 'audio') if '{}_codec'.format(t) in info)
+        if headers.needs_file_end(data):
+            return None
+        probe_data = self._probe(input_file, strict=False)
+        return set(s['codec_type'] for s in probe_data.get('streams', [])) & {'video', 'audio'}
+
     def _parse_audio_stream_data(self, stream):
         bit_rate = stream.get('bit_rate')  # NOTE: ffprobe may not return bitrate
         if bit_rate is not None:
@@ -81,16 +185,36 @@ class FFMpegEncoder(BaseEncoder):
 
     def get_file_info(self, input_file, stream_type=None):
         """
-        Executes ffprobe to get information about media file.
+        Returns information about media file. Headers of the supported containers are parsed natively,
+        ffprobe is executed for other files.
 
-        :param input_file: input file path
-        :type input_file: str
+        File objects are probed through a pipe, so formats which need seeking can't be probed this way.
+
+        :param input_file: input file path or django File object
+        :type input_file: str or django.core.files.File
         :param stream_type: returns only data for specified stream type, can be 'video' or 'audio'
         :type stream_type: str
         :return: Dictionary populated with Audio or Video fields
         :rtype: dict
         """
         assert stream_type in (None, 'video', 'audio'), "stream_type can be 'video' or 'audio'"
+        is_file_object = not isinstance(input_file, six.string_types)
+
+        if is_file_object:
+            # NOTE: seek to the end gives the actual size of the file content
+            input_file.seek(0, os.SEEK_END)
+            file_size = input_file.tell()
+            input_file.seek(0)
+
+        if settings.NATIVE_FILE_INFO_ENABLED:
+            if is_file_object:
+                data = input_file.read(settings.PIPE_PROBE_MAX_SIZE)
+                input_file.seek(0)
+                info = headers.parse_file_info(data, file_size, stream_type)
+            else:
+                info = headers.get_file_info(input_file, stream_type)
+            if info is not None:
+                return info
 
         probe_data = self._probe(input_file)
 
@@ -111,8 +235,15 @@ class FFMpegEncoder(BaseEncoder):
             # NOTE: first stream is used
             audio_stream = next(audio_streams, None)
 
+        if is_file_object:
+            # NOTE: ffprobe doesn't know size of the piped file and may not know its duration
+            if 'duration' not in probe_data['format']:
+                raise FFProbeError('Duration of the piped file is unknown.')
+            probe_data['format'].setdefault('size', file_size)
+            probe_data['format'].setdefault('bit_rate', file_size * 8 / float(probe_data['format']['duration']))
+
         info = {
-            'bitrate': int(probe_data['format']['bit_rate']),
+            'bitrate': int(float(probe_data['format']['bit_rate'])),
             'size': int(probe_data['format']['size']),
             'duration': float(probe_data['format']['duration'])
         }
@@ -143,6 +274,11 @@ class FFMpegEncoder(BaseEncoder):
         if encode_format.video_codec_params:
             params.extend(encode_format.video_codec_params.split(' '))
 
+        # Speed preset adapted to the encode queue load, see avlogue.speed_presets
+        speed_preset = getattr(encode_format, 'speed_preset', None)
+        if speed_preset and encode_format.video_codec in settings.VIDEO_SPEED_PRESET_PARAMS:
+            params.extend(settings.VIDEO_SPEED_PRESET_PARAMS[encode_format.video_codec].format(speed_preset).split(' '))
+
         if encode_format.video_bitrate is not None:
             params.extend(('-b:v', str(encode_format.video_bitrate)))
             params.extend(('-maxrate', str(encode_format.video_bitrate)))
@@ -159,7 +295,7 @@ class FFMpegEncoder(BaseEncoder):
                                .format(width=video_width, height=video_height)))
         return params
 
-    def encode(self, media_file, output_file, encode_format):
+    def encode(self, media_file, output_file, encode_format, input_file=None, threads=None):
         """
         Encode media_file to the encode_format with ffmpeg.
 
@@ -169,6 +305,10 @@ class FFMpegEncoder(BaseEncoder):
         :type output_file: str
         :param encode_format: VideoFormat or AudioFormat
         :type encode_format: avlogue.models.BaseFormat
+        :param input_file: file path to be encoded instead of the media_file file, e.g. mezzanine file
+        :type input_file: str
+        :param threads: number of encoder threads, the encoder picks it itself if it is None
+        :type threads: int
 
         :rtype: subprocess.Popen
         """
@@ -177,24 +317,26 @@ class FFMpegEncoder(BaseEncoder):
         if not isinstance(media_file, (Video, Audio)):
             raise TypeError('media_file must be instance of Video or Audio')
 
-        cmd = [settings.FFMPEG_EXECUTABLE, '-y', '-i', media_file.file.path]
+        cmd = [settings.FFMPEG_EXECUTABLE, '-y', '-i', input_file or media_file.file.path]
         cmd.extend(('-loglevel', 'error'))
         if isinstance(media_file, Video):
             containers = settings.VIDEO_CONTAINERS
             cmd.extend(self._get_video_params(encode_format))
-            cmd.extend(('-threads', '0'))
+            cmd.extend(('-threads', str(threads or 0)))
             cmd.extend(self._get_audio_params(encode_format))
 
         elif isinstance(media_file, Audio):
             containers = settings.AUDIO_CONTAINERS
             cmd.extend(self._get_audio_params(encode_format))
+            if threads is not None:
+                cmd.extend(('-threads', str(threads)))
 
         cmd.extend(('-f', containers[encode_format.container]))
         cmd.append(output_file)
 
         logger.debug('ffmpeg encode command: {}'.format(cmd))
 
-        p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        p = process.popen(cmd, process.ENCODE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
         errors = p.communicate()[1]
         if errors:
             logger.error('ffmpeg conversion error: {}.\nEncode format: {}.\n'
@@ -208,6 +350,52 @@ class FFMpegEncoder(BaseEncoder):
             raise FFMpegEncoderError('No output file after conversion.', cmd)
         return p
 
+    def create_mezzanine(self, input_file, output_file, threads=None):
+        """
+        Encodes media file to a fast-decoding intermediate file with ffmpeg.
+
+        :param input_file: input file path
+        :type input_file: str
+        :param output_file: output file path
+        :type output_file: str
+        :param threads: number of encoder threads, the encoder picks it itself if it is None
+        :type threads: int
+        """
+        cmd = [settings.FFMPEG_EXECUTABLE, '-y', '-loglevel', 'error', '-i', input_file]
+        cmd.extend(settings.MEZZANINE_PARAMS.split(' '))
+        cmd.extend(('-threads', str(threads or 0), '-f', 'matroska', output_file))
+        self._execute(cmd, FFMpegEncoderError, 'ffmpeg mezzanine')
+        if not os.path.exists(output_file):
+            raise FFMpegEncoderError('No output file after mezzanine encoding.', cmd)
+
+    def get_complexity(self, input_file):
+        """
+        Returns complexity of the video. Segments of the video are encoded with constant quality
+        and complexity is a ratio of the result bitrate to the reference bitrate.
+
+        :param input_file: input file path
+        :type input_file: str
+        :return: complexity or None if the video has no duration
+        :rtype: float
+        """
+        duration = self.get_file_info(input_file, 'video').get('duration')
+        if not duration or duration <= 0:
+            return None
+        segments_count = settings.COMPLEXITY_SAMPLE_SEGMENTS
+        segment_duration = min(settings.COMPLEXITY_SAMPLE_DURATION, duration / segments_count)
+
+        encoded_size = 0
+        for index in range(segments_count):
+            start = max(0, (index + 0.5) * duration / segments_count - segment_duration / 2)
+            cmd = [settings.FFMPEG_EXECUTABLE, '-loglevel', 'error', '-ss', str(start), '-i', input_file,
+                   '-t', str(segment_duration)]
+            cmd.extend(settings.COMPLEXITY_PROBE_PARAMS.split(' '))
+            cmd.extend(('-f', 'matroska', '-'))
+            encoded_size += len(self._execute(cmd, FFMpegEncoderError, 'ffmpeg complexity probe'))
+
+        bitrate = encoded_size * 8 / (segment_duration * segments_count)
+        return bitrate / settings.COMPLEXITY_REFERENCE_BITRATE
+
     def get_file_preview(self, input_file, output_file):
         """
         Returns preview for media file.
@@ -224,7 +412,7 @@ class FFMpegEncoder(BaseEncoder):
         cmd = [settings.FFMPEG_EXECUTABLE, '-loglevel', 'error', '-i', input_file, '-ss', str(time), '-vframes', '1',
                '-vf', 'scale={}'.format(settings.VIDEO_PREVIEW_SIZE), '-y', output_file]
         logger.debug('ffmpeg file preview command: {}'.format(cmd))
-        p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        p = process.popen(cmd, process.PREVIEW, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
         errors = p.communicate()[1]
         if errors:
             logger.error('ffmpeg creating preview error: {}.'
@@ -236,3 +424,155 @@ class FFMpegEncoder(BaseEncoder):
                          '\nInput file: {}.\nOutput File:{}\nCommand: {}.'.format(input_file, output_file, cmd))
             raise FFMpegCreatePreviewError('No output file after creating preview.', cmd)
         return p
+
+    def _get_keyframes(self, input_file):
+        """
+        Returns sorted timestamps of the first video stream keyframes.
+        Only packets are read, frames are not decoded.
+        :param input_file:
+        :return:
+        """
+        cmd = (settings.FFPROBE_EXECUTABLE, input_file, '-loglevel', 'error', '-select_streams', 'v:0',
+               '-show_entries', 'packet=pts_time,flags', '-print_format', 'json')
+        output = self._execute(cmd, FFProbeError, 'ffprobe keyframes', process.PROBE)
+        if isinstance(output, bytes):
+            output = output.decode('utf-8')
+        packets = json.loads(output).get('packets', [])
+        return sorted(float(packet['pts_time']) for packet in packets
+                      if 'K' in packet.get('flags', '') and packet.get('pts_time', 'N/A') != 'N/A')
+
+    def _cut_segment(self, input_file, output_file, start, end, video_params=None):
+        """
+        Cuts segment of input file. Streams are copied if video_params are not specified,
+        otherwise video is re-encoded with the video_params.
+        :param input_file:
+        :param output_file:
+        :param start:
+        :param end:
+        :param video_params:
+        :return:
+        """
+        cmd = [settings.FFMPEG_EXECUTABLE, '-y', '-loglevel', 'error', '-ss', str(start), '-i', input_file,
+               '-t', str(end - start)]
+        if video_params is None:
+            cmd.extend(('-c', 'copy', '-avoid_negative_ts', 'make_zero'))
+        else:
+            cmd.extend(video_params)
+            cmd.extend(('-c:a', 'copy'))
+        cmd.append(output_file)
+        self._execute(cmd, FFMpegEncoderError, 'ffmpeg clip')
+
+    def _get_segment_video_params(self, input_file, video_library, file_info):
+        """
+        Returns params to re-encode boundary segments, which can be joined with the copied part:
+        source codec, bitrate, profile, pixel format and resolution.
+        :param input_file:
+        :param video_library: encoder library of the source codec
+        :param file_info:
+        :return:
+        """
+        streams = self._probe(input_file).get('streams', [])
+        video_stream = next((stream for stream in streams if stream['codec_type'] == 'video'), {})
+
+        video_params = ['-c:v', video_library]
+        if file_info.get('video_bitrate') is not None:
+            video_params.extend(('-b:v', str(file_info['video_bitrate'])))
+        profile = video_stream.get('profile')
+        if file_info['video_codec'] == 'h264':
+            profile = self.h264_profiles.get(profile)
+        elif profile:
+            # e.g. 'Profile 0' of vp9, 'Main 10' of hevc
+            match = re.match(r'^Profile (\d+)$', profile)
+            profile = match.group(1) if match else profile.lower().replace(' ', '')
+        if profile:
+            video_params.extend(('-profile:v', profile))
+        if video_stream.get('pix_fmt'):
+            video_params.extend(('-pix_fmt', video_stream['pix_fmt']))
+        if video_stream.get('width') and video_stream.get('height'):
+            video_params.extend(('-s', '{}x{}'.format(video_stream['width'], video_stream['height'])))
+        return video_params
+
+    def extract_clip(self, input_file, output_file, start, end):
+        """
+        Extracts clip with ffmpeg.
+        Streams are copied if clip boundaries are aligned with video keyframes. Otherwise only the boundary GOPs
+        are re-encoded with the source video codec, profile, pixel format and resolution and joined with the copied
+        middle part. If the source codec can't be encoded, the clip start is moved to the previous keyframe.
+
+        :param input_file: input file path
+        :type input_file: str
+        :param output_file: output file path
+        :type output_file: str
+        :param start: clip start in seconds
+        :type start: float
+        :param end: clip end in seconds
+        :type end: float
+        :return: start and end of the extracted clip
+        :rtype: tuple
+        """
+        file_info = self.get_file_info(input_file)
+        tolerance = self.keyframe_tolerance
+        end = min(end, file_info['duration'])
+
+        if file_info.get('video_codec') is None:
+            # Audio frames are decoded independently, so audio is always copied
+            self._cut_segment(input_file, output_file, start, end)
+            return start, end
+
+        all_keyframes = self._get_keyframes(input_file)
+        video_library = settings.VIDEO_CODECS.get(file_info['video_codec'])
+        if video_library is None:
+            # Copied video starts with the keyframe preceding the clip start
+            start = max([t for t in all_keyframes if t <= start + tolerance] or [0.0])
+            logger.warning('Unknown video codec {}, clip start of {} is moved to the keyframe {}.'
+                           .format(file_info['video_codec'], input_file, start))
+            self._cut_segment(input_file, output_file, start, end)
+            return start, end
+
+        video_params = self._get_segment_video_params(input_file, video_library, file_info)
+
+        # Only keyframes inside the clip can start or end the copied part
+        keyframes = [t for t in all_keyframes if start - tolerance <= t <= end + tolerance]
+        if not keyframes:
+            self._cut_segment(input_file, output_file, start, end, video_params)
+            return start, end
+        copy_start, copy_end = keyframes[0], keyframes[-1]
+        if abs(copy_start - start) <= tolerance:
+            copy_start = start
+        if abs(copy_end - end) <= tolerance or end >= file_info['duration'] - tolerance:
+            copy_end = end
+        copy_start = min(copy_start, end)
+        copy_end = min(max(copy_start, copy_end), end)
+
+        segments = []
+        if copy_start > start:
+            segments.append((start, copy_start, video_params))
+        if copy_end > copy_start:
+            segments.append((copy_start, copy_end, None))
+        if end > copy_end:
+            segments.append((copy_end, end, video_params))
+
+        if len(segments) == 1:
+            self._cut_segment(input_file, output_file, *segments[0])
+            return start, end
+
+        logger.info('Clip {}-{} of {} is not aligned with keyframes, re-encode {} boundary segments.'
+                    .format(start, end, input_file, len(segments) - 1))
+        list_file = '{}.txt'.format(output_file)
+        segment_files = []
+        try:
+            for index, segment in enumerate(segments):
+                segment_file = '{}.{}.mkv'.format(output_file, index)
+                segment_files.append(segment_file)
+                self._cut_segment(input_file, segment_file, *segment)
+            with open(list_file, 'w') as f:
+                for segment_file in segment_files:
+                    f.write("file '{}'\n".format(segment_file.replace("'", "'\\''")))
+            cmd = [settings.FFMPEG_EXECUTABLE, '-y', '-loglevel', 'error', '-f', 'concat', '-safe', '0',
+                   '-i', list_file, '-c', 'copy', output_file]
+            self._execute(cmd, FFMpegEncoderError, 'ffmpeg clip concat')
+        finally:
+            for file_path in segment_files + [list_file]:
+                if os.path.exists(file_path):
+                    os.remove(file_path)
+        return start, end
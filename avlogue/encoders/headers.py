@@ -0,0 +1,608 @@
+"""
+Pure python parser of media container headers.
+
+MP4, Matroska/WebM and MP3 headers are parsed to get the same information as
+:meth:`avlogue.encoders.ffmpeg.FFMpegEncoder.get_file_info` returns, without running ffprobe.
+None is returned for the files, which are not understood by the parser, so ffprobe can be used instead.
+"""
+import logging
+import mmap
+import os
+import struct
+
+logger = logging.getLogger('avlogue')
+
+#: MP4 sample entry types and codec names.
+MP4_CODECS = {
+    b'avc1': 'h264',
+    b'avc3': 'h264',
+    b'hev1': 'hevc',
+    b'hvc1': 'hevc',
+    b'vp08': 'vp8',
+    b'vp09': 'vp9',
+    b'av01': 'av1',
+    b'mp4v': 'mpeg4',
+    b'ac-3': 'ac3',
+    b'ec-3': 'eac3',
+    b'Opus': 'opus',
+    b'fLaC': 'flac',
+    b'alac': 'alac',
+}
+
+#: MPEG-4 object type indications of 'mp4a' sample entries and codec names.
+MP4_AUDIO_OBJECT_TYPES = {
+    0x40: 'aac',
+    0x66: 'aac',
+    0x67: 'aac',
+    0x68: 'aac',
+    0x69: 'mp3',
+    0x6B: 'mp3',
+}
+
+#: Matroska codec ids and codec names.
+MATROSKA_CODECS = {
+    'V_MPEG4/ISO/AVC': 'h264',
+    'V_MPEGH/ISO/HEVC': 'hevc',
+    'V_MPEG4/ISO/ASP': 'mpeg4',
+    'V_MPEG4/ISO/SP': 'mpeg4',
+    'V_MPEG4/ISO/AP': 'mpeg4',
+    'V_VP8': 'vp8',
+    'V_VP9': 'vp9',
+    'V_AV1': 'av1',
+    'V_THEORA': 'theora',
+    'A_AAC': 'aac',
+    'A_MPEG/L3': 'mp3',
+    'A_VORBIS': 'vorbis',
+    'A_OPUS': 'opus',
+    'A_AC3': 'ac3',
+    'A_EAC3': 'eac3',
+    'A_FLAC': 'flac',
+}
+
+MP3_BITRATES = {
+    # MPEG-1 layer III
+    1: (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    # MPEG-2 and MPEG-2.5 layer III
+    2: (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+
+MP3_SAMPLE_RATES = {
+    3: (44100, 48000, 32000),  # MPEG-1
+    2: (22050, 24000, 16000),  # MPEG-2
+    0: (11025, 12000, 8000),  # MPEG-2.5
+}
+
+EBML_MAGIC = b'\x1a\x45\xdf\xa3'
+EBML_DOC_TYPE = 0x4282
+MATROSKA_SEGMENT = 0x18538067
+MATROSKA_INFO = 0x1549A966
+MATROSKA_TIMECODE_SCALE = 0x2AD7B1
+MATROSKA_DURATION = 0x4489
+MATROSKA_TRACKS = 0x1654AE6B
+MATROSKA_TRACK_ENTRY = 0xAE
+MATROSKA_TRACK_TYPE = 0x83
+MATROSKA_CODEC_ID = 0x86
+MATROSKA_VIDEO = 0xE0
+MATROSKA_PIXEL_WIDTH = 0xB0
+MATROSKA_PIXEL_HEIGHT = 0xBA
+MATROSKA_AUDIO = 0xE1
+MATROSKA_CHANNELS = 0x9F
+MATROSKA_CLUSTER = 0x1F43B675
+
+
+class HeaderParseError(Exception):
+    """
+    Exception, which is raised if headers can't be parsed.
+    """
+
+
+def _uint8(data, offset):
+    return struct.unpack_from('>B', data, offset)[0]
+
+
+def _iter_boxes(data, start, end):
+    """
+    Yields (type, payload start, box end) of MP4 boxes.
+    """
+    offset = start
+    while offset + 8 <= end:
+        size, box_type = struct.unpack_from('>I4s', data, offset)
+        header_size = 8
+        if size == 1:
+            size = struct.unpack_from('>Q', data, offset + 8)[0]
+            header_size = 16
+        elif size == 0:
+            size = end - offset
+        if size < header_size or offset + size > end:
+            raise HeaderParseError('Invalid size of MP4 box {}.'.format(box_type))
+        yield box_type, offset + header_size, offset + size
+        offset += size
+
+
+def _find_box(data, start, end, path):
+    """
+    Returns (payload start, box end) of the first box by the box types path or None.
+    """
+    for box_type, payload_start, box_end in _iter_boxes(data, start, end):
+        if box_type == path[0]:
+            if len(path) == 1:
+                return payload_start, box_end
+            return _find_box(data, payload_start, box_end, path[1:])
+    return None
+
+
+def _get_box(data, start, end, path):
+    box = _find_box(data, start, end, path)
+    if box is None:
+        raise HeaderParseError('MP4 box {} is not found.'.format(path))
+    return box
+
+
+def _read_duration_header(data, start):
+    """
+    Returns (timescale, duration) from mvhd or mdhd box.
+    """
+    if _uint8(data, start) == 1:
+        return struct.unpack_from('>IQ', data, start + 20)
+    return struct.unpack_from('>II', data, start + 12)
+
+
+def _read_descriptor(data, offset):
+    """
+    Returns (tag, payload start) of MPEG-4 descriptor.
+    """
+    tag = _uint8(data, offset)
+    offset += 1
+    for _ in range(4):
+        offset += 1
+        if not _uint8(data, offset - 1) & 0x80:
+            break
+    return tag, offset
+
+
+def _parse_esds(data, start):
+    """
+    Returns (object type indication, channels) from esds box payload.
+    """
+    tag, offset = _read_descriptor(data, start + 4)
+    if tag == 0x03:
+        # ES descriptor
+        flags = _uint8(data, offset + 2)
+        offset += 3
+        if flags & 0x80:
+            offset += 2
+        if flags & 0x40:
+            offset += 1 + _uint8(data, offset)
+        if flags & 0x20:
+            offset += 2
+        tag, offset = _read_descriptor(data, offset)
+    if tag != 0x04:
+        raise HeaderParseError('Decoder config descriptor is not found.')
+    object_type = _uint8(data, offset)
+
+    channels = None
+    tag, offset = _read_descriptor(data, offset + 13)
+    if tag == 0x05 and MP4_AUDIO_OBJECT_TYPES.get(object_type) == 'aac':
+        # Audio specific config: object type (5 bits), frequency index (4 bits), channel configuration (4 bits)
+        config = struct.unpack_from('>H', data, offset)[0]
+        # Explicit frequency (index 15) is not supported, sample entry channels are used then
+        channel_config = None if (config >> 7) & 0x0F == 0x0F else (config >> 3) & 0x0F
+        if channel_config:
+            channels = 8 if channel_config == 7 else channel_config
+    return object_type, channels
+
+
+def _parse_mp4_track(data, start, end):
+    """
+    Returns track info of MP4 trak box or None for non audio/video tracks.
+    """
+    mdia = _get_box(data, start, end, (b'mdia',))
+    hdlr = _get_box(data, mdia[0], mdia[1], (b'hdlr',))
+    handler_type = data[hdlr[0] + 8:hdlr[0] + 12]
+    if handler_type not in (b'vide', b'soun'):
+        return None
+
+    timescale, duration = _read_duration_header(data, _get_box(data, mdia[0], mdia[1], (b'mdhd',))[0])
+    stbl = _get_box(data, mdia[0], mdia[1], (b'minf', b'stbl'))
+
+    stsd = _get_box(data, stbl[0], stbl[1], (b'stsd',))
+    entry_size, sample_entry_type = struct.unpack_from('>I4s', data, stsd[0] + 8)
+    entry_start = stsd[0] + 16
+    entry_end = stsd[0] + 8 + entry_size
+
+    stsz = _get_box(data, stbl[0], stbl[1], (b'stsz',))
+    sample_size, sample_count = struct.unpack_from('>II', data, stsz[0] + 4)
+    if sample_size:
+        data_size = sample_size * sample_count
+    else:
+        data_size = sum(struct.unpack_from('>{}I'.format(sample_count), data, stsz[0] + 12))
+    bitrate = int(round(data_size * 8.0 * timescale / duration)) if duration else None
+
+    if handler_type == b'vide':
+        width, height = struct.unpack_from('>HH', data, entry_start + 24)
+        return {
+            'codec_type': 'video',
+            'video_codec': MP4_CODECS.get(sample_entry_type),
+            'video_bitrate': bitrate,
+            'video_width': width,
+            'video_height': height,
+        }
+
+    sound_version, = struct.unpack_from('>H', data, entry_start + 8)
+    if sound_version not in (0, 1):
+        raise HeaderParseError('Unsupported sound sample entry version {}.'.format(sound_version))
+    channels, = struct.unpack_from('>H', data, entry_start + 16)
+    codec = MP4_CODECS.get(sample_entry_type)
+    if sample_entry_type == b'mp4a':
+        children_start = entry_start + (44 if sound_version == 1 else 28)
+        esds = _get_box(data, children_start, entry_end, (b'esds',))
+        object_type, config_channels = _parse_esds(data, esds[0])
+        codec = MP4_AUDIO_OBJECT_TYPES.get(object_type)
+        channels = config_channels or channels
+    return {
+        'codec_type': 'audio',
+        'audio_codec': codec,
+        'audio_bitrate': bitrate,
+        'audio_channels': channels,
+    }
+
+
+def _parse_mp4(data, size):
+    """
+    Returns (duration, tracks) of MP4 file.
+    """
+    moov = _get_box(data, 0, size, (b'moov',))
+    if _find_box(data, moov[0], moov[1], (b'mvex',)) is not None:
+        raise HeaderParseError('Fragmented MP4 files are not supported.')
+
+    timescale, duration = _read_duration_header(data, _get_box(data, moov[0], moov[1], (b'mvhd',))[0])
+    tracks = []
+    for box_type, start, end in _iter_boxes(data, moov[0], moov[1]):
+        if box_type == b'trak':
+            track = _parse_mp4_track(data, start, end)
+            if track is not None:
+                tracks.append(track)
+    return float(duration) / timescale, tracks
+
+
+def _read_vint(data, offset, keep_marker=False):
+    """
+    Returns (value, end offset, length) of EBML variable size integer.
+    """
+    first = _uint8(data, offset)
+    length = 1
+    mask = 0x80
+    while not first & mask:
+        mask >>= 1
+        length += 1
+        if length > 8:
+            raise HeaderParseError('Invalid EBML variable size integer.')
+    value = first if keep_marker else first & (mask - 1)
+    for i in range(1, length):
+        value = (value << 8) | _uint8(data, offset + i)
+    return value, offset + length, length
+
+
+def _iter_elements(data, start, end):
+    """
+    Yields (id, payload start, element end) of EBML elements.
+    """
+    offset = start
+    while offset < end:
+        element_id, offset, _ = _read_vint(data, offset, keep_marker=True)
+        element_size, offset, length = _read_vint(data, offset)
+        if element_size == (1 << (7 * length)) - 1:
+            # Unknown size
+            element_end = end
+        else:
+            element_end = min(offset + element_size, end)
+        yield element_id, offset, element_end
+        offset = element_end
+
+
+def _read_uint(data, start, end):
+    value = 0
+    for offset in range(start, end):
+        value = (value << 8) | _uint8(data, offset)
+    return value
+
+
+def _read_float(data, start, end):
+    if end - start == 4:
+        return struct.unpack_from('>f', data, start)[0]
+    if end - start == 8:
+        return struct.unpack_from('>d', data, start)[0]
+    raise HeaderParseError('Invalid EBML float size.')
+
+
+def _read_string(data, start, end):
+    return data[start:end].rstrip(b'\x00').decode('ascii')
+
+
+def _parse_matroska_track(data, start, end):
+    """
+    Returns track info of Matroska TrackEntry element or None for non audio/video tracks.
+    """
+    track_type = codec_id = width = height = None
+    channels = 1
+    for element_id, element_start, element_end in _iter_elements(data, start, end):
+        if element_id == MATROSKA_TRACK_TYPE:
+            track_type = _read_uint(data, element_start, element_end)
+        elif element_id == MATROSKA_CODEC_ID:
+            codec_id = _read_string(data, element_start, element_end)
+        elif element_id == MATROSKA_VIDEO:
+            for child_id, child_start, child_end in _iter_elements(data, element_start, element_end):
+                if child_id == MATROSKA_PIXEL_WIDTH:
+                    width = _read_uint(data, child_start, child_end)
+                elif child_id == MATROSKA_PIXEL_HEIGHT:
+                    height = _read_uint(data, child_start, child_end)
+        elif element_id == MATROSKA_AUDIO:
+            for child_id, child_start, child_end in _iter_elements(data, element_start, element_end):
+                if child_id == MATROSKA_CHANNELS:
+                    channels = _read_uint(data, child_start, child_end)
+
+    codec = MATROSKA_CODECS.get(codec_id)
+    if codec is None and codec_id is not None and codec_id.startswith('A_AAC'):
+        codec = 'aac'
+    if track_type == 1:
+        return {
+            'codec_type': 'video',
+            'video_codec': codec,
+            'video_bitrate': None,
+            'video_width': width,
+            'video_height': height,
+        }
+    if track_type == 2:
+        return {
+            'codec_type': 'audio',
+            'audio_codec': codec,
+            'audio_bitrate': None,
+            'audio_channels': channels,
+        }
+    return None
+
+
+def _parse_matroska(data, size):
+    """
+    Returns (duration, tracks) of Matroska/WebM file.
+    """
+    elements = _iter_elements(data, 0, size)
+    element_id, start, end = next(elements)
+    doc_type = None
+    for child_id, child_start, child_end in _iter_elements(data, start, end):
+        if child_id == EBML_DOC_TYPE:
+            doc_type = _read_string(data, child_start, child_end)
+    if doc_type not in ('matroska', 'webm'):
+        raise HeaderParseError('Unsupported EBML document type {}.'.format(doc_type))
+
+    segment = next((element for element in elements if element[0] == MATROSKA_SEGMENT), None)
+    if segment is None:
+        raise HeaderParseError('Matroska segment is not found.')
+
+    timecode_scale = 1000000
+    duration = None
+    tracks = None
+    for element_id, start, end in _iter_elements(data, segment[1], segment[2]):
+        if element_id == MATROSKA_INFO:
+            for child_id, child_start, child_end in _iter_elements(data, start, end):
+                if child_id == MATROSKA_TIMECODE_SCALE:
+                    timecode_scale = _read_uint(data, child_start, child_end)
+                elif child_id == MATROSKA_DURATION:
+                    duration = _read_float(data, child_start, child_end)
+        elif element_id == MATROSKA_TRACKS:
+            tracks = []
+            for child_id, child_start, child_end in _iter_elements(data, start, end):
+                if child_id == MATROSKA_TRACK_ENTRY:
+                    track = _parse_matroska_track(data, child_start, child_end)
+                    if track is not None:
+                        tracks.append(track)
+        elif element_id == MATROSKA_CLUSTER:
+            # Headers are placed before clusters
+            break
+        if duration is not None and tracks is not None:
+            break
+
+    if duration is None or tracks is None:
+        raise HeaderParseError('Matroska info or tracks are not found before clusters.')
+    return duration * timecode_scale / 1e9, tracks
+
+
+def _parse_mp3_frame_header(data, offset):
+    """
+    Returns MPEG audio layer III frame header info.
+    """
+    b0, b1, b2, b3 = struct.unpack_from('>4B', data, offset)
+    if b0 != 0xFF or b1 & 0xE0 != 0xE0:
+        raise HeaderParseError('Invalid MPEG audio frame sync.')
+    version = (b1 >> 3) & 0x03
+    layer = (b1 >> 1) & 0x03
+    bitrate_index = b2 >> 4
+    sample_rate_index = (b2 >> 2) & 0x03
+    if version == 1 or layer != 1 or bitrate_index in (0, 15) or sample_rate_index == 3:
+        raise HeaderParseError('Only MPEG audio layer III with constant frame bitrate is supported.')
+
+    bitrate = MP3_BITRATES[1 if version == 3 else 2][bitrate_index] * 1000
+    sample_rate = MP3_SAMPLE_RATES[version][sample_rate_index]
+    samples = 1152 if version == 3 else 576
+    channels = 1 if b3 >> 6 == 3 else 2
+    if version == 3:
+        side_info_size = 17 if channels == 1 else 32
+    else:
+        side_info_size = 9 if channels == 1 else 17
+    return {
+        'bitrate': bitrate,
+        'sample_rate': sample_rate,
+        'samples': samples,
+        'channels': channels,
+        'side_info_size': side_info_size,
+        'frame_size': samples // 8 * bitrate // sample_rate + ((b2 >> 1) & 0x01),
+    }
+
+
+def _find_mp3_frame(data, start, size):
+    """
+    Returns (offset, header) of the first MP3 frame, which is followed by another frame.
+    """
+    offset = data.find(b'\xff', start, min(start + 65536, size))
+    while offset != -1 and offset + 4 <= size:
+        try:
+            header = _parse_mp3_frame_header(data, offset)
+            next_offset = offset + header['frame_size']
+            if next_offset + 4 > size or _parse_mp3_frame_header(data, next_offset):
+                return offset, header
+        except HeaderParseError:
+            pass
+        offset = data.find(b'\xff', offset + 1, min(start + 65536, size))
+    raise HeaderParseError('MPEG audio frame is not found.')
+
+
+def _parse_mp3(data, size, stream_type):
+    """
+    Returns (duration, tracks) of MP3 file.
+    """
+    offset = 0
+    if data[0:3] == b'ID3':
+        major_version, flags = struct.unpack_from('>BxB', data, 3)
+        tag_size = 0
+        for byte in struct.unpack_from('>4B', data, 6):
+            tag_size = (tag_size << 7) | (byte & 0x7F)
+        offset = 10 + tag_size + (10 if flags & 0x10 else 0)
+        # ffprobe returns attached pictures as video streams
+        picture_frame = b'PIC' if major_version == 2 else b'APIC'
+        if stream_type in (None, 'video') and data.find(picture_frame, 10, offset) != -1:
+            raise HeaderParseError('MP3 files with attached pictures are not supported.')
+
+    offset, header = _find_mp3_frame(data, offset, size)
+    bitrate = header['bitrate']
+
+    frames = data_size = None
+    is_cbr = True
+    xing_offset = offset + 4 + header['side_info_size']
+    if data[xing_offset:xing_offset + 4] in (b'Xing', b'Info'):
+        flags, = struct.unpack_from('>I', data, xing_offset + 4)
+        field_offset = xing_offset + 8
+        if flags & 0x01:
+            frames, = struct.unpack_from('>I', data, field_offset)
+            field_offset += 4
+        if flags & 0x02:
+            data_size, = struct.unpack_from('>I', data, field_offset)
+        is_cbr = data[xing_offset:xing_offset + 4] == b'Info'
+    elif data[offset + 36:offset + 40] == b'VBRI':
+        data_size, frames = struct.unpack_from('>II', data, offset + 46)
+        is_cbr = False
+
+    if frames:
+        duration = frames * header['samples'] / float(header['sample_rate'])
+        if data_size and not is_cbr:
+            bitrate = int(round(data_size * 8.0 * header['sample_rate'] / (frames * header['samples'])))
+    else:
+        audio_end = size - 128 if size >= 128 and data[size - 128:size - 125] == b'TAG' else size
+        duration = (audio_end - offset) * 8.0 / bitrate
+
+    return duration, [{
+        'codec_type': 'audio',
+        'audio_codec': 'mp3',
+        'audio_bitrate': bitrate,
+        'audio_channels': header['channels'],
+    }]
+
+
+def parse_file_info(data, size, stream_type=None):
+    """
+    Returns information about media file parsed from its headers.
+
+    :param data: file content, e.g. bytes or mmap object
+    :param size: file size
+    :type size: int
+    :param stream_type: returns only data for specified stream type, can be 'video' or 'audio'
+    :type stream_type: str
+    :return: Dictionary populated with Audio or Video fields or None if file headers are not supported
+    :rtype: dict
+    """
+    try:
+        if data[4:8] in (b'ftyp', b'moov'):
+            duration, tracks = _parse_mp4(data, size)
+        elif data[0:4] == EBML_MAGIC:
+            duration, tracks = _parse_matroska(data, size)
+        elif data[0:3] == b'ID3' or data[0:1] == b'\xff':
+            duration, tracks = _parse_mp3(data, size, stream_type)
+        else:
+            return None
+
+        if not duration:
+            raise HeaderParseError('Unknown duration.')
+        info = {
+            'bitrate': int(size * 8 / duration),
+            'size': size,
+            'duration': duration,
+        }
+        for codec_type in ('video', 'audio'):
+            if stream_type not in (None, codec_type):
+                continue
+            # NOTE: first stream is used
+            track = next((t for t in tracks if t['codec_type'] == codec_type), None)
+            if track is not None:
+                if None in (track.get('{}_codec'.format(codec_type)), track.get('video_width', 0),
+                            track.get('video_height', 0), track.get('audio_channels', 0)):
+                    raise HeaderParseError('Incomplete {} stream info.'.format(codec_type))
+                info.update((key, value) for key, value in track.items() if key != 'codec_type')
+        return info
+    except (HeaderParseError, struct.error, IndexError, KeyError, ValueError, StopIteration,
+            UnicodeDecodeError) as e:
+        logger.debug('Media file headers parsing error: {}'.format(e))
+        return None
+
+
+def needs_file_end(data):
+    """
+    Returns True if data is the beginning of MP4 file, which moov box is placed after the media data,
+    so the file can't be probed without its end.
+
+    :param data: beginning of the file
+    :rtype: bool
+    """
+    if data[4:8] not in (b'ftyp', b'moov'):
+        return False
+    offset = 0
+    try:
+        while offset + 8 <= len(data):
+            size, box_type = struct.unpack_from('>I4s', data, offset)
+            if box_type == b'moov':
+                return False
+            if box_type == b'mdat':
+                return True
+            if size == 1:
+                size = struct.unpack_from('>Q', data, offset + 8)[0]
+            if size < 8:
+                return False
+            offset += size
+    except struct.error:
+        pass
+    return True
+
+
+def get_file_info(input_file, stream_type=None):
+    """
+    Returns information about media file parsed from its headers.
+    File is memory-mapped, so only the headers are read from disk.
+
+    :param input_file: input file path
+    :type input_file: str
+    :param stream_type: returns only data for specified stream type, can be 'video' or 'audio'
+    :type stream_type: str
+    :return: Dictionary populated with Audio or Video fields or None if file headers are not supported
+    :rtype: dict
+    """
+    try:
+        with open(input_file, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if not size:
+                return None
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                return parse_file_info(data, size, stream_type)
+            finally:
+                data.close()
+    except (IOError, OSError, ValueError) as e:
+        logger.debug('Media file headers reading error: {}'.format(e))
+        return None
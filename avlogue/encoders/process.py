@@ -0,0 +1,165 @@
+"""
+Encoder child processes.
+
+All encoder commands are started by popen, which applies AVLOGUE_PROCESS_POLICIES of the operation to the child
+process before the command is executed: nice level, IO scheduling class, CPU affinity and resource limits.
+So interactive probes stay fast while batch encodes use the idle capacity of the host.
+preexec_fn is not safe in the presence of threads, e.g. in the batch encodes, so the policy is applied by nice,
+ionice, taskset and prlimit utilities wrapping the command when other threads are running.
+Policies, which cannot be applied because a utility is not installed, are logged as warnings.
+"""
+import ctypes
+import ctypes.util
+import logging
+import os
+import platform
+import resource
+import subprocess
+import threading
+
+from avlogue import settings
+
+logger = logging.getLogger('avlogue')
+
+#: Operations of the encoder commands.
+PROBE = 'probe'
+ENCODE = 'encode'
+PREVIEW = 'preview'
+
+IOPRIO_CLASSES = {
+    'realtime': 1,
+    'best-effort': 2,
+    'idle': 3,
+}
+IOPRIO_CLASS_SHIFT = 13
+IOPRIO_WHO_PROCESS = 1
+
+# ioprio_set system call numbers by machine, there is no libc wrapper for it
+IOPRIO_SET_SYSCALLS = {
+    'x86_64': 251,
+    'i386': 289,
+    'i686': 289,
+    'aarch64': 30,
+    'armv7l': 314,
+    'ppc64le': 273,
+}
+
+
+def _get_ioprio_set():
+    syscall_number = IOPRIO_SET_SYSCALLS.get(platform.machine())
+    libc_name = ctypes.util.find_library('c')
+    if syscall_number is None or libc_name is None:
+        return None
+    libc = ctypes.CDLL(libc_name, use_errno=True)
+
+    def ioprio_set(ioprio):
+        return libc.syscall(syscall_number, IOPRIO_WHO_PROCESS, 0, ioprio)
+    return ioprio_set
+
+
+def get_preexec_fn(operation):
+    """
+    Returns function, which applies the process policy of the operation in the child process,
+    or None if the operation has no policy.
+
+    Policy keys:
+
+    * nice - niceness increment
+    * ionice - IO scheduling class: 'realtime', 'best-effort' or 'idle'
+    * ionice_level - IO priority level of 'realtime' and 'best-effort' classes, 0 (highest) - 7
+    * cpu_affinity - list of CPUs
+    * rlimit_as - maximal size of the address space in bytes
+    * rlimit_cpu - maximal CPU time in seconds
+
+    :param operation: PROBE, ENCODE or PREVIEW
+    :type operation: str
+    :rtype: callable
+    """
+    policy = settings.PROCESS_POLICIES.get(operation)
+    if not policy:
+        return None
+
+    # Everything is prepared in the parent process, only system calls are made in the child process
+    ioprio_set = None
+    ioprio = None
+    if policy.get('ionice') is not None:
+        ioprio_set = _get_ioprio_set()
+        ioprio = (IOPRIO_CLASSES[policy['ionice']] << IOPRIO_CLASS_SHIFT) | policy.get('ionice_level', 4)
+    cpu_affinity = policy.get('cpu_affinity')
+    if not hasattr(os, 'sched_setaffinity'):
+        cpu_affinity = None
+    rlimits = [(limit, policy[key]) for key, limit in (('rlimit_as', resource.RLIMIT_AS),
+                                                      ('rlimit_cpu', resource.RLIMIT_CPU))
+               if policy.get(key) is not None]
+    nice = policy.get('nice')
+
+    def preexec_fn():
+        if nice:
+            os.nice(nice)
+        if ioprio_set is not None:
+            ioprio_set(ioprio)
+        if cpu_affinity:
+            os.sched_setaffinity(0, cpu_affinity)
+        for limit, value in rlimits:
+            resource.setrlimit(limit, (value, value))
+    return preexec_fn
+
+
+def _find_wrapper(utility, operation, keys):
+    if settings.which(utility):
+        return True
+    logger.warning('{} is not installed, process policy {} of {} commands is not applied.'.format(
+        utility, ', '.join(keys), operation))
+    return False
+
+
+def get_wrapper_command(operation):
+    """
+    Returns command, which applies the process policy of the operation to the wrapped command by nice, ionice,
+    taskset and prlimit utilities. Policy keys of the utilities, which are not installed, are skipped with a warning.
+
+    :param operation: PROBE, ENCODE or PREVIEW
+    :type operation: str
+    :rtype: list
+    """
+    policy = settings.PROCESS_POLICIES.get(operation)
+    if not policy:
+        return []
+
+    command = []
+    if policy.get('nice') and _find_wrapper('nice', operation, ['nice']):
+        command.extend(('nice', '-n', str(policy['nice'])))
+    if policy.get('ionice') is not None and _find_wrapper('ionice', operation, ['ionice']):
+        command.extend(('ionice', '-c', str(IOPRIO_CLASSES[policy['ionice']])))
+        if policy['ionice'] != 'idle':
+            command.extend(('-n', str(policy.get('ionice_level', 4))))
+    if policy.get('cpu_affinity') and _find_wrapper('taskset', operation, ['cpu_affinity']):
+        command.extend(('taskset', '-c', ','.join(str(cpu) for cpu in policy['cpu_affinity'])))
+    rlimit_keys = [key for key in ('rlimit_as', 'rlimit_cpu') if policy.get(key) is not None]
+    if rlimit_keys and _find_wrapper('prlimit', operation, rlimit_keys):
+        command.append('prlimit')
+        command.extend('--{}={}'.format(key[len('rlimit_'):], policy[key]) for key in rlimit_keys)
+    return command
+
+
+def popen(cmd, operation, **kwargs):
+    """
+    Starts the command with the process policy of the operation.
+
+    :param cmd: command
+    :param operation: PROBE, ENCODE or PREVIEW
+    :type operation: str
+    :param kwargs: subprocess.Popen kwargs
+    :rtype: subprocess.Popen
+    """
+    if threading.active_count() > 1:
+        # Child process could deadlock in preexec_fn on a lock held by another thread
+        wrapper_command = get_wrapper_command(operation)
+        if wrapper_command:
+            cmd = wrapper_command + list(cmd)
+        return subprocess.Popen(cmd, **kwargs)
+
+    preexec_fn = get_preexec_fn(operation)
+    if preexec_fn is not None:
+        kwargs['preexec_fn'] = preexec_fn
+    return subprocess.Popen(cmd, **kwargs)
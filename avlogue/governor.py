@@ -0,0 +1,165 @@
+"""
+AVlogue encode governor.
+
+Limits the number of the stream conversions running in the cluster, on a worker host and by formats and codecs,
+and gives every conversion an explicit number of encoder threads, so hosts are not oversubscribed by bursts
+of uploads. Cluster wide slots are kept in AVLOGUE_GOVERNOR_CACHE_ALIAS cache, without the cache the slots are
+local to the host and are held by locked files, which are released by the OS if the worker crashes.
+"""
+import errno
+import fcntl
+import multiprocessing
+import os
+import uuid
+from contextlib import contextmanager
+
+from django.core.cache import caches
+from django.utils.text import slugify
+
+from avlogue import settings
+
+
+class GovernorBusy(Exception):
+    """
+    Exception, which is raised if there is no free conversion slot.
+    """
+
+
+class CacheSemaphore(object):
+    """
+    Semaphore of the slots kept in the cache. Slots are added atomically by cache.add and expire
+    after AVLOGUE_GOVERNOR_SLOT_TIMEOUT.
+    """
+
+    def __init__(self, name, limit, cache):
+        self.name = name
+        self.limit = limit
+        self.cache = cache
+        self.key = None
+        self.token = uuid.uuid4().hex
+
+    def acquire(self):
+        for index in range(self.limit):
+            key = 'avlogue:governor:{}:{}'.format(slugify(self.name), index)
+            if self.cache.add(key, self.token, settings.GOVERNOR_SLOT_TIMEOUT):
+                self.key = key
+                return True
+        return False
+
+    def release(self):
+        if self.key is not None and self.cache.get(self.key) == self.token:
+            self.cache.delete(self.key)
+        self.key = None
+
+
+class FileSemaphore(object):
+    """
+    Semaphore of the slots held by locked files of the host.
+    """
+
+    def __init__(self, name, limit):
+        self.name = name
+        self.limit = limit
+        self.file = None
+
+    def acquire(self):
+        if not os.path.exists(settings.GOVERNOR_PATH):
+            try:
+                os.makedirs(settings.GOVERNOR_PATH)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+        for index in range(self.limit):
+            slot_file = open(os.path.join(settings.GOVERNOR_PATH, '{}_{}.lock'.format(slugify(self.name), index)), 'a')
+            try:
+                fcntl.flock(slot_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except (IOError, OSError) as e:
+                slot_file.close()
+                if e.errno not in (errno.EAGAIN, errno.EACCES):
+                    raise
+                continue
+            self.file = slot_file
+            return True
+        return False
+
+    def release(self):
+        if self.file is not None:
+            fcntl.flock(self.file, fcntl.LOCK_UN)
+            self.file.close()
+        self.file = None
+
+
+def get_worker_cpus():
+    return settings.GOVERNOR_WORKER_CPUS or multiprocessing.cpu_count()
+
+
+def get_threads():
+    """
+    Returns number of the encoder threads of a conversion.
+
+    :rtype: int
+    """
+    return max(1, get_worker_cpus() // settings.GOVERNOR_WORKER_ENCODES)
+
+
+def get_quotas(encode_format):
+    """
+    Returns names and limits of the quotas of the format.
+
+    :param encode_format:
+    :type encode_format: avlogue.models.BaseFormat
+    :rtype: list
+    """
+    keys = ['format:{}'.format(encode_format.name)]
+    for codec in (getattr(encode_format, 'video_codec', None), encode_format.audio_codec):
+        if codec:
+            keys.append('codec:{}'.format(codec))
+    return [(key, settings.GOVERNOR_QUOTAS[key]) for key in keys if key in settings.GOVERNOR_QUOTAS]
+
+
+def get_semaphores(encode_format):
+    """
+    Returns semaphores to be acquired by a conversion to the format.
+
+    :param encode_format:
+    :type encode_format: avlogue.models.BaseFormat
+    :rtype: list
+    """
+    # Worker slots are always local to the host
+    semaphores = [FileSemaphore('worker', settings.GOVERNOR_WORKER_ENCODES)]
+    limits = get_quotas(encode_format)
+    if settings.GOVERNOR_GLOBAL_LIMIT is not None:
+        limits.insert(0, ('global', settings.GOVERNOR_GLOBAL_LIMIT))
+    for name, limit in limits:
+        if settings.GOVERNOR_CACHE_ALIAS is not None:
+            semaphores.append(CacheSemaphore(name, limit, caches[settings.GOVERNOR_CACHE_ALIAS]))
+        else:
+            semaphores.append(FileSemaphore(name, limit))
+    return semaphores
+
+
+@contextmanager
+def encode_slot(encode_format):
+    """
+    Acquires slots of a conversion to the format and returns number of the encoder threads.
+    Slots are released on exit. None is returned if the governor is disabled, the encoder picks threads itself then.
+
+    :param encode_format:
+    :type encode_format: avlogue.models.BaseFormat
+    :rtype: int
+    :raises GovernorBusy: there is no free slot
+    """
+    if not settings.GOVERNOR_ENABLED:
+        yield None
+        return
+
+    acquired = []
+    try:
+        for semaphore in get_semaphores(encode_format):
+            if not semaphore.acquire():
+                raise GovernorBusy('No free {} slot for {}.'.format(semaphore.name, encode_format))
+            acquired.append(semaphore)
+        yield get_threads()
+    finally:
+        for semaphore in reversed(acquired):
+            semaphore.release()
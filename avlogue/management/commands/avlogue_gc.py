@@ -0,0 +1,41 @@
+"""
+Deletes orphaned files of AVlogue storages and old temporary files.
+"""
+from __future__ import unicode_literals
+
+from django.core.management.base import BaseCommand
+from django.template.defaultfilters import filesizeformat
+
+from avlogue import orphans
+
+
+class Command(BaseCommand):
+    help = 'Deletes storage files, which are not referenced by media files and streams, and old temporary files.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', dest='dry_run', default=False,
+                            help='Only list orphaned files.')
+        parser.add_argument('--min-age', type=float, dest='min_age', default=24,
+                            help='Minimal age in hours of the deleted files, 24 by default.')
+        parser.add_argument('--chunk-size', type=int, dest='chunk_size', default=10000,
+                            help='Number of rows loaded by a database query.')
+        parser.add_argument('--skip-temp', action='store_true', dest='skip_temp', default=False,
+                            help="Don't delete old temporary files.")
+
+    def handle(self, *args, **options):
+        min_age = int(options['min_age'] * 60 * 60)
+        dry_run = options['dry_run']
+        collections = [('storage', orphans.collect_storage_orphans(min_age, dry_run, options['chunk_size']))]
+        if not options['skip_temp']:
+            collections.append(('temporary', orphans.collect_temp_orphans(min_age, dry_run)))
+
+        for title, collection in collections:
+            count = reclaimed = 0
+            for name, size in collection:
+                count += 1
+                reclaimed += size
+                if options['verbosity'] > 1:
+                    self.stdout.write('{} ({})'.format(name, filesizeformat(size)))
+            self.stdout.write('{} {} files: {}, {} {}.'.format(
+                'Found' if dry_run else 'Deleted', title, count, 'reclaimable' if dry_run else 'reclaimed',
+                filesizeformat(reclaimed)))
@@ -0,0 +1,46 @@
+"""
+Relocates files of the existing media files and streams to the directories of AVLOGUE_STORAGE_LAYOUT setting.
+"""
+from django.core.management.base import BaseCommand
+
+from avlogue import orphans
+from avlogue import relocation
+from avlogue import settings
+from avlogue import tasks
+
+
+class Command(BaseCommand):
+    help = 'Relocates files of the media files and streams to the directories of AVLOGUE_STORAGE_LAYOUT setting.'
+
+    def add_arguments(self, parser):
+        model_names = [model._meta.model_name for model, field_names in orphans.get_file_fields()]
+        parser.add_argument('--model', choices=model_names, dest='model',
+                            help='Relocate files of the model only.')
+        parser.add_argument('--start-pk', type=int, dest='start_pk', default=0,
+                            help='Resume relocation of the model after the pk.')
+        parser.add_argument('--batch-size', type=int, dest='batch_size', default=settings.RELOCATION_BATCH_SIZE,
+                            help='Number of rows relocated by a batch.')
+        parser.add_argument('--background', action='store_true', dest='background', default=False,
+                            help='Relocate files by celery tasks.')
+
+    def handle(self, *args, **options):
+        for model, field_names in orphans.get_file_fields():
+            model_name = model._meta.model_name
+            if options['model'] is not None and options['model'] != model_name:
+                continue
+            last_pk = options['start_pk'] if options['model'] is not None else 0
+
+            if options['background']:
+                tasks.relocate_files.delay(model, field_names, last_pk, options['batch_size'])
+                self.stdout.write('{}: relocation is queued.'.format(model_name))
+                continue
+
+            total_count = 0
+            while last_pk is not None:
+                last_pk, relocated_count = relocation.relocate_batch(model, field_names, last_pk,
+                                                                     options['batch_size'])
+                total_count += relocated_count
+                if last_pk is not None and options['verbosity'] > 1:
+                    # Relocation can be resumed with --model and --start-pk
+                    self.stdout.write('{}: relocated {} files, last pk {}.'.format(model_name, total_count, last_pk))
+            self.stdout.write('{}: relocated {} files.'.format(model_name, total_count))
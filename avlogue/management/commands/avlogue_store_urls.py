@@ -0,0 +1,34 @@
+"""
+Stores file urls of the existing media files and streams if AVLOGUE_STORE_FILE_URLS is enabled, otherwise clears them.
+"""
+from django.core.management.base import BaseCommand
+
+from avlogue import orphans
+from avlogue import settings
+
+
+class Command(BaseCommand):
+    help = 'Stores file urls of the media files and streams, or clears them if AVLOGUE_STORE_FILE_URLS is disabled.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, dest='chunk_size', default=1000,
+                            help='Number of rows loaded by a database query.')
+
+    def handle(self, *args, **options):
+        from avlogue import models
+
+        for model, field_names in orphans.get_file_fields():
+            storage = model._meta.get_field('file').storage
+            updated_count = 0
+            last_pk = 0
+            while last_pk is not None:
+                instances = list(model.objects.filter(pk__gt=last_pk).order_by('pk')[:options['chunk_size']])
+                for instance in instances:
+                    url = storage.url(instance.file.name) if settings.STORE_FILE_URLS and instance.file.name else None
+                    if url != instance.url:
+                        model.objects.filter(pk=instance.pk).update(url=url)
+                        # Signals are not sent by the queryset update
+                        models.invalidate_player_cache(model, instance)
+                        updated_count += 1
+                last_pk = instances[-1].pk if len(instances) == options['chunk_size'] else None
+            self.stdout.write('{}: updated {} urls.'.format(model._meta.model_name, updated_count))
@@ -3,10 +3,10 @@ import os
 import six
 from django.core import files
 from django.db import models
+from django.db.models import Prefetch
 from django.utils.text import slugify
 
 from avlogue import utils
-from avlogue.encoders import default_encoder
 
 
 class BaseMediaFileQuerySet(models.QuerySet):
@@ -14,12 +14,13 @@ class BaseMediaFileQuerySet(models.QuerySet):
     Base media file queryset.
     """
 
-    def create_from_file(self, file, title=None, slug=None):
+    def create_from_file(self, file, title=None, slug=None, **kwargs):
         """
         Creates video and fills fields with metadata.
         :param file: django.core.files.File or file path
         :param title:
         :param slug:
+        :param kwargs: additional model fields
         :return:
         """
         if isinstance(file, six.string_types):
@@ -31,15 +32,49 @@ class BaseMediaFileQuerySet(models.QuerySet):
             # Skips video stream info
             stream_type = 'audio'
 
-        with utils.get_local_file_path(file) as file_path:
-            file_info = default_encoder.get_file_info(file_path, stream_type=stream_type)
+        file_info = utils.get_file_info(file, stream_type=stream_type)
 
         if title is None:
             title = os.path.basename(file.name)[0:50]
         if slug is None:
             slug = slugify(title)
 
-        return self.create(file=file, title=title, slug=slug, **file_info)
+        kwargs.update(file_info)
+        return self.create(file=file, title=title, slug=slug, **kwargs)
+
+    def with_playable_streams(self, formats=None, format_sets=None):
+        """
+        Prefetches successfully converted streams with their formats and format sets names,
+        so avlogue_player tag filters the streams without additional queries.
+        Only the stream columns needed by the player are loaded.
+
+        :param formats: names of formats to prefetch the streams of, list or comma separated string
+        :param format_sets: names of format sets to prefetch the streams of, list or comma separated string
+        :return:
+        """
+        stream_model = self.model._meta.get_field('streams').related_model
+        format_model = stream_model._meta.get_field('format').related_model
+        format_set_model = format_model._meta.get_field('format_sets').related_model
+
+        streams = stream_model.objects.playable()
+        format_names = utils.split_names(formats)
+        if format_names is not None:
+            streams = streams.filter(format__name__in=format_names)
+        format_set_names = utils.split_names(format_sets)
+        if format_set_names is not None:
+            streams = streams.filter(format__format_sets__name__in=format_set_names).distinct()
+        fields = ['id', 'media_file', 'file', 'content_type', 'url', 'bitrate', 'status', 'format', 'format__id',
+                  'format__name']
+        from avlogue.models import VideoFields
+        if issubclass(stream_model, VideoFields):
+            # Video width is used to order the player sources by the client hints
+            fields.append('video_width')
+        streams = streams.select_related('format').only(*fields).order_by('pk')
+        # Format sets are prefetched by an outer lookup, Django < 1.10 runs prefetches nested in the streams
+        # queryset twice
+        return self.prefetch_related(
+            Prefetch('streams', queryset=streams),
+            Prefetch('streams__format__format_sets', queryset=format_set_model.objects.only('id', 'name')))
 
 
 class VideoQuerySet(BaseMediaFileQuerySet):
@@ -52,3 +87,16 @@ class AudioQuerySet(BaseMediaFileQuerySet):
     """
     Audio queryset.
     """
+
+
+class StreamQuerySet(models.QuerySet):
+    """
+    Stream queryset.
+    """
+
+    def playable(self):
+        """
+        Returns successfully converted streams.
+        Filtering of them by media file and bitrate is covered by the (media_file, status, bitrate) index.
+        """
+        return self.filter(status=self.model.CONVERSION_SUCCESSFUL)
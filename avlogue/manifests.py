@@ -0,0 +1,115 @@
+"""
+AVlogue stream manifests.
+
+Manifest is a compact JSON file with the playable streams of a media file. Manifests are written to the streams
+storage, so players can be loaded from a CDN by avlogue/js/player_loader.js without Django requests.
+"""
+import json
+import logging
+import os
+
+from django.core.files.base import ContentFile
+
+from avlogue import settings
+
+logger = logging.getLogger('avlogue')
+
+
+def get_manifest_name(media_file):
+    """
+    Returns storage name of the media file manifest.
+
+    :param media_file:
+    :type media_file: avlogue.models.MediaFile
+    :rtype: str
+    """
+    return os.path.join(settings.MANIFESTS_DIR, media_file._meta.model_name, '{}.json'.format(media_file.pk))
+
+
+def get_manifest_url(media_file):
+    """
+    Returns url of the media file manifest.
+
+    :param media_file:
+    :type media_file: avlogue.models.MediaFile
+    :rtype: str
+    """
+    return settings.MEDIA_STREAMS_STORAGE.url(get_manifest_name(media_file))
+
+
+def _get_file_fields(obj):
+    from avlogue.models import AudioFields, VideoFields
+
+    fields = {
+        'url': obj.public_url,
+        'content_type': obj.content_type,
+        'bitrate': obj.bitrate,
+    }
+    if isinstance(obj, VideoFields):
+        fields.update(video_codec=obj.video_codec, video_bitrate=obj.video_bitrate,
+                      width=obj.video_width, height=obj.video_height)
+    if isinstance(obj, (AudioFields, VideoFields)):
+        fields.update(audio_codec=obj.audio_codec, audio_bitrate=obj.audio_bitrate,
+                      audio_channels=obj.audio_channels)
+    return fields
+
+
+def build_manifest(media_file):
+    """
+    Returns manifest of the media file with its playable streams.
+
+    :param media_file:
+    :type media_file: avlogue.models.MediaFile
+    :rtype: dict
+    """
+    from avlogue.models import Video
+
+    manifest = {
+        'id': media_file.pk,
+        'type': media_file._meta.model_name,
+        'title': media_file.title,
+        'duration': media_file.duration,
+    }
+    manifest.update(_get_file_fields(media_file))
+    if isinstance(media_file, Video):
+        manifest['preview'] = media_file.preview.url if media_file.preview.name else None
+
+    streams = []
+    for stream in media_file.streams.playable().select_related('format').order_by('pk'):
+        stream_fields = _get_file_fields(stream)
+        stream_fields['format'] = stream.format.name
+        streams.append(stream_fields)
+    manifest['streams'] = streams
+    return manifest
+
+
+def write_manifest(media_file):
+    """
+    Writes manifest of the media file to the streams storage.
+
+    :param media_file:
+    :type media_file: avlogue.models.MediaFile
+    :return: manifest storage name
+    :rtype: str
+    """
+    name = get_manifest_name(media_file)
+    content = json.dumps(build_manifest(media_file), separators=(',', ':'), sort_keys=True)
+    storage = settings.MEDIA_STREAMS_STORAGE
+    # Manifest url must not be changed, so the old manifest is deleted instead of saving the new one with a new name
+    if storage.exists(name):
+        storage.delete(name)
+    storage.save(name, ContentFile(content.encode('utf-8')))
+    logger.info('Write manifest of {}: {}'.format(repr(media_file), name))
+    return name
+
+
+def delete_manifest(media_file):
+    """
+    Deletes manifest of the media file.
+
+    :param media_file:
+    :type media_file: avlogue.models.MediaFile
+    """
+    name = get_manifest_name(media_file)
+    if settings.MEDIA_STREAMS_STORAGE.exists(name):
+        settings.MEDIA_STREAMS_STORAGE.delete(name)
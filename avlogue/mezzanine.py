@@ -0,0 +1,199 @@
+"""
+AVlogue mezzanine files.
+
+Mezzanine file is a fast-decoding intermediate copy of a source video, which is expensive to decode.
+It is created once per source and is used as input by all stream conversion tasks of the source.
+Tasks don't wait for a mezzanine file being created by another task, MezzanineBusy is raised, so they are requeued.
+Failed creation is recorded, so other tasks of the source use the source file instead of retrying it.
+Estimated size of the mezzanine file is reserved in the scratch ledger during the creation, so the creation is
+postponed by ScratchSpaceError like the conversions if there is not enough free space.
+"""
+import errno
+import logging
+import os
+import time
+
+from django.utils.text import slugify
+
+from avlogue import scratch
+from avlogue import settings
+from avlogue.encoders import default_encoder
+from avlogue.encoders.exceptions import EncodeError
+
+logger = logging.getLogger('avlogue')
+
+
+class MezzanineBusy(Exception):
+    """
+    Mezzanine file is being created by another task.
+    """
+
+
+def needs_mezzanine(media_file):
+    """
+    Returns True if media file is a video, which is expensive to decode.
+
+    :param media_file:
+    :type media_file: avlogue.models.MediaFile
+    :rtype: bool
+    """
+    from avlogue.models import Video
+
+    if not settings.MEZZANINE_ENABLED or not isinstance(media_file, Video):
+        return False
+    if media_file.video_codec in settings.MEZZANINE_SOURCE_CODECS:
+        return True
+    return (media_file.video_width or 0) * (media_file.video_height or 0) >= settings.MEZZANINE_SOURCE_MIN_PIXELS
+
+
+def estimate_size(media_file):
+    """
+    Returns estimated size of the mezzanine file of the media file or None if it can't be estimated.
+
+    :param media_file:
+    :type media_file: avlogue.models.MediaFile
+    :return: size in bytes
+    :rtype: int
+    """
+    if media_file.duration is None:
+        return None
+    video_bitrate = (media_file.video_width or 0) * (media_file.video_height or 0) * settings.MEZZANINE_PIXEL_BITRATE
+    audio_bitrate = scratch.PCM_CHANNEL_BITRATE * (media_file.audio_channels or 2)
+    return int(media_file.duration * (video_bitrate + audio_bitrate) / 8 * scratch.SIZE_MARGIN)
+
+
+def get_mezzanine_path(media_file):
+    """
+    Returns mezzanine file path of the media file.
+    Path depends on the source file name, so it is changed when the media file is changed.
+
+    :param media_file:
+    :type media_file: avlogue.models.MediaFile
+    :rtype: str
+    """
+    file_name = os.path.splitext(os.path.basename(media_file.file.name))[0]
+    file_name = '{}_{}_{}.mkv'.format(media_file._meta.model_name, media_file.pk, slugify(file_name))
+    return os.path.join(settings.MEZZANINE_PATH, file_name)
+
+
+def _lock(lock_path):
+    """
+    Creates lock file. Returns False if the lock file already exists.
+    """
+    try:
+        os.close(os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+        return False
+    return True
+
+
+def _get_failed_path(mezzanine_path):
+    return '{}.failed'.format(mezzanine_path)
+
+
+def _create_mezzanine(media_file, mezzanine_path, threads=None):
+    """
+    Creates mezzanine file. Returns source file path if mezzanine file can't be created.
+    """
+    logger.info('Create mezzanine file for: {}'.format(repr(media_file)))
+    temp_path = '{}.part'.format(mezzanine_path)
+    ledger_path, reservation_id = scratch.reserve_space(estimate_size(media_file), path=settings.MEZZANINE_PATH)
+    try:
+        default_encoder.create_mezzanine(media_file.file.path, temp_path, threads=threads)
+        os.rename(temp_path, mezzanine_path)
+    except EncodeError as e:
+        logger.error('Mezzanine file creation for {} failed, source file is used instead.\nException:\n{}'
+                     .format(repr(media_file), str(e)))
+        # Tasks waiting for the mezzanine file use the source file
+        open(_get_failed_path(mezzanine_path), 'w').close()
+        return media_file.file.path
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        scratch.release_space(ledger_path, reservation_id)
+    return mezzanine_path
+
+
+def get_input_file(media_file, threads=None):
+    """
+    Returns path of the file to be encoded: mezzanine file path if the media file needs it,
+    otherwise media file path. Mezzanine file is created if it does not exist yet.
+
+    :param media_file:
+    :type media_file: avlogue.models.MediaFile
+    :param threads: number of encoder threads of the mezzanine file creation
+    :type threads: int
+    :rtype: str
+    :raises MezzanineBusy: mezzanine file is being created by another task
+    :raises avlogue.scratch.ScratchSpaceError: there is not enough free space for the mezzanine file
+    """
+    if not needs_mezzanine(media_file):
+        return media_file.file.path
+
+    if not os.path.exists(settings.MEZZANINE_PATH):
+        try:
+            os.makedirs(settings.MEZZANINE_PATH)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+    mezzanine_path = get_mezzanine_path(media_file)
+    lock_path = '{}.lock'.format(mezzanine_path)
+    if not os.path.exists(mezzanine_path):
+        if os.path.exists(_get_failed_path(mezzanine_path)):
+            return media_file.file.path
+        if _lock(lock_path):
+            try:
+                return _create_mezzanine(media_file, mezzanine_path, threads)
+            finally:
+                os.remove(lock_path)
+        try:
+            lock_age = time.time() - os.path.getmtime(lock_path)
+        except OSError:
+            # Mezzanine file has been created meanwhile
+            lock_age = 0
+        if lock_age > settings.MEZZANINE_LOCK_TIMEOUT:
+            logger.warning('Mezzanine file {} was not created in time, source file is used instead.'
+                           .format(mezzanine_path))
+            return media_file.file.path
+        if not os.path.exists(mezzanine_path):
+            raise MezzanineBusy('Mezzanine file {} is being created by another task.'.format(mezzanine_path))
+
+    # Retention period is counted from the last usage
+    os.utime(mezzanine_path, None)
+    return mezzanine_path
+
+
+def delete_expired_mezzanines():
+    """
+    Deletes mezzanine files which were not used during the retention period
+    and files left by the failed tasks.
+
+    :return: deleted file paths
+    :rtype: list
+    """
+    deleted_files = []
+    if not os.path.exists(settings.MEZZANINE_PATH):
+        return deleted_files
+
+    now = time.time()
+    for file_name in os.listdir(settings.MEZZANINE_PATH):
+        file_path = os.path.join(settings.MEZZANINE_PATH, file_name)
+        if file_name == scratch.LEDGER_NAME:
+            continue
+        if file_name.endswith(('.lock', '.part', '.failed')):
+            retention = settings.MEZZANINE_LOCK_TIMEOUT
+        else:
+            retention = settings.MEZZANINE_RETENTION
+        try:
+            if now - os.path.getmtime(file_path) > retention:
+                os.remove(file_path)
+                deleted_files.append(file_path)
+        except OSError:
+            # File was deleted by another process
+            continue
+    if deleted_files:
+        logger.info('Deleted expired mezzanine files: {}'.format(deleted_files))
+    return deleted_files
@@ -0,0 +1,19 @@
+"""
+AVlogue middleware.
+"""
+from django.utils.cache import patch_vary_headers
+
+from avlogue import client_hints
+
+
+class ClientHintsMiddleware(object):
+    """
+    Asks browsers to send client hints, which are used to order the player sources, by Accept-CH header.
+    Responses with players ordered by the client hints vary on them.
+    """
+
+    def process_response(self, request, response):
+        response['Accept-CH'] = ', '.join(client_hints.CLIENT_HINTS)
+        if getattr(request, 'avlogue_client_hints_used', False):
+            patch_vary_headers(response, client_hints.CLIENT_HINTS)
+        return response
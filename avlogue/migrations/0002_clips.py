@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.7 on 2026-10-19 10:12
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('avlogue', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='audio',
+            name='clip_end',
+            field=models.FloatField(blank=True, null=True, verbose_name='clip end'),
+        ),
+        migrations.AddField(
+            model_name='audio',
+            name='clip_start',
+            field=models.FloatField(blank=True, null=True, verbose_name='clip start'),
+        ),
+        migrations.AddField(
+            model_name='audio',
+            name='parent',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='clips', to='avlogue.Audio', verbose_name='source media file'),
+        ),
+        migrations.AddField(
+            model_name='video',
+            name='clip_end',
+            field=models.FloatField(blank=True, null=True, verbose_name='clip end'),
+        ),
+        migrations.AddField(
+            model_name='video',
+            name='clip_start',
+            field=models.FloatField(blank=True, null=True, verbose_name='clip start'),
+        ),
+        migrations.AddField(
+            model_name='video',
+            name='parent',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='clips', to='avlogue.Video', verbose_name='source media file'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.7 on 2026-10-19 11:02
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('avlogue', '0002_clips'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='video',
+            name='complexity',
+            field=models.FloatField(blank=True, help_text='Content complexity, 1.0 is a complexity of the reference content.', null=True, verbose_name='complexity'),
+        ),
+        migrations.AddField(
+            model_name='videostream',
+            name='target_video_bitrate',
+            field=models.PositiveIntegerField(blank=True, help_text='Format video bitrate adapted to the video complexity.', null=True, verbose_name='target video bitrate'),
+        ),
+    ]
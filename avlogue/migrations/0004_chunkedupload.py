@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.7 on 2026-10-19 12:14
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('avlogue', '0003_complexity'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChunkedUpload',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('upload_id', models.UUIDField(default=uuid.uuid4, editable=False, unique=True, verbose_name='upload id')),
+                ('media_type', models.CharField(choices=[('audio', 'audio'), ('video', 'video')], max_length=5, verbose_name='media type')),
+                ('file_name', models.CharField(max_length=255, verbose_name='file name')),
+                ('title', models.CharField(blank=True, max_length=50, verbose_name='title')),
+                ('size', models.BigIntegerField(verbose_name='size')),
+                ('offset', models.BigIntegerField(default=0, verbose_name='offset')),
+                ('chunks', models.TextField(blank=True, editable=False, help_text='Storage names of the received chunks, one per line.', verbose_name='chunks')),
+                ('headers_checked', models.BooleanField(default=False, verbose_name='headers checked')),
+                ('status', models.IntegerField(choices=[(0, 'In progress'), (1, 'Processing'), (2, 'Completed'), (3, 'Failure')], default=0, verbose_name='upload status')),
+                ('error', models.TextField(blank=True, verbose_name='error')),
+                ('media_file_id', models.PositiveIntegerField(blank=True, null=True, verbose_name='media file id')),
+                ('created', models.DateTimeField(default=django.utils.timezone.now, verbose_name='created')),
+                ('modified', models.DateTimeField(auto_now=True, verbose_name='modified')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL, verbose_name='user')),
+            ],
+            options={
+                'verbose_name': 'chunked upload',
+            },
+        ),
+    ]
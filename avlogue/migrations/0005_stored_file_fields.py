@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.7 on 2026-10-19 14:20
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+from avlogue.mime import mimetypes
+
+
+def fill_content_types(apps, schema_editor):
+    """
+    Fills content types of the existing media files and streams from the stored names.
+    Urls are not filled here, they are read from the storages until avlogue_store_urls command is run.
+    """
+    for model_name in ('Audio', 'Video', 'AudioStream', 'VideoStream'):
+        model = apps.get_model('avlogue', model_name)
+        for pk, name in model.objects.exclude(file='').exclude(file=None).values_list('pk', 'file').iterator():
+            model.objects.filter(pk=pk).update(content_type=mimetypes.guess_type(name)[0])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('avlogue', '0004_chunkedupload'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='audio',
+            name='content_type',
+            field=models.CharField(db_index=True, editable=False, max_length=100, null=True, verbose_name='content type'),
+        ),
+        migrations.AddField(
+            model_name='audio',
+            name='url',
+            field=models.CharField(editable=False, help_text='Stored if AVLOGUE_STORE_FILE_URLS is enabled.', max_length=500, null=True, verbose_name='file url'),
+        ),
+        migrations.AddField(
+            model_name='audiostream',
+            name='content_type',
+            field=models.CharField(db_index=True, editable=False, max_length=100, null=True, verbose_name='content type'),
+        ),
+        migrations.AddField(
+            model_name='audiostream',
+            name='url',
+            field=models.CharField(editable=False, help_text='Stored if AVLOGUE_STORE_FILE_URLS is enabled.', max_length=500, null=True, verbose_name='file url'),
+        ),
+        migrations.AddField(
+            model_name='video',
+            name='content_type',
+            field=models.CharField(db_index=True, editable=False, max_length=100, null=True, verbose_name='content type'),
+        ),
+        migrations.AddField(
+            model_name='video',
+            name='url',
+            field=models.CharField(editable=False, help_text='Stored if AVLOGUE_STORE_FILE_URLS is enabled.', max_length=500, null=True, verbose_name='file url'),
+        ),
+        migrations.AddField(
+            model_name='videostream',
+            name='content_type',
+            field=models.CharField(db_index=True, editable=False, max_length=100, null=True, verbose_name='content type'),
+        ),
+        migrations.AddField(
+            model_name='videostream',
+            name='url',
+            field=models.CharField(editable=False, help_text='Stored if AVLOGUE_STORE_FILE_URLS is enabled.', max_length=500, null=True, verbose_name='file url'),
+        ),
+        migrations.RunPython(fill_content_types, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.7 on 2026-10-19 14:45
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('avlogue', '0005_stored_file_fields'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='audiostream',
+            index_together=set([('media_file', 'status', 'bitrate'), ('status', 'created')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='videostream',
+            index_together=set([('media_file', 'status', 'bitrate'), ('status', 'created')]),
+        ),
+    ]
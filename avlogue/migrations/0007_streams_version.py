@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.7 on 2026-10-19 15:10
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('avlogue', '0006_stream_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='audio',
+            name='streams_modified',
+            field=models.DateTimeField(editable=False, null=True, verbose_name='streams modified'),
+        ),
+        migrations.AddField(
+            model_name='audio',
+            name='streams_version',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Incremented on any change of the streams.', verbose_name='streams version'),
+        ),
+        migrations.AddField(
+            model_name='video',
+            name='streams_modified',
+            field=models.DateTimeField(editable=False, null=True, verbose_name='streams modified'),
+        ),
+        migrations.AddField(
+            model_name='video',
+            name='streams_version',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Incremented on any change of the streams.', verbose_name='streams version'),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.7 on 2026-10-19 17:10
+from __future__ import unicode_literals
+
+import avlogue.utils
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('avlogue', '0008_pendingdeletion'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='audio',
+            name='file',
+            field=models.FileField(upload_to=avlogue.utils.UploadTo('avlogue/audio'), validators=[avlogue.utils.ContentTypeValidator(('audio/.*',), message='Only audio files are allowed.')], verbose_name='audio file'),
+        ),
+        migrations.AlterField(
+            model_name='audiostream',
+            name='file',
+            field=models.FileField(upload_to=avlogue.utils.UploadTo('avlogue/audio/streams'), verbose_name='stream file'),
+        ),
+        migrations.AlterField(
+            model_name='video',
+            name='file',
+            field=models.FileField(upload_to=avlogue.utils.UploadTo('avlogue/video'), validators=[avlogue.utils.ContentTypeValidator(('video/.*',), message='Only video files are allowed.')], verbose_name='video file'),
+        ),
+        migrations.AlterField(
+            model_name='video',
+            name='preview',
+            field=models.FileField(blank=True, null=True, upload_to=avlogue.utils.UploadTo('avlogue/video'), verbose_name='video preview'),
+        ),
+        migrations.AlterField(
+            model_name='videostream',
+            name='file',
+            field=models.FileField(upload_to=avlogue.utils.UploadTo('avlogue/video/streams'), verbose_name='stream file'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.7 on 2026-10-19 18:20
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('avlogue', '0009_upload_to_layout'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='videoformat',
+            name='deadline_class',
+            field=models.CharField(choices=[('urgent', 'urgent'), ('normal', 'normal'), ('relaxed', 'relaxed')], default='normal', help_text='Urgent formats use faster speed presets at a lower queue load.', max_length=10, verbose_name='deadline class'),
+        ),
+        migrations.AddField(
+            model_name='videoformat',
+            name='video_speed_presets',
+            field=models.CharField(blank=True, help_text='Comma separated encoder speed presets from the slowest to the fastest one, e.g. "slow,medium,fast,veryfast". Faster presets are used when the encode queue is long.', max_length=200, verbose_name='video speed presets'),
+        ),
+        migrations.AddField(
+            model_name='videostream',
+            name='speed_preset',
+            field=models.CharField(blank=True, editable=False, help_text='Encoder speed preset used for the conversion.', max_length=50, null=True, verbose_name='speed preset'),
+        ),
+    ]
@@ -1,24 +1,34 @@
 """
 AVlogue models.
 """
+import copy
 import logging
 import os
+import threading
+import uuid
 
 from celery.result import AsyncResult
+from django.conf import settings as django_settings
 from django.core.exceptions import ValidationError
 from django.core.files import File
 from django.db import models
 from django.dispatch import receiver
-from django.template.loader import render_to_string
 from django.utils.six import python_2_unicode_compatible
+from django.utils.text import slugify
 from django.utils.timezone import now
 from django.utils.translation import ugettext_lazy as _
 
+from avlogue import batching
+from avlogue import deletion
 from avlogue import managers
+from avlogue import manifests
+from avlogue import player_cache
+from avlogue import scratch
 from avlogue import settings
+from avlogue import speed_presets
 from avlogue import tasks
 from avlogue.encoders import default_encoder
-from avlogue.encoders.exceptions import GetFileInfoError
+from avlogue.encoders.exceptions import EncodeError, GetFileInfoError
 from avlogue.mime import mimetypes
 from avlogue import utils
 
@@ -74,6 +84,18 @@ class MetaDataFields(models.Model):
         abstract = True
 
 
+class StoredFileFields(models.Model):
+    """
+    File fields computed on save, so they can be read without storage calls.
+    """
+    content_type = models.CharField(_('content type'), max_length=100, null=True, editable=False, db_index=True)
+    url = models.CharField(_('file url'), max_length=500, null=True, editable=False,
+                           help_text=_('Stored if AVLOGUE_STORE_FILE_URLS is enabled.'))
+
+    class Meta:
+        abstract = True
+
+
 @python_2_unicode_compatible
 class BaseFormat(models.Model):
     """
@@ -119,6 +141,14 @@ class VideoFormat(BaseFormat, VideoFields):
         default='scale',
         help_text=_('Aspect mode is only used if both video width and height sizes are specified,'
                     'otherwise aspect mode will be ignored.'))
+    video_speed_presets = models.CharField(_('video speed presets'), max_length=200, blank=True,
+                                           help_text=_('Comma separated encoder speed presets from the slowest '
+                                                       'to the fastest one, e.g. "slow,medium,fast,veryfast". '
+                                                       'Faster presets are used when the encode queue is long.'))
+    deadline_class = models.CharField(_('deadline class'), max_length=10, default='normal',
+                                      choices=(('urgent', _('urgent')), ('normal', _('normal')),
+                                               ('relaxed', _('relaxed'))),
+                                      help_text=_('Urgent formats use faster speed presets at a lower queue load.'))
 
     class Meta:
         verbose_name = _('video format')
@@ -150,6 +180,14 @@ class VideoFormatSet(BaseFormatSet):
     formats = models.ManyToManyField(VideoFormat, verbose_name=_('formats'), related_name='format_sets')
 
 
+DEFERRED_FILE = object()
+
+
+def _get_file_name(value):
+    # Value is a name loaded from the database, File or FieldFile
+    return getattr(value, 'name', value)
+
+
 class FileChangedMixin(object):
     """
     Mixin adds logic to check whether file was changed and to update info.
@@ -157,13 +195,27 @@ class FileChangedMixin(object):
     def __init__(self, *args, **kwargs):
         super(FileChangedMixin, self).__init__(*args, **kwargs)
         if self.pk is not None:
-            self._old_file = self.file
+            # Raw file name is read from the instance dict, so FieldFile is not created for every loaded instance
+            self._old_file_name = _get_file_name(self.__dict__.get('file', DEFERRED_FILE))
         else:
-            self._old_file = None
+            self._old_file_name = None
+
+    @property
+    def old_file_name(self):
+        """
+        Returns file name, which has been loaded from the database or saved last time.
+        """
+        if self._old_file_name is DEFERRED_FILE:
+            self._old_file_name = self.__class__._base_manager.filter(pk=self.pk) \
+                .values_list('file', flat=True).first()
+        return self._old_file_name
 
     @property
     def file_changed(self):
-        return self._old_file != self.file
+        if self._old_file_name is DEFERRED_FILE and 'file' not in self.__dict__:
+            # Deferred file has been neither loaded nor changed
+            return False
+        return self.old_file_name != _get_file_name(self.file)
 
     def clear_fields(self):
         fields = []
@@ -179,10 +231,9 @@ class FileChangedMixin(object):
     def update_file_info(self):
         if self.file.name:
             stream_type = 'audio' if isinstance(self, (Audio, AudioStream)) else None
-            with utils.get_local_file_path(self.file.file) as file_path:
-                file_info = default_encoder.get_file_info(file_path, stream_type=stream_type)
-                for field_name, value in file_info.items():
-                    setattr(self, field_name, value)
+            file_info = utils.get_file_info(self.file.file, stream_type=stream_type)
+            for field_name, value in file_info.items():
+                setattr(self, field_name, value)
         else:
             self.clear_fields()
 
@@ -194,13 +245,49 @@ class FileChangedMixin(object):
             except GetFileInfoError:
                 raise ValidationError("Can't get information about media file.")
 
+    def update_content_type(self):
+        if self.file.name:
+            self.content_type = mimetypes.guess_type(self.file.name)[0]
+        else:
+            self.content_type = None
+
+    def update_url(self):
+        """
+        Updates stored file url. The file name is final only after the file is saved to the storage,
+        so the url is updated with an additional query.
+        """
+        url = None
+        if settings.STORE_FILE_URLS and self.file.name:
+            url = self.file.url
+        if url != self.url:
+            self.url = url
+            self.__class__.objects.filter(pk=self.pk).update(url=url)
+
+    @property
+    def public_url(self):
+        """
+        Returns file url, the stored one if it is available.
+        """
+        if self.url is not None:
+            return self.url
+        if self.file.name:
+            return self.file.url
+
     def save(self, *args, **kwargs):
+        file_changed = self.file_changed
+        if file_changed:
+            self.update_content_type()
+            update_fields = kwargs.get('update_fields')
+            if update_fields is not None and 'file' in update_fields:
+                kwargs['update_fields'] = list(update_fields) + ['content_type']
         super(FileChangedMixin, self).save(*args, **kwargs)
-        self._old_file = self.file
+        if file_changed:
+            self.update_url()
+        self._old_file_name = self.file.name
 
 
 @python_2_unicode_compatible
-class MediaFile(FileChangedMixin, MetaDataFields):
+class MediaFile(FileChangedMixin, MetaDataFields, StoredFileFields):
     """
     Base media file model.
     """
@@ -210,20 +297,63 @@ class MediaFile(FileChangedMixin, MetaDataFields):
     description = models.TextField(_('description'), blank=True)
     date_added = models.DateTimeField(_('date published'), default=now)
 
+    parent = models.ForeignKey('self', verbose_name=_('source media file'), null=True, blank=True,
+                               on_delete=models.SET_NULL, related_name='clips')
+    clip_start = models.FloatField(_('clip start'), null=True, blank=True)
+    clip_end = models.FloatField(_('clip end'), null=True, blank=True)
+    streams_version = models.PositiveIntegerField(_('streams version'), default=0, editable=False,
+                                                  help_text=_('Incremented on any change of the streams.'))
+    streams_modified = models.DateTimeField(_('streams modified'), null=True, editable=False)
+
     def format_has_lower_quality(self, encode_format):
         raise NotImplementedError  # pragma: no cover
 
+    def get_output_key(self, encode_format):
+        """
+        Returns key of the stream, which will be produced by encoding of the media file to encode_format.
+        Formats with equal keys produce the same streams.
+        """
+        raise NotImplementedError  # pragma: no cover
+
+    def prune_formats(self, encode_formats):
+        """
+        Returns formats to be used for conversion of the media file.
+        Formats with higher quality than media file and formats, which would produce the same stream
+        as one of the previous formats, are skipped.
+
+        :param encode_formats: list of media file formats
+        :type encode_formats: list
+        :return: list of formats
+        :rtype: list
+        """
+        formats = []
+        output_keys = {}
+        for encode_format in encode_formats:
+            if not self.format_has_lower_quality(encode_format):
+                logger.info('Skip format {} for {}: format has higher quality than media file.'
+                            .format(repr(encode_format), repr(self)))
+                continue
+            output_key = self.get_output_key(encode_format)
+            if output_key in output_keys:
+                logger.info('Skip format {} for {}: stream would be the same as for format {}.'
+                            .format(repr(encode_format), repr(self), repr(output_keys[output_key])))
+                continue
+            output_keys[output_key] = encode_format
+            formats.append(encode_format)
+        return formats
+
     def convert(self, encode_formats):
         """
         Converts media file to specified formats.
-        If one of formats has higher quality than media file, then such format will be skipped.
+        If one of formats has higher quality than media file or would produce the same stream as another format,
+        then such format will be skipped.
 
         :param encode_formats: list of media file formats
         :type encode_formats: list
         :return: list with streams
         :rtype: list
         """
-        encode_formats = list(filter(self.format_has_lower_quality, encode_formats))
+        encode_formats = self.prune_formats(encode_formats)
         streams = []
         stream_cls = self.streams.model
         for encode_format in encode_formats:
@@ -243,10 +373,10 @@ class MediaFile(FileChangedMixin, MetaDataFields):
         all_streams_formats = list(map(lambda s: s.format, self.streams.all()))
         if all_streams_formats:
             # Formats to be updated
-            formats_to_be_updated = list(filter(self.format_has_lower_quality, all_streams_formats))
+            formats_to_be_updated = self.prune_formats(all_streams_formats)
             logger.info('Update streams: {}'.format(formats_to_be_updated))
 
-            # Formats with higher quality should be deleted
+            # Formats with higher quality and duplicated formats should be deleted
             formats_to_be_deleted = list(set(all_streams_formats) - set(formats_to_be_updated))
             logger.info('Delete streams: {}'.format(formats_to_be_deleted))
             for stream in self.streams.filter(format__in=formats_to_be_deleted).all():
@@ -255,24 +385,66 @@ class MediaFile(FileChangedMixin, MetaDataFields):
             return self.convert(formats_to_be_updated)
         return []
 
+    def create_clip(self, start, end, title=None, slug=None):
+        """
+        Creates a new media file from the part of the current one between start and end.
+        The clip is cut without re-encoding where it is possible and is converted to the formats
+        of the current media file streams.
+
+        :param start: clip start in seconds
+        :type start: float
+        :param end: clip end in seconds
+        :type end: float
+        :param title: clip title
+        :param slug: clip slug
+        :return: clip media file
+        :rtype: MediaFile
+        """
+        if self.duration is not None:
+            end = min(end, self.duration)
+        if start < 0 or start >= end:
+            raise ValueError('Clip start must be positive and less than clip end.')
+
+        file_name, ext = os.path.splitext(os.path.basename(self.file.name))
+        output_filename = '{}_clip_{}_{}{}'.format(file_name, slugify('{:g}'.format(start)),
+                                                   slugify('{:g}'.format(end)), ext)
+        if title is None:
+            title = '{} [{:g}-{:g}]'.format(self.title[0:30], start, end)
+
+        # Clip is cut without re-encoding, so its size is proportional to its duration
+        estimated_size = None
+        if self.size and self.duration:
+            estimated_size = int(self.size * (end - start) / self.duration * scratch.SIZE_MARGIN)
+
+        logger.info('Create clip {}-{} of: {}'.format(start, end, repr(self)))
+        with scratch.scratch_directory(estimated_size) as scratch_dir:
+            output_file = os.path.join(scratch_dir, output_filename)
+            # Boundaries are stored as they have been cut, they could be moved to keyframes
+            clip_start, clip_end = default_encoder.extract_clip(self.file.path, output_file, start, end)
+            clip = self.__class__.objects.create_from_file(output_file, title=title, slug=slug, parent=self,
+                                                           clip_start=clip_start, clip_end=clip_end)
+
+        clip.convert([stream.format for stream in self.streams.all()])
+        return clip
+
     def save(self, *args, **kwargs):
         """
         Updates streams if file has been changed.
         """
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            # Streams version is changed by queryset updates only, so its possibly stale value is refreshed
+            versions = self.__class__.objects.filter(pk=self.pk) \
+                .values_list('streams_version', 'streams_modified').first()
+            if versions is not None:
+                self.streams_version, self.streams_modified = versions
         file_changed = self.file_changed
         super(MediaFile, self).save(*args, **kwargs)
         if file_changed:
             self.update_streams()
 
-    @property
-    def content_type(self):
-        if self.file.name:
-            return mimetypes.guess_type(self.file.url)[0]
-
     def html_block(self):
-        from avlogue.templatetags.avlogue_tags import avlogue_player
-        context = avlogue_player(self)
-        return render_to_string('avlogue/player_tag.html', context)
+        from avlogue.templatetags.avlogue_tags import render_player
+        return render_player(self)
 
     def __str__(self):
         return self.title
@@ -287,8 +459,8 @@ class Audio(MediaFile, AudioFields):
     """
     objects = managers.AudioQuerySet.as_manager()
 
-    file = models.FileField(_('audio file'), upload_to=settings.AUDIO_DIR, storage=settings.MEDIA_STORAGE,
-                            validators=[audio_file_validator])
+    file = models.FileField(_('audio file'), upload_to=utils.UploadTo(settings.AUDIO_DIR),
+                            storage=settings.MEDIA_STORAGE, validators=[audio_file_validator])
 
     def format_has_lower_quality(self, encode_format):
         """
@@ -302,6 +474,17 @@ class Audio(MediaFile, AudioFields):
         bitrate = self.audio_bitrate or self.bitrate
         return bitrate >= (encode_format.audio_bitrate or 0)
 
+    def get_output_key(self, encode_format):
+        """
+        Returns key of the stream, which will be produced by encoding of the audio to encode_format.
+
+        :param encode_format:
+        :type encode_format: AudioFormat
+        :rtype: tuple
+        """
+        return (encode_format.container, encode_format.audio_codec, encode_format.audio_bitrate,
+                encode_format.audio_channels, encode_format.audio_codec_params)
+
 
 class Video(MediaFile, VideoFields):
     """
@@ -309,11 +492,13 @@ class Video(MediaFile, VideoFields):
     """
     objects = managers.VideoQuerySet.as_manager()
 
-    file = models.FileField(_('video file'), upload_to=settings.VIDEO_DIR, storage=settings.MEDIA_STORAGE,
-                            validators=[video_file_validator])
+    file = models.FileField(_('video file'), upload_to=utils.UploadTo(settings.VIDEO_DIR),
+                            storage=settings.MEDIA_STORAGE, validators=[video_file_validator])
 
-    preview = models.FileField(_('video preview'), upload_to=settings.VIDEO_DIR, storage=settings.MEDIA_STORAGE,
-                               null=True, blank=True)
+    preview = models.FileField(_('video preview'), upload_to=utils.UploadTo(settings.VIDEO_DIR),
+                               storage=settings.MEDIA_STORAGE, null=True, blank=True)
+    complexity = models.FloatField(_('complexity'), null=True, blank=True,
+                                   help_text=_('Content complexity, 1.0 is a complexity of the reference content.'))
 
     def admin_thumbnail(self):
         if self.preview:
@@ -333,38 +518,132 @@ class Video(MediaFile, VideoFields):
         """
         audio_bitrate = self.audio_bitrate or self.bitrate
         video_bitrate = self.video_bitrate or self.bitrate
+        if audio_bitrate < (encode_format.audio_bitrate or 0) or video_bitrate < (encode_format.video_bitrate or 0):
+            return False
+
+        # Skip upscaling
+        output_width, output_height = self.get_output_resolution(encode_format)
+        if self.video_width and output_width and output_width > self.video_width:
+            return False
+        if self.video_height and output_height and output_height > self.video_height:
+            return False
+        return True
+
+    def get_output_resolution(self, encode_format):
+        """
+        Returns resolution of the stream, which will be produced by encoding of the video to encode_format.
+        If only one size is specified by encode_format, then other one is calculated with video aspect ratio.
 
-        return audio_bitrate >= (encode_format.audio_bitrate or 0) \
-            and video_bitrate >= (encode_format.video_bitrate or 0)
+        :param encode_format:
+        :type encode_format: VideoFormat
+        :return: (width, height) tuple
+        :rtype: tuple
+        """
+        width, height = encode_format.video_width, encode_format.video_height
+        if not (self.video_width and self.video_height):
+            return width, height
+        if width is None and height is None:
+            return self.video_width, self.video_height
+        # Calculated sizes are rounded to even numbers like ffmpeg does for -2 size
+        if width is None:
+            width = int(round(self.video_width * height / 2.0 / self.video_height)) * 2
+        elif height is None:
+            height = int(round(self.video_height * width / 2.0 / self.video_width)) * 2
+        return width, height
+
+    def convert(self, encode_formats):
+        """
+        Converts video to specified formats. With AVLOGUE_COMPLEXITY_ANALYSIS_ENABLED complexity of the video,
+        which has not been analysed yet, is analysed once by a task, which converts the streams after the analysis.
+
+        :param encode_formats: list of video formats
+        :type encode_formats: list
+        :return: list with streams
+        :rtype: list
+        """
+        if not settings.COMPLEXITY_ANALYSIS_ENABLED or self.complexity is not None or not self.file.name:
+            return super(Video, self).convert(encode_formats)
+
+        streams = []
+        for encode_format in self.prune_formats(encode_formats):
+            stream, created = self.streams.model.objects.get_or_create(media_file=self, format=encode_format)
+            # Stream is waiting for the analysis
+            stream.cancel_conversion()
+            stream.save()
+            streams.append(stream)
+        tasks.analyse_complexity.delay(self.pk, [stream.pk for stream in streams])
+        return streams
+
+    def update_complexity(self):
+        """
+        Analyses and stores complexity of the video. Complexity is left empty if the analysis fails,
+        so format bitrates are used.
+        """
+        try:
+            self.complexity = default_encoder.get_complexity(self.file.path)
+        except (EncodeError, GetFileInfoError) as e:
+            logger.warning('Complexity analysis of {} failed, format bitrates are used.\nException:\n{}'
+                           .format(repr(self), str(e)))
+            return
+        logger.info('Complexity of {}: {}'.format(repr(self), self.complexity))
+        self.__class__.objects.filter(pk=self.pk).update(complexity=self.complexity)
+
+    def get_target_video_bitrate(self, encode_format):
+        """
+        Returns video bitrate of encode_format scaled by the video complexity.
+
+        :param encode_format:
+        :type encode_format: VideoFormat
+        :rtype: int
+        """
+        if encode_format.video_bitrate is None or self.complexity is None:
+            return encode_format.video_bitrate
+        min_factor, max_factor = settings.COMPLEXITY_BITRATE_FACTORS
+        factor = min(max(self.complexity, min_factor), max_factor)
+        return int(encode_format.video_bitrate * factor)
+
+    def get_output_key(self, encode_format):
+        """
+        Returns key of the stream, which will be produced by encoding of the video to encode_format.
+
+        :param encode_format:
+        :type encode_format: VideoFormat
+        :rtype: tuple
+        """
+        aspect_mode = 'scale'
+        if encode_format.video_width is not None and encode_format.video_height is not None:
+            aspect_mode = encode_format.video_aspect_mode
+        return (encode_format.container, encode_format.audio_codec, encode_format.audio_bitrate,
+                encode_format.audio_channels, encode_format.audio_codec_params,
+                encode_format.video_codec, encode_format.video_bitrate, encode_format.video_codec_params,
+                self.get_output_resolution(encode_format), aspect_mode)
 
     def save(self, *args, **kwargs):
         file_changed = self.file_changed
+        if file_changed:
+            self.complexity = None
         super(Video, self).save(*args, **kwargs)
 
         if file_changed or not self.preview.name:
             preview_changed = False
             if self.preview.name:
-                self.preview.storage.delete(self.preview.name)
+                deletion.delete_files(self.preview.storage, [self.preview.name])
                 self.preview = None
                 preview_changed = True
 
             if self.file.name:
                 filename = '{}.png'.format(os.path.splitext(os.path.basename(self.file.name))[0])
-                temp_preview_file_path = os.path.join(settings.TEMP_PATH, filename)
-                try:
+                with scratch.scratch_directory(scratch.PREVIEW_SIZE) as scratch_dir:
+                    temp_preview_file_path = os.path.join(scratch_dir, filename)
                     default_encoder.get_file_preview(self.file.path, temp_preview_file_path)
                     self.preview = File(open(temp_preview_file_path, 'rb'))
-                    preview_changed = True
-                finally:
-                    if os.path.exists(temp_preview_file_path):
-                        os.remove(temp_preview_file_path)
-
-            if preview_changed:
+                    self.save(update_fields=['preview'])
+            elif preview_changed:
                 self.save(update_fields=['preview'])
 
 
 @python_2_unicode_compatible
-class BaseStream(FileChangedMixin, MetaDataFields):
+class BaseStream(FileChangedMixin, MetaDataFields, StoredFileFields):
     CONVERSION_PREPARATION = 0
     CONVERSION_IN_PROGRESS = 1
     CONVERSION_SUCCESSFUL = 2
@@ -405,17 +684,21 @@ class BaseStream(FileChangedMixin, MetaDataFields):
     def convert(self):
         """
         Runs conversion task for the stream.
-        :return: Celery AsyncResult.
+        :return: Celery AsyncResult or None if the stream is encoded by a batch.
         """
         logger.info('Start stream conversion: {}'.format(self))
         self.cancel_conversion()
         self.save()
+        if batching.is_batched(self):
+            batching.schedule_batch()
+            return None
         return tasks.encode_stream.delay(self.__class__, self.pk)
 
-    @property
-    def content_type(self):
-        if self.file.name:
-            return mimetypes.guess_type(self.file.url)[0]
+    def get_encode_format(self):
+        """
+        Returns format to be used for the stream encoding.
+        """
+        return self.format
 
     class Meta:
         abstract = True
@@ -425,26 +708,132 @@ class AudioStream(BaseStream, AudioFields):
     """
     Audio stream.
     """
-    file = models.FileField(_('stream file'), upload_to=settings.AUDIO_STREAMS_DIR,
+    file = models.FileField(_('stream file'), upload_to=utils.UploadTo(settings.AUDIO_STREAMS_DIR),
                             storage=settings.MEDIA_STREAMS_STORAGE)
     media_file = models.ForeignKey(Audio, on_delete=models.CASCADE, related_name='streams')
     format = models.ForeignKey(AudioFormat)
 
+    objects = managers.StreamQuerySet.as_manager()
+
     class Meta:
         unique_together = ['media_file', 'format']
+        index_together = [['media_file', 'status', 'bitrate'], ['status', 'created']]
 
 
 class VideoStream(BaseStream, VideoFields):
     """
     Video stream.
     """
-    file = models.FileField(_('stream file'), upload_to=settings.VIDEO_STREAMS_DIR,
+    file = models.FileField(_('stream file'), upload_to=utils.UploadTo(settings.VIDEO_STREAMS_DIR),
                             storage=settings.MEDIA_STREAMS_STORAGE)
     media_file = models.ForeignKey(Video, on_delete=models.CASCADE, related_name='streams')
     format = models.ForeignKey(VideoFormat)
+    target_video_bitrate = models.PositiveIntegerField(_('target video bitrate'), null=True, blank=True,
+                                                       help_text=_('Format video bitrate adapted to the video '
+                                                                   'complexity.'))
+    speed_preset = models.CharField(_('speed preset'), max_length=50, null=True, blank=True, editable=False,
+                                    help_text=_('Encoder speed preset used for the conversion.'))
+
+    objects = managers.StreamQuerySet.as_manager()
+
+    def convert(self):
+        self.target_video_bitrate = self.media_file.get_target_video_bitrate(self.format)
+        return super(VideoStream, self).convert()
+
+    def get_encode_format(self):
+        """
+        Returns stream format with the video bitrate adapted to the video complexity and the speed preset
+        adapted to the encode queue load. The target video bitrate and the speed preset are recorded on the stream.
+        """
+        encode_format = copy.copy(self.format)
+        if self.target_video_bitrate is not None:
+            encode_format.video_bitrate = self.target_video_bitrate
+        self.speed_preset = None
+        if speed_presets.get_speed_presets(encode_format):
+            self.speed_preset = speed_presets.select_speed_preset(
+                encode_format, speed_presets.get_queue_load(self.__class__))
+        encode_format.speed_preset = self.speed_preset
+        return encode_format
 
     class Meta:
         unique_together = ['media_file', 'format']
+        index_together = [['media_file', 'status', 'bitrate'], ['status', 'created']]
+
+
+@python_2_unicode_compatible
+class ChunkedUpload(models.Model):
+    """
+    Resumable chunked upload of an audio or video file.
+    Chunks are stored in the media files storage and are joined into the media file after the last chunk.
+    """
+    UPLOAD_IN_PROGRESS = 0
+    UPLOAD_PROCESSING = 1
+    UPLOAD_COMPLETED = 2
+    UPLOAD_FAILURE = 3
+
+    # Sort choices by status code to easy get text
+    UPLOAD_CHOICES = sorted(((UPLOAD_IN_PROGRESS, _('In progress')),
+                             (UPLOAD_PROCESSING, _('Processing')),
+                             (UPLOAD_COMPLETED, _('Completed')),
+                             (UPLOAD_FAILURE, _('Failure'))),
+                            key=lambda s: s[0])
+
+    MEDIA_TYPE_CHOICES = (('audio', _('audio')),
+                          ('video', _('video')))
+
+    upload_id = models.UUIDField(_('upload id'), default=uuid.uuid4, unique=True, editable=False)
+    user = models.ForeignKey(django_settings.AUTH_USER_MODEL, verbose_name=_('user'), null=True, blank=True,
+                             on_delete=models.CASCADE)
+    media_type = models.CharField(_('media type'), max_length=5, choices=MEDIA_TYPE_CHOICES)
+    file_name = models.CharField(_('file name'), max_length=255)
+    title = models.CharField(_('title'), max_length=50, blank=True)
+    size = models.BigIntegerField(_('size'))
+    offset = models.BigIntegerField(_('offset'), default=0)
+    chunks = models.TextField(_('chunks'), blank=True, editable=False,
+                              help_text=_('Storage names of the received chunks, one per line.'))
+    headers_checked = models.BooleanField(_('headers checked'), default=False)
+    status = models.IntegerField(_('upload status'), default=UPLOAD_IN_PROGRESS, choices=UPLOAD_CHOICES)
+    error = models.TextField(_('error'), blank=True)
+    media_file_id = models.PositiveIntegerField(_('media file id'), null=True, blank=True)
+    created = models.DateTimeField(_('created'), default=now)
+    modified = models.DateTimeField(_('modified'), auto_now=True)
+
+    def __str__(self):
+        return "{}: {}".format(self.media_type, self.file_name)
+
+    def get_status_text(self):
+        return self.UPLOAD_CHOICES[self.status][1]
+
+    def get_media_file_model(self):
+        return Audio if self.media_type == 'audio' else Video
+
+    def get_chunk_names(self):
+        return [name for name in self.chunks.split('\n') if name]
+
+    class Meta:
+        verbose_name = _('chunked upload')
+
+
+@python_2_unicode_compatible
+class PendingDeletion(models.Model):
+    """
+    Tombstone of a storage file, which is to be deleted by avlogue.tasks.delete_pending_files task.
+    """
+    STORAGE_CHOICES = (('media', _('media files storage')),
+                       ('streams', _('streams storage')))
+
+    storage = models.CharField(_('storage'), max_length=10, choices=STORAGE_CHOICES)
+    name = models.CharField(_('file name'), max_length=255)
+    attempts = models.PositiveSmallIntegerField(_('attempts'), default=0)
+    error = models.TextField(_('error'), blank=True)
+    created = models.DateTimeField(_('created'), default=now)
+    next_attempt = models.DateTimeField(_('next attempt'), default=now, db_index=True)
+
+    def __str__(self):
+        return "{}: {}".format(self.storage, self.name)
+
+    class Meta:
+        verbose_name = _('pending deletion')
 
 
 def delete_media_file_on_model_delete(sender, instance, **kwargs):
@@ -455,10 +844,9 @@ def delete_media_file_on_model_delete(sender, instance, **kwargs):
     :param kwargs:
     :return:
     """
-    if instance.file.name:
-        instance.file.storage.delete(instance.file.name)
-    if isinstance(instance, Video) and instance.preview.name:
-        instance.preview.storage.delete(instance.preview.name)
+    deletion.delete_files(instance.file.storage, [instance.file.name])
+    if isinstance(instance, Video):
+        deletion.delete_files(instance.preview.storage, [instance.preview.name])
 
 
 def delete_media_old_file_on_model_change(sender, instance, **kwargs):
@@ -469,8 +857,105 @@ def delete_media_old_file_on_model_change(sender, instance, **kwargs):
     :param kwargs:
     :return:
     """
-    if instance.file_changed and instance._old_file is not None and instance._old_file.name:
-        instance._old_file.storage.delete(instance._old_file.name)
+    if instance.file_changed and instance.old_file_name:
+        deletion.delete_files(instance.file.storage, [instance.old_file_name])
+
+
+def invalidate_player_cache(sender, instance, **kwargs):
+    """
+    Invalidates cached player html of the media file if the media file or its stream has been changed.
+    :param sender:
+    :param instance:
+    :param kwargs:
+    :return:
+    """
+    if isinstance(instance, BaseStream):
+        player_cache.invalidate(sender._meta.get_field('media_file').related_model, instance.media_file_id)
+    else:
+        player_cache.invalidate(sender, instance.pk)
+
+
+def invalidate_formats_player_cache(sender, **kwargs):
+    """
+    Invalidates cached player html of all media files if a format or a format set has been changed.
+    :param sender:
+    :param kwargs:
+    :return:
+    """
+    player_cache.invalidate_formats()
+
+
+def update_streams_version(sender, instance, **kwargs):
+    """
+    Increments streams version of the media file if its stream has been changed.
+    :param sender:
+    :param instance:
+    :param kwargs:
+    :return:
+    """
+    media_file_model = sender._meta.get_field('media_file').related_model
+    media_file_model.objects.filter(pk=instance.media_file_id).update(
+        streams_version=models.F('streams_version') + 1, streams_modified=now())
+
+
+# Media files being deleted by the current thread, their streams are deleted before them by the cascade
+_deleting_media_files = threading.local()
+
+
+def _get_deleting_media_files():
+    if not hasattr(_deleting_media_files, 'keys'):
+        _deleting_media_files.keys = set()
+    return _deleting_media_files.keys
+
+
+def mark_media_file_deleting(sender, instance, **kwargs):
+    """
+    Marks the media file being deleted, so its manifest is not rewritten on the deletion of its streams.
+    :param sender:
+    :param instance:
+    :param kwargs:
+    :return:
+    """
+    if settings.MANIFESTS_ENABLED:
+        _get_deleting_media_files().add((sender, instance.pk))
+
+
+def update_manifest(sender, instance, **kwargs):
+    """
+    Writes manifest of the media file if the media file has been changed or its stream conversion has been completed.
+    :param sender:
+    :param instance:
+    :param kwargs:
+    :return:
+    """
+    if not settings.MANIFESTS_ENABLED:
+        return
+    if isinstance(instance, BaseStream):
+        if instance.status == instance.CONVERSION_IN_PROGRESS:
+            return
+        media_file_model = sender._meta.get_field('media_file').related_model
+        if (media_file_model, instance.media_file_id) in _get_deleting_media_files():
+            # Manifest is deleted with the media file
+            return
+        # Media file is None if the stream is deleted with its media file
+        media_file = media_file_model.objects.filter(pk=instance.media_file_id).first()
+        if media_file is not None:
+            manifests.write_manifest(media_file)
+    else:
+        manifests.write_manifest(instance)
+
+
+def delete_manifest_on_model_delete(sender, instance, **kwargs):
+    """
+    Deletes manifest of the deleted media file.
+    :param sender:
+    :param instance:
+    :param kwargs:
+    :return:
+    """
+    if settings.MANIFESTS_ENABLED:
+        _get_deleting_media_files().discard((sender, instance.pk))
+        manifests.delete_manifest(instance)
 
 
 # Register media files deletion on model deletion
@@ -484,3 +969,43 @@ receiver(models.signals.pre_save, sender=Video)(delete_media_old_file_on_model_c
 receiver(models.signals.pre_save, sender=VideoStream)(delete_media_old_file_on_model_change)
 receiver(models.signals.pre_save, sender=Audio)(delete_media_old_file_on_model_change)
 receiver(models.signals.pre_save, sender=AudioStream)(delete_media_old_file_on_model_change)
+
+# Register player cache invalidation on model changing and deletion
+receiver(models.signals.post_save, sender=Video)(invalidate_player_cache)
+receiver(models.signals.post_save, sender=VideoStream)(invalidate_player_cache)
+receiver(models.signals.post_save, sender=Audio)(invalidate_player_cache)
+receiver(models.signals.post_save, sender=AudioStream)(invalidate_player_cache)
+receiver(models.signals.post_delete, sender=Video)(invalidate_player_cache)
+receiver(models.signals.post_delete, sender=VideoStream)(invalidate_player_cache)
+receiver(models.signals.post_delete, sender=Audio)(invalidate_player_cache)
+receiver(models.signals.post_delete, sender=AudioStream)(invalidate_player_cache)
+
+# Register player cache invalidation on formats changing
+receiver(models.signals.post_save, sender=VideoFormat)(invalidate_formats_player_cache)
+receiver(models.signals.post_save, sender=AudioFormat)(invalidate_formats_player_cache)
+receiver(models.signals.post_delete, sender=VideoFormat)(invalidate_formats_player_cache)
+receiver(models.signals.post_delete, sender=AudioFormat)(invalidate_formats_player_cache)
+receiver(models.signals.post_save, sender=VideoFormatSet)(invalidate_formats_player_cache)
+receiver(models.signals.post_save, sender=AudioFormatSet)(invalidate_formats_player_cache)
+receiver(models.signals.post_delete, sender=VideoFormatSet)(invalidate_formats_player_cache)
+receiver(models.signals.post_delete, sender=AudioFormatSet)(invalidate_formats_player_cache)
+receiver(models.signals.m2m_changed, sender=VideoFormatSet.formats.through)(invalidate_formats_player_cache)
+receiver(models.signals.m2m_changed, sender=AudioFormatSet.formats.through)(invalidate_formats_player_cache)
+
+# Register streams version update on streams changing and deletion
+receiver(models.signals.post_save, sender=VideoStream)(update_streams_version)
+receiver(models.signals.post_save, sender=AudioStream)(update_streams_version)
+receiver(models.signals.post_delete, sender=VideoStream)(update_streams_version)
+receiver(models.signals.post_delete, sender=AudioStream)(update_streams_version)
+
+# Register manifests update on model changing and deletion
+receiver(models.signals.post_save, sender=Video)(update_manifest)
+receiver(models.signals.post_save, sender=VideoStream)(update_manifest)
+receiver(models.signals.post_save, sender=Audio)(update_manifest)
+receiver(models.signals.post_save, sender=AudioStream)(update_manifest)
+receiver(models.signals.post_delete, sender=VideoStream)(update_manifest)
+receiver(models.signals.post_delete, sender=AudioStream)(update_manifest)
+receiver(models.signals.pre_delete, sender=Video)(mark_media_file_deleting)
+receiver(models.signals.pre_delete, sender=Audio)(mark_media_file_deleting)
+receiver(models.signals.post_delete, sender=Video)(delete_manifest_on_model_delete)
+receiver(models.signals.post_delete, sender=Audio)(delete_manifest_on_model_delete)
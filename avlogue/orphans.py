@@ -0,0 +1,183 @@
+"""
+AVlogue orphaned files garbage collector.
+
+Files of failed or revoked conversions and files saved to the storage by crashed processes are not referenced by any
+media file or stream. Storage listings are streamed directory by directory and are compared with the referenced
+names, which are loaded by chunks and are kept as short hashes, so memory is bounded at millions of files.
+"""
+import datetime
+import hashlib
+import logging
+import os
+import time
+
+from django.conf import settings as django_settings
+from django.utils.encoding import force_bytes
+from django.utils.timezone import is_aware, is_naive, make_aware, make_naive, now
+
+from avlogue import scratch
+from avlogue import settings
+
+logger = logging.getLogger('avlogue')
+
+
+def _hash_name(name):
+    return hashlib.md5(force_bytes(name)).digest()[:8]
+
+
+def get_file_fields():
+    """
+    Returns models and names of their file fields, which reference storage files.
+    """
+    from avlogue.models import Audio, AudioStream, Video, VideoStream
+
+    return ((Audio, ('file',)), (Video, ('file', 'preview')), (AudioStream, ('file',)), (VideoStream, ('file',)))
+
+
+def iter_referenced_names(chunk_size=10000):
+    """
+    Yields names of the referenced files. Rows are loaded by chunks ordered by pk.
+    """
+    for model, field_names in get_file_fields():
+        last_pk = 0
+        while True:
+            rows = list(model.objects.filter(pk__gt=last_pk).order_by('pk')
+                        .values_list('pk', *field_names)[:chunk_size])
+            for row in rows:
+                for name in row[1:]:
+                    if name:
+                        yield name
+            if len(rows) < chunk_size:
+                break
+            last_pk = rows[-1][0]
+
+
+def is_referenced(names):
+    """
+    Returns set of referenced names among the given ones.
+    """
+    referenced = set()
+    # Number of query parameters is limited in SQLite
+    for i in range(0, len(names), 500):
+        for model, field_names in get_file_fields():
+            for field_name in field_names:
+                referenced.update(model.objects.filter(**{'{}__in'.format(field_name): names[i:i + 500]})
+                                  .values_list(field_name, flat=True))
+    return referenced
+
+
+def walk_storage(storage, path):
+    """
+    Yields names of the storage files under the path, directory by directory.
+    """
+    try:
+        directories, files = storage.listdir(path)
+    except (OSError, IOError):
+        # Path doesn't exist
+        return
+    for file_name in sorted(files):
+        yield os.path.join(path, file_name)
+    for directory in sorted(directories):
+        for name in walk_storage(storage, os.path.join(path, directory)):
+            yield name
+
+
+def _get_modified_time(storage, name):
+    # Storage.modified_time is replaced by get_modified_time in new Django versions
+    if hasattr(storage, 'get_modified_time'):
+        modified = storage.get_modified_time(name)
+    else:
+        modified = storage.modified_time(name)
+    # Modified time is compared with now(), which is naive without USE_TZ
+    if django_settings.USE_TZ and is_naive(modified):
+        modified = make_aware(modified)
+    elif not django_settings.USE_TZ and is_aware(modified):
+        modified = make_naive(modified)
+    return modified
+
+
+def get_storage_roots():
+    """
+    Returns storages and directories to be scanned for the orphaned files.
+    """
+    roots = []
+    for storage, path in ((settings.MEDIA_STORAGE, settings.AUDIO_DIR), (settings.MEDIA_STORAGE, settings.VIDEO_DIR),
+                          (settings.MEDIA_STREAMS_STORAGE, settings.AUDIO_STREAMS_DIR),
+                          (settings.MEDIA_STREAMS_STORAGE, settings.VIDEO_STREAMS_DIR)):
+        # Streams directories are in the media files directories by default
+        if not any(root_storage is storage and (path == root_path or path.startswith(root_path.rstrip('/') + '/'))
+                   for root_storage, root_path in roots):
+            roots.append((storage, path))
+    return roots
+
+
+def collect_storage_orphans(min_age, dry_run=False, chunk_size=10000):
+    """
+    Deletes storage files, which are not referenced by media files and streams.
+
+    :param min_age: minimal age in seconds of the deleted files, files being saved right now are not referenced yet
+    :type min_age: int
+    :param dry_run: only find orphaned files
+    :param chunk_size: number of rows loaded by a query
+    :return: generator of names and sizes of the orphaned files
+    """
+    referenced = set(_hash_name(name) for name in iter_referenced_names(chunk_size))
+    max_modified = now() - datetime.timedelta(seconds=min_age)
+
+    for storage, path in get_storage_roots():
+        candidates = []
+        for name in walk_storage(storage, path):
+            if _hash_name(name) not in referenced:
+                candidates.append(name)
+            if len(candidates) >= chunk_size:
+                for orphan in _collect_candidates(storage, candidates, max_modified, dry_run):
+                    yield orphan
+                candidates = []
+        for orphan in _collect_candidates(storage, candidates, max_modified, dry_run):
+            yield orphan
+
+
+def _collect_candidates(storage, candidates, max_modified, dry_run):
+    if not candidates:
+        return
+    # Files could be referenced after the referenced names have been loaded
+    referenced = is_referenced(candidates)
+    for name in candidates:
+        if name in referenced or _get_modified_time(storage, name) > max_modified:
+            continue
+        size = storage.size(name)
+        if not dry_run:
+            logger.info('Delete orphaned file: {}'.format(name))
+            storage.delete(name)
+        yield name, size
+
+
+def collect_temp_orphans(min_age, dry_run=False):
+    """
+    Deletes old files of the temporary path, mezzanine files are skipped as they have their own expiration,
+    reservations ledger and governor slot files are skipped as they are locked by the running conversions.
+
+    :param min_age: minimal age in seconds of the deleted files
+    :type min_age: int
+    :param dry_run: only find old files
+    :return: generator of paths and sizes of the old files
+    """
+    max_mtime = time.time() - min_age
+    skipped_paths = (os.path.abspath(settings.MEZZANINE_PATH), os.path.abspath(settings.GOVERNOR_PATH))
+    for directory, directories, files in os.walk(settings.TEMP_PATH):
+        directories[:] = [d for d in directories if os.path.abspath(os.path.join(directory, d)) not in skipped_paths]
+        for file_name in files:
+            if file_name == scratch.LEDGER_NAME:
+                continue
+            path = os.path.join(directory, file_name)
+            try:
+                stat = os.stat(path)
+                if stat.st_mtime > max_mtime:
+                    continue
+                if not dry_run:
+                    logger.info('Delete old temporary file: {}'.format(path))
+                    os.remove(path)
+            except OSError:
+                # File has been removed by another process
+                continue
+            yield path, stat.st_size
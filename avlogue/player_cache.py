@@ -0,0 +1,93 @@
+"""
+AVlogue player html cache.
+
+Rendered player html is cached with a key, which contains the version of the media file and its streams
+and the version of the formats. Versions are changed by the model signals, so stale html is never served.
+The key also contains the active language and the prefetched streams, which the html is rendered from.
+"""
+import hashlib
+import time
+
+from django.core.cache import caches
+from django.utils.translation import get_language
+
+from avlogue import settings
+
+FORMATS_VERSION_KEY = 'avlogue:player:formats-version'
+
+
+def get_cache():
+    """
+    Returns player cache or None if the cache is disabled.
+    """
+    if settings.PLAYER_CACHE_ALIAS is not None:
+        return caches[settings.PLAYER_CACHE_ALIAS]
+
+
+def _new_version():
+    # NOTE: version is based on time, so a version evicted from the cache is never reused
+    return int(time.time() * 1000)
+
+
+def _get_label(model):
+    return '{}.{}'.format(model._meta.app_label, model._meta.model_name)
+
+
+def _get_version_key(model, pk):
+    return 'avlogue:player:version:{}:{}'.format(_get_label(model), pk)
+
+
+def get_cache_key(media_file, params, stream_pks=None):
+    """
+    Returns cache key of the media file player html.
+
+    :param media_file:
+    :type media_file: avlogue.models.MediaFile
+    :param params: player tag params
+    :type params: dict
+    :param stream_pks: pks of the prefetched streams or None if the streams are queried
+    :type stream_pks: list
+    :rtype: str
+    """
+    cache = get_cache()
+    version_key = _get_version_key(media_file.__class__, media_file.pk)
+    versions = cache.get_many((version_key, FORMATS_VERSION_KEY))
+    for key in (version_key, FORMATS_VERSION_KEY):
+        if key not in versions:
+            cache.add(key, _new_version(), None)
+            versions[key] = cache.get(key)
+
+    if stream_pks is not None:
+        stream_pks = sorted(stream_pks)
+    params_hash = hashlib.md5(repr((sorted(params.items()), stream_pks)).encode('utf-8')).hexdigest()
+    return 'avlogue:player:{}:{}:{}:{}:{}:{}'.format(_get_label(media_file.__class__), media_file.pk,
+                                                     versions[version_key], versions[FORMATS_VERSION_KEY],
+                                                     get_language(), params_hash)
+
+
+def _bump_version(key):
+    cache = get_cache()
+    if cache is None:
+        return
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Version is not cached
+        cache.set(key, _new_version(), None)
+
+
+def invalidate(model, pk):
+    """
+    Invalidates cached player html of the media file.
+
+    :param model: Audio or Video
+    :param pk: media file pk
+    """
+    _bump_version(_get_version_key(model, pk))
+
+
+def invalidate_formats():
+    """
+    Invalidates cached player html of all media files.
+    """
+    _bump_version(FORMATS_VERSION_KEY)
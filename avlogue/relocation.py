@@ -0,0 +1,92 @@
+"""
+AVlogue files relocation.
+
+Moves files of the existing media files and streams to the directories of AVLOGUE_STORAGE_LAYOUT setting.
+Rows are relocated in batches ordered by pk and the last pk of a batch is returned, so the relocation can be resumed
+from it. Files, which are already in their layout directories, are skipped, so the relocation can be safely rerun.
+"""
+import logging
+import os
+
+from avlogue import deletion
+from avlogue import settings
+
+logger = logging.getLogger('avlogue')
+
+
+def get_relocation_name(instance, field_name, name):
+    """
+    Returns name of the file in the directory of the storage layout.
+    """
+    field = instance._meta.get_field(field_name)
+    return field.generate_filename(instance, os.path.basename(name))
+
+
+def is_relocated(instance, field_name, name):
+    # Storage can add a suffix to the name, so only the directory is compared
+    return os.path.dirname(name) == os.path.dirname(get_relocation_name(instance, field_name, name))
+
+
+def relocate_file(instance, field_name):
+    """
+    Copies file to the directory of the storage layout and deletes the old file.
+
+    :param instance: media file or stream
+    :param field_name: name of the file field
+    :return: True if the file has been relocated
+    :rtype: bool
+    """
+    model = instance.__class__
+    name = getattr(instance, field_name).name
+    if not name or is_relocated(instance, field_name, name):
+        return False
+
+    storage = model._meta.get_field(field_name).storage
+    with storage.open(name, 'rb') as f:
+        new_name = storage.save(get_relocation_name(instance, field_name, name), f)
+    # File could be changed by a conversion meanwhile
+    if not model.objects.filter(pk=instance.pk, **{field_name: name}).update(**{field_name: new_name}):
+        storage.delete(new_name)
+        return False
+
+    logger.info('Relocate {} to {}'.format(name, new_name))
+    setattr(instance, field_name, new_name)
+    if field_name == 'file':
+        instance._old_file_name = new_name
+    deletion.delete_files(storage, [name])
+    return True
+
+
+def _file_relocated(model, instance, field_names):
+    # Signals are not sent by the queryset update, urls of the relocated files are updated here
+    from avlogue import models
+
+    if 'file' in field_names:
+        instance.update_url()
+    models.invalidate_player_cache(model, instance)
+    if isinstance(instance, models.BaseStream):
+        models.update_streams_version(model, instance)
+    models.update_manifest(model, instance)
+
+
+def relocate_batch(model, field_names, last_pk=0, batch_size=None):
+    """
+    Relocates files of a batch of the model rows after last_pk.
+
+    :param model: media file or stream model
+    :param field_names: names of the file fields
+    :param last_pk: last pk of the previous batch
+    :param batch_size: number of rows, AVLOGUE_RELOCATION_BATCH_SIZE by default
+    :return: last pk of the batch or None if all rows have been processed, and number of relocated files
+    :rtype: tuple
+    """
+    batch_size = batch_size or settings.RELOCATION_BATCH_SIZE
+    instances = list(model.objects.filter(pk__gt=last_pk).order_by('pk')[:batch_size])
+    relocated_count = 0
+    for instance in instances:
+        relocated_fields = [field_name for field_name in field_names if relocate_file(instance, field_name)]
+        if relocated_fields:
+            relocated_count += len(relocated_fields)
+            _file_relocated(model, instance, relocated_fields)
+    last_pk = instances[-1].pk if len(instances) == batch_size else None
+    return last_pk, relocated_count
@@ -0,0 +1,233 @@
+"""
+AVlogue scratch directories.
+
+Every conversion writes its outputs to its own scratch directory, which is deleted when the conversion is
+finished, so concurrent conversions never collide. Small outputs are written to the RAM backed
+AVLOGUE_SCRATCH_RAM_PATH if it is configured, other outputs are written to AVLOGUE_TEMP_PATH. The estimated output size
+is reserved in a ledger of the path before a scratch directory is created, so concurrent conversions don't fill
+the disk: a conversion is admitted only if the free space minus the sizes reserved by other running conversions
+is enough for its output.
+"""
+import errno
+import fcntl
+import json
+import os
+import shutil
+import tempfile
+import uuid
+from contextlib import contextmanager
+
+from avlogue import settings
+
+#: Margin of the estimated output size for the container overhead and the bitrate variations.
+SIZE_MARGIN = 1.2
+
+#: Bitrate of 16-bit 48 kHz PCM audio channel, it is used for the formats without audio bitrate.
+PCM_CHANNEL_BITRATE = 768000
+
+#: Estimated size of a video preview.
+PREVIEW_SIZE = 1024 * 1024
+
+#: Name of the reservations ledger in the scratch path.
+LEDGER_NAME = '.reservations'
+
+
+class ScratchSpaceError(Exception):
+    """
+    Exception, which is raised if there is not enough free space for the scratch directory.
+    """
+
+
+def estimate_output_size(media_file, encode_format):
+    """
+    Returns estimated size of the media file encoded to the format or None if it can't be estimated.
+
+    :param media_file:
+    :type media_file: avlogue.models.MediaFile
+    :param encode_format:
+    :type encode_format: avlogue.models.BaseFormat
+    :return: size in bytes
+    :rtype: int
+    """
+    if media_file.duration is None:
+        return None
+    audio_bitrate = encode_format.audio_bitrate
+    if audio_bitrate is None and encode_format.audio_codec:
+        # Lossless or quality based audio is estimated as PCM
+        audio_bitrate = PCM_CHANNEL_BITRATE * (encode_format.audio_channels or media_file.audio_channels or 2)
+    video_bitrate = getattr(encode_format, 'video_bitrate', None)
+    if video_bitrate is None and getattr(encode_format, 'video_codec', None):
+        # Quality based video is estimated by the source bitrate
+        video_bitrate = getattr(media_file, 'video_bitrate', None) or media_file.bitrate
+        if video_bitrate is None:
+            return None
+    return int(media_file.duration * ((audio_bitrate or 0) + (video_bitrate or 0)) / 8 * SIZE_MARGIN)
+
+
+def get_free_space(path):
+    """
+    Returns free space in bytes available to the process on the file system of the path.
+    """
+    stat = os.statvfs(path)
+    return stat.f_bavail * stat.f_frsize
+
+
+def _is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+    return True
+
+
+@contextmanager
+def locked_ledger(path):
+    """
+    Locks reservations ledger of the path and returns reservations, which are [pid, size] lists by ids.
+    Changes of the reservations are written on exit. Reservations of the dead processes are dropped.
+
+    :param path: scratch path
+    :rtype: dict
+    """
+    with open(os.path.join(path, LEDGER_NAME), 'a+') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            f.seek(0)
+            content = f.read()
+            reservations = dict((reservation_id, reservation)
+                                for reservation_id, reservation in (json.loads(content) if content else {}).items()
+                                if _is_alive(reservation[0]))
+            yield reservations
+            f.seek(0)
+            f.truncate()
+            f.write(json.dumps(reservations))
+            f.flush()
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _get_paths(estimated_size):
+    paths = [settings.TEMP_PATH]
+    if settings.SCRATCH_RAM_PATH and estimated_size is not None and \
+            estimated_size <= settings.SCRATCH_RAM_MAX_SIZE:
+        paths.insert(0, settings.SCRATCH_RAM_PATH)
+    for path in paths:
+        if not os.path.exists(path):
+            try:
+                os.makedirs(path)
+            except OSError as e:
+                # Directory could be created by another worker meanwhile
+                if e.errno != errno.EEXIST:
+                    raise
+    return paths
+
+
+def _fits(path, reservations, estimated_size):
+    reserved_size = sum(size for pid, size in reservations.values())
+    size = estimated_size or 0
+    if settings.SCRATCH_SPACE_BUDGET is not None and reserved_size + size > settings.SCRATCH_SPACE_BUDGET:
+        return False
+    # NOTE: written parts of the reserved outputs are counted twice, so the check is conservative
+    return get_free_space(path) - reserved_size - size >= settings.SCRATCH_MIN_FREE_SPACE
+
+
+def get_scratch_path(estimated_size=None):
+    """
+    Returns path, where a scratch directory for the output of the estimated size can be created.
+
+    :param estimated_size: estimated output size in bytes, outputs of unknown size are written to the disk
+    :type estimated_size: int
+    :rtype: str
+    :raises ScratchSpaceError: there is not enough free space
+    """
+    for path in _get_paths(estimated_size):
+        with locked_ledger(path) as reservations:
+            if _fits(path, reservations, estimated_size):
+                return path
+    raise ScratchSpaceError('Not enough free space for an output of {} bytes.'.format(estimated_size))
+
+
+def _get_ledger_path(path):
+    """
+    Returns scratch path on the file system of the path, or the path itself if it is on another file system.
+    """
+    device = os.stat(path).st_dev
+    for scratch_path in _get_paths(None) + [settings.SCRATCH_RAM_PATH]:
+        if scratch_path and os.path.exists(scratch_path) and os.stat(scratch_path).st_dev == device:
+            return scratch_path
+    return path
+
+
+def reserve_space(estimated_size=None, path=None):
+    """
+    Reserves space for the output of the estimated size.
+
+    :param estimated_size: estimated output size in bytes
+    :type estimated_size: int
+    :param path: existing directory of an output written outside of the scratch directories, e.g. a mezzanine
+                 file, the space is reserved in the ledger of the scratch path on its file system
+    :type path: str
+    :return: scratch path and reservation id
+    :rtype: tuple
+    :raises ScratchSpaceError: there is not enough free space
+    """
+    paths = _get_paths(estimated_size) if path is None else [_get_ledger_path(path)]
+    for path in paths:
+        with locked_ledger(path) as reservations:
+            if _fits(path, reservations, estimated_size):
+                reservation_id = uuid.uuid4().hex
+                reservations[reservation_id] = [os.getpid(), estimated_size or 0]
+                return path, reservation_id
+    raise ScratchSpaceError('Not enough free space for an output of {} bytes.'.format(estimated_size))
+
+
+def release_space(path, reservation_id):
+    """
+    Releases reserved space.
+    """
+    with locked_ledger(path) as reservations:
+        reservations.pop(reservation_id, None)
+
+
+def check_storage_space(storage, estimated_size):
+    """
+    Checks free space of a local storage for the output of the estimated size, remote storages are not checked.
+
+    :raises ScratchSpaceError: there is not enough free space
+    """
+    try:
+        location = storage.path('')
+    except NotImplementedError:
+        return
+    if estimated_size is None:
+        return
+    try:
+        free_space = get_free_space(location)
+    except OSError:
+        # Storage location is created with the first file
+        return
+    if free_space - estimated_size < settings.SCRATCH_MIN_FREE_SPACE:
+        raise ScratchSpaceError('Not enough free space in the storage for an output of {} bytes.'.format(
+            estimated_size))
+
+
+@contextmanager
+def scratch_directory(estimated_size=None):
+    """
+    Reserves space and creates scratch directory for the output of the estimated size.
+    The directory is deleted and the space is released on exit.
+
+    :param estimated_size: estimated output size in bytes
+    :type estimated_size: int
+    :return: path of the scratch directory
+    :raises ScratchSpaceError: there is not enough free space
+    """
+    scratch_path, reservation_id = reserve_space(estimated_size)
+    try:
+        path = tempfile.mkdtemp(prefix='scratch_', dir=scratch_path)
+        try:
+            yield path
+        finally:
+            shutil.rmtree(path, ignore_errors=True)
+    finally:
+        release_space(scratch_path, reservation_id)
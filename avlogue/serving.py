@@ -0,0 +1,181 @@
+"""
+AVlogue media files serving with byte ranges.
+
+Files of local storages are served by FileResponse, so full files are sent by the WSGI server file wrapper
+(os.sendfile where it is supported). Requested ranges are streamed by blocks and are never read into memory
+at once. Behind nginx or apache files can be sent by the web server with AVLOGUE_SERVE_FILES_HEADER.
+"""
+import os
+import re
+
+from django.http import FileResponse, HttpResponse, HttpResponseNotModified
+from django.utils import http
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+
+from avlogue import settings
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class RangeFile(object):
+    """
+    File-like object to read a part of the file.
+    """
+
+    def __init__(self, file, start, length):
+        self.file = file
+        self.file.seek(start)
+        self.remaining = length
+
+    def read(self, size=-1):
+        if self.remaining <= 0:
+            return b''
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+def parse_range(value, size):
+    """
+    Parses Range header. Only a single range is supported, None is returned for other values,
+    so the full file is served.
+
+    :param value: Range header value
+    :type value: str
+    :param size: file size
+    :type size: int
+    :return: start and end (inclusive) of the range or None
+    :rtype: tuple
+    :raises ValueError: range is not satisfiable
+    """
+    match = RANGE_RE.match(value.replace(' ', ''))
+    if match is None:
+        return None
+    start, end = match.groups()
+    if not start and not end:
+        return None
+    if not start:
+        # Suffix range, the last bytes of the file
+        suffix_length = int(end)
+        if suffix_length == 0:
+            raise ValueError('Range is not satisfiable.')
+        return max(size - suffix_length, 0), size - 1
+    start = int(start)
+    end = min(int(end), size - 1) if end else size - 1
+    if start > end:
+        raise ValueError('Range is not satisfiable.')
+    return start, end
+
+
+def _get_file_path(field_file):
+    try:
+        return field_file.storage.path(field_file.name)
+    except NotImplementedError:
+        # Remote storage
+        return None
+
+
+def parse_etags(etag_str):
+    """
+    Parses If-None-Match header to a list of quoted etags.
+
+    Django before 1.11 unquotes parsed etags and later versions keep the quotes.
+    """
+    return [etag if etag == '*' or etag.startswith(('"', 'W/')) else quote_etag(etag)
+            for etag in http.parse_etags(etag_str)]
+
+
+def _is_not_modified(request, etag, modified):
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match is not None:
+        return etag in parse_etags(if_none_match)
+    if_modified_since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+    if if_modified_since is None or modified is None:
+        return False
+    return modified <= if_modified_since
+
+
+def _is_range_allowed(request, etag, modified):
+    # Range is ignored, so the full file is served, if the file has been changed since If-Range
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if if_range is None or if_range == etag:
+        return True
+    return modified is not None and if_range == http_date(modified)
+
+
+def serve_file(request, field_file, content_type=None):
+    """
+    Returns response with the file or its requested range.
+
+    :param request:
+    :param field_file: file of a media file or a stream
+    :type field_file: django.db.models.fields.files.FieldFile
+    :param content_type:
+    :type content_type: str
+    :rtype: django.http.HttpResponse
+    """
+    content_type = content_type or 'application/octet-stream'
+    if settings.SERVE_FILES_HEADER == 'X-Accel-Redirect':
+        # nginx serves the file with ranges itself
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = '{}/{}'.format(settings.SERVE_FILES_ACCEL_PREFIX.rstrip('/'),
+                                                      field_file.name.lstrip('/'))
+        return response
+
+    path = _get_file_path(field_file)
+    if settings.SERVE_FILES_HEADER == 'X-Sendfile' and path is not None:
+        response = HttpResponse(content_type=content_type)
+        response['X-Sendfile'] = path
+        return response
+
+    if path is not None:
+        file = open(path, 'rb')
+        stat = os.fstat(file.fileno())
+        size, modified = stat.st_size, int(stat.st_mtime)
+    else:
+        file = field_file.storage.open(field_file.name, 'rb')
+        size, modified = file.size, None
+    etag = quote_etag('{:x}-{:x}'.format(size, modified or 0))
+
+    if _is_not_modified(request, etag, modified):
+        file.close()
+        response = HttpResponseNotModified()
+        response['ETag'] = etag
+        return response
+
+    byte_range = None
+    range_header = request.META.get('HTTP_RANGE')
+    if range_header is not None and _is_range_allowed(request, etag, modified):
+        try:
+            byte_range = parse_range(range_header, size)
+        except ValueError:
+            file.close()
+            response = HttpResponse(status=416)
+            response['Content-Range'] = 'bytes */{}'.format(size)
+            return response
+
+    if request.method == 'HEAD':
+        file.close()
+        response = HttpResponse(content_type=content_type)
+    elif byte_range is not None:
+        response = FileResponse(RangeFile(file, byte_range[0], byte_range[1] - byte_range[0] + 1),
+                                content_type=content_type)
+    else:
+        response = FileResponse(file, content_type=content_type)
+
+    if byte_range is not None:
+        response.status_code = 206
+        response['Content-Range'] = 'bytes {}-{}/{}'.format(byte_range[0], byte_range[1], size)
+        response['Content-Length'] = byte_range[1] - byte_range[0] + 1
+    else:
+        response['Content-Length'] = size
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    if modified is not None:
+        response['Last-Modified'] = http_date(modified)
+    return response
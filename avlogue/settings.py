@@ -56,6 +56,16 @@ AUDIO_DIR = get_avlogue_setting('AUDIO_DIR', os.path.join(DIR, 'audio'))
 #: Audio streams directory.
 AUDIO_STREAMS_DIR = get_avlogue_setting('AUDIO_STREAMS_DIR', os.path.join(AUDIO_DIR, 'streams'))
 
+#: Layout of the files in the media files and streams directories. 'flat' keeps all files in the directory,
+#: 'hash' shards them by a hash prefix, e.g. ``ab/cd/<media file pk>/<stream file>``, and 'pk' shards streams by
+#: the media file pk, e.g. ``000/012/12345/<stream file>``. Media files and previews are sharded by their name hash
+#: in both sharded layouts. Run ``avlogue_relocate`` command to move the existing files after the layout is changed.
+STORAGE_LAYOUT = get_avlogue_setting('STORAGE_LAYOUT', 'flat')
+assert STORAGE_LAYOUT in ('flat', 'hash', 'pk'), 'AVLOGUE_STORAGE_LAYOUT must be "flat", "hash" or "pk"'
+
+#: Number of media files or streams relocated by a batch of ``avlogue_relocate`` command.
+RELOCATION_BATCH_SIZE = get_avlogue_setting('RELOCATION_BATCH_SIZE', 100)
+
 #: Temporary path for conversation task.
 TEMP_PATH = get_avlogue_setting('TEMP_PATH', '/tmp/avlogue')
 if not os.path.exists(TEMP_PATH):
@@ -63,6 +73,24 @@ if not os.path.exists(TEMP_PATH):
 
 assert os.access(TEMP_PATH, os.W_OK), 'AVlogue must have write access into `{}` temporary path'.format(TEMP_PATH)
 
+#: RAM backed scratch path, e.g. '/dev/shm/avlogue'. Conversion outputs, which are estimated to be smaller than
+#: AVLOGUE_SCRATCH_RAM_MAX_SIZE, are written there instead of the temporary path.
+SCRATCH_RAM_PATH = get_avlogue_setting('SCRATCH_RAM_PATH', None)
+
+#: Maximal estimated output size in bytes written to the RAM backed scratch path.
+SCRATCH_RAM_MAX_SIZE = get_avlogue_setting('SCRATCH_RAM_MAX_SIZE', 64 * 1024 * 1024)
+
+#: Free space in bytes, which must be left on the scratch path after the output of the estimated size is written.
+#: Conversion is postponed if the space is not enough.
+SCRATCH_MIN_FREE_SPACE = get_avlogue_setting('SCRATCH_MIN_FREE_SPACE', 0)
+
+#: Maximal total size in bytes of the outputs reserved by the running conversions on a scratch path,
+#: None is for no limit except the free space.
+SCRATCH_SPACE_BUDGET = get_avlogue_setting('SCRATCH_SPACE_BUDGET', None)
+
+#: Delay in seconds before a postponed conversion is retried.
+SCRATCH_RETRY_DELAY = get_avlogue_setting('SCRATCH_RETRY_DELAY', 60)
+
 #: Path to ffmpeg executable.
 FFMPEG_EXECUTABLE = get_avlogue_setting('FFMPEG_EXECUTABLE', 'ffmpeg')
 
@@ -124,3 +152,212 @@ MEDIA_STREAMS_STORAGE = get_avlogue_setting('MEDIA_STREAMS_STORAGE', default_sto
 #: Video preview image size.  If you'd like to keep the aspect ratio, you need to specify only one component,
 #: either width or height, and set the other component to -1.
 VIDEO_PREVIEW_SIZE = get_avlogue_setting('VIDEO_PREVIEW_SIZE', '-1:250')
+
+#: Encode video streams of sources, which are expensive to decode, from a fast-decoding intermediate (mezzanine)
+#: file. The mezzanine file is created once per source and is shared by all stream conversion tasks.
+MEZZANINE_ENABLED = get_avlogue_setting('MEZZANINE_ENABLED', False)
+
+#: Source video codecs which are expensive to decode.
+MEZZANINE_SOURCE_CODECS = get_avlogue_setting('MEZZANINE_SOURCE_CODECS', ('prores', 'hevc', 'dnxhd', 'vp9', 'av1'))
+
+#: Source video resolution (width * height) starting from which a source is expensive to decode.
+MEZZANINE_SOURCE_MIN_PIXELS = get_avlogue_setting('MEZZANINE_SOURCE_MIN_PIXELS', 3840 * 2160)
+
+#: ffmpeg params to encode mezzanine files.
+MEZZANINE_PARAMS = get_avlogue_setting(
+    'MEZZANINE_PARAMS', '-c:v libx264 -preset ultrafast -tune fastdecode -crf 10 -pix_fmt yuv420p -c:a pcm_s16le')
+
+#: Estimated bitrate per pixel of the mezzanine video in bits per second, it is used to reserve scratch space
+#: for the mezzanine file creation.
+MEZZANINE_PIXEL_BITRATE = get_avlogue_setting('MEZZANINE_PIXEL_BITRATE', 20)
+
+#: Mezzanine files directory.
+MEZZANINE_PATH = get_avlogue_setting('MEZZANINE_PATH', os.path.join(TEMP_PATH, 'mezzanine'))
+
+#: Time in seconds to keep mezzanine files after the last usage.
+MEZZANINE_RETENTION = get_avlogue_setting('MEZZANINE_RETENTION', 24 * 60 * 60)
+
+#: Max time in seconds of a mezzanine file creation, source file is used when a lock is older, e.g. of a crashed task.
+MEZZANINE_LOCK_TIMEOUT = get_avlogue_setting('MEZZANINE_LOCK_TIMEOUT', 6 * 60 * 60)
+
+#: Delay in seconds before a conversion, which waits for a mezzanine file being created by another task, is retried.
+MEZZANINE_RETRY_DELAY = get_avlogue_setting('MEZZANINE_RETRY_DELAY', 30)
+
+#: Analyse complexity of the source video with a fast probe encode of its segments
+#: and adapt video bitrate of the streams to the complexity.
+COMPLEXITY_ANALYSIS_ENABLED = get_avlogue_setting('COMPLEXITY_ANALYSIS_ENABLED', False)
+
+#: Number of the source segments to be encoded by the complexity analysis.
+COMPLEXITY_SAMPLE_SEGMENTS = get_avlogue_setting('COMPLEXITY_SAMPLE_SEGMENTS', 3)
+
+#: Duration in seconds of each segment to be encoded by the complexity analysis.
+COMPLEXITY_SAMPLE_DURATION = get_avlogue_setting('COMPLEXITY_SAMPLE_DURATION', 4)
+
+#: ffmpeg params of the complexity analysis probe encode.
+COMPLEXITY_PROBE_PARAMS = get_avlogue_setting('COMPLEXITY_PROBE_PARAMS',
+                                              '-vf scale=-2:240 -c:v libx264 -preset ultrafast -crf 23 -an')
+
+#: Probe encode bitrate of the content with complexity 1.0.
+COMPLEXITY_REFERENCE_BITRATE = get_avlogue_setting('COMPLEXITY_REFERENCE_BITRATE', 400000)
+
+#: Min and max factors to scale video bitrate of the formats by the source complexity.
+COMPLEXITY_BITRATE_FACTORS = get_avlogue_setting('COMPLEXITY_BITRATE_FACTORS', (0.5, 1.0))
+
+#: Get file info of MP4, Matroska/WebM and MP3 files by parsing their headers in python instead of running ffprobe.
+#: ffprobe is used for other files and for the files which headers can't be parsed.
+NATIVE_FILE_INFO_ENABLED = get_avlogue_setting('NATIVE_FILE_INFO_ENABLED', False)
+
+#: Probe in-memory and streaming uploads through ffprobe stdin pipe instead of writing them into temporary files.
+#: Temporary file is used only if the file format needs seeking.
+PIPE_PROBE_ENABLED = get_avlogue_setting('PIPE_PROBE_ENABLED', True)
+
+#: Max size in bytes of the file beginning to be fed into ffprobe pipe or to be parsed natively.
+PIPE_PROBE_MAX_SIZE = get_avlogue_setting('PIPE_PROBE_MAX_SIZE', 16 * 1024 * 1024)
+
+#: Chunked uploads directory in the media files storage.
+CHUNKED_UPLOADS_DIR = get_avlogue_setting('CHUNKED_UPLOADS_DIR', os.path.join(DIR, 'uploads'))
+
+#: Max size in bytes of a chunked upload, None for unlimited size.
+CHUNKED_UPLOAD_MAX_SIZE = get_avlogue_setting('CHUNKED_UPLOAD_MAX_SIZE', None)
+
+#: Max size in bytes of one chunk.
+CHUNKED_UPLOAD_CHUNK_MAX_SIZE = get_avlogue_setting('CHUNKED_UPLOAD_CHUNK_MAX_SIZE', 16 * 1024 * 1024)
+
+#: Size in bytes of the upload beginning, which is probed to reject invalid files before the upload is completed.
+CHUNKED_UPLOAD_PROBE_SIZE = get_avlogue_setting('CHUNKED_UPLOAD_PROBE_SIZE', 4 * 1024 * 1024)
+
+#: Time in seconds to keep chunked uploads after the last change.
+CHUNKED_UPLOAD_EXPIRATION = get_avlogue_setting('CHUNKED_UPLOAD_EXPIRATION', 24 * 60 * 60)
+
+#: Cache alias to cache rendered player html, None to disable the cache.
+PLAYER_CACHE_ALIAS = get_avlogue_setting('PLAYER_CACHE_ALIAS', 'default')
+
+#: Timeout in seconds of the rendered player html cache.
+PLAYER_CACHE_TIMEOUT = get_avlogue_setting('PLAYER_CACHE_TIMEOUT', 24 * 60 * 60)
+
+#: Store public urls of media files and streams in the database, so the player doesn't call the storage.
+#: Don't enable it for storages with expiring (signed) urls.
+STORE_FILE_URLS = get_avlogue_setting('STORE_FILE_URLS', False)
+
+#: Write JSON manifests of the media files playable streams to the streams storage, when streams are changed.
+MANIFESTS_ENABLED = get_avlogue_setting('MANIFESTS_ENABLED', False)
+
+#: Manifests directory of the streams storage.
+MANIFESTS_DIR = get_avlogue_setting('MANIFESTS_DIR', os.path.join(DIR, 'manifests'))
+
+#: Maximal number of media files in a streams API request.
+STREAMS_API_MAX_IDS = get_avlogue_setting('STREAMS_API_MAX_IDS', 100)
+
+#: Header to delegate files serving to the web server: 'X-Accel-Redirect' (nginx), 'X-Sendfile' (apache, lighttpd)
+#: or None to serve files by Django.
+SERVE_FILES_HEADER = get_avlogue_setting('SERVE_FILES_HEADER', None)
+
+#: nginx internal location of the storage root for X-Accel-Redirect.
+SERVE_FILES_ACCEL_PREFIX = get_avlogue_setting('SERVE_FILES_ACCEL_PREFIX', '/protected')
+
+#: Order player sources by the client hints (Save-Data, Downlink, ECT, Viewport-Width) if the template context
+#: has the request.
+PLAYER_CLIENT_HINTS_ENABLED = get_avlogue_setting('PLAYER_CLIENT_HINTS_ENABLED', True)
+
+#: Maximal stream bitrate for clients with Save-Data header.
+PLAYER_SAVE_DATA_MAX_BITRATE = get_avlogue_setting('PLAYER_SAVE_DATA_MAX_BITRATE', 400000)
+
+#: Maximal stream bitrates by the ECT (effective connection type) header.
+PLAYER_ECT_MAX_BITRATES = get_avlogue_setting('PLAYER_ECT_MAX_BITRATES', {
+    'slow-2g': 50000,
+    '2g': 150000,
+    '3g': 700000,
+})
+
+#: Part of the Downlink bandwidth to be used by the stream.
+PLAYER_DOWNLINK_USAGE = get_avlogue_setting('PLAYER_DOWNLINK_USAGE', 0.7)
+
+#: Maximal stream bitrate is rounded down to these steps, clients with bandwidth over the top step
+#: are not constrained.
+PLAYER_BITRATE_STEPS = get_avlogue_setting('PLAYER_BITRATE_STEPS', (150000, 400000, 800000, 1500000, 3000000,
+                                                                    6000000))
+
+#: Maximal video width is the Viewport-Width rounded up to these steps, wider viewports are not constrained.
+PLAYER_VIEWPORT_WIDTH_STEPS = get_avlogue_setting('PLAYER_VIEWPORT_WIDTH_STEPS', (480, 720, 1280, 1920))
+
+#: Skip sources, which don't fit the client constraints.
+PLAYER_LIMIT_SOURCES = get_avlogue_setting('PLAYER_LIMIT_SOURCES', False)
+
+#: Delete files of the deleted or changed media files and streams by a celery task after the transaction commit.
+ASYNC_DELETION_ENABLED = get_avlogue_setting('ASYNC_DELETION_ENABLED', False)
+
+#: Number of files deleted in one batch.
+ASYNC_DELETION_BATCH_SIZE = get_avlogue_setting('ASYNC_DELETION_BATCH_SIZE', 500)
+
+#: Delay in seconds of the first retry of a failed deletion, the delay is doubled on every attempt.
+ASYNC_DELETION_RETRY_DELAY = get_avlogue_setting('ASYNC_DELETION_RETRY_DELAY', 60)
+
+#: Limit concurrency of the stream conversions by the encode governor.
+GOVERNOR_ENABLED = get_avlogue_setting('GOVERNOR_ENABLED', False)
+
+#: Cache alias of the cluster wide conversion slots. Slots are local to the host if it is None,
+#: they are held by locked files then.
+GOVERNOR_CACHE_ALIAS = get_avlogue_setting('GOVERNOR_CACHE_ALIAS', None)
+
+#: Maximal number of the conversions running in the cluster, None is for no limit.
+GOVERNOR_GLOBAL_LIMIT = get_avlogue_setting('GOVERNOR_GLOBAL_LIMIT', None)
+
+#: Maximal number of the conversions by format or codec, e.g. {'format:h264 720p': 2, 'codec:vp8': 1}.
+GOVERNOR_QUOTAS = get_avlogue_setting('GOVERNOR_QUOTAS', {})
+
+#: Number of CPUs of a worker host used by the conversions, all CPUs by default.
+GOVERNOR_WORKER_CPUS = get_avlogue_setting('GOVERNOR_WORKER_CPUS', None)
+
+#: Maximal number of the conversions running on a worker host. Every conversion gets
+#: AVLOGUE_GOVERNOR_WORKER_CPUS / AVLOGUE_GOVERNOR_WORKER_ENCODES encoder threads.
+GOVERNOR_WORKER_ENCODES = get_avlogue_setting('GOVERNOR_WORKER_ENCODES', 2)
+
+#: Timeout in seconds of a cluster wide slot, slots of the crashed workers are released after it.
+GOVERNOR_SLOT_TIMEOUT = get_avlogue_setting('GOVERNOR_SLOT_TIMEOUT', 6 * 60 * 60)
+
+#: Delay in seconds before a conversion, which hasn't got a slot, is retried.
+GOVERNOR_RETRY_DELAY = get_avlogue_setting('GOVERNOR_RETRY_DELAY', 30)
+
+#: Directory of the host local slot files.
+GOVERNOR_PATH = get_avlogue_setting('GOVERNOR_PATH', os.path.join(TEMP_PATH, 'governor'))
+
+#: Policies of the encoder child processes by operations: 'probe', 'encode' (encodes, mezzanine files, clips and
+#: complexity analysis) and 'preview'. A policy is a dict with the keys: 'nice' (niceness increment),
+#: 'ionice' ('realtime', 'best-effort' or 'idle'), 'ionice_level' (0 - 7), 'cpu_affinity' (list of CPUs),
+#: 'rlimit_as' (address space limit in bytes) and 'rlimit_cpu' (CPU time limit in seconds),
+#: e.g. {'encode': {'nice': 10, 'ionice': 'idle'}}.
+PROCESS_POLICIES = get_avlogue_setting('PROCESS_POLICIES', {})
+
+#: Encoder params of the speed presets by video codecs.
+VIDEO_SPEED_PRESET_PARAMS = get_avlogue_setting('VIDEO_SPEED_PRESET_PARAMS', {
+    'h264': '-preset {}',
+    'vp8': '-cpu-used {}',
+})
+
+#: Number of the queued video streams, at which the fastest speed presets of the formats are used.
+SPEED_PRESETS_QUEUE_DEPTH = get_avlogue_setting('SPEED_PRESETS_QUEUE_DEPTH', 100)
+
+#: Age in seconds of the oldest queued video stream, at which the fastest speed presets of the formats are used.
+SPEED_PRESETS_QUEUE_AGE = get_avlogue_setting('SPEED_PRESETS_QUEUE_AGE', 60 * 60)
+
+#: Factors of the encode queue load by the format deadline classes.
+SPEED_PRESETS_DEADLINE_FACTORS = get_avlogue_setting('SPEED_PRESETS_DEADLINE_FACTORS', {
+    'urgent': 2.0,
+    'normal': 1.0,
+    'relaxed': 0.5,
+})
+
+#: Encode short audio streams by batches, see avlogue.batching.
+AUDIO_BATCH_ENABLED = get_avlogue_setting('AUDIO_BATCH_ENABLED', False)
+
+#: Maximal duration in seconds of the audio files, streams of which are encoded by batches.
+AUDIO_BATCH_MAX_DURATION = get_avlogue_setting('AUDIO_BATCH_MAX_DURATION', 60)
+
+#: Maximal number of the audio streams encoded by a batch task.
+AUDIO_BATCH_SIZE = get_avlogue_setting('AUDIO_BATCH_SIZE', 50)
+
+#: Number of the parallel encoder processes of a batch task.
+AUDIO_BATCH_CONCURRENCY = get_avlogue_setting('AUDIO_BATCH_CONCURRENCY', 4)
+
+#: Delay in seconds before the postponed streams of a batch are retried.
+AUDIO_BATCH_RETRY_DELAY = get_avlogue_setting('AUDIO_BATCH_RETRY_DELAY', 30)
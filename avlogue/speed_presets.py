@@ -0,0 +1,61 @@
+"""
+AVlogue load-adaptive encoder speed presets.
+
+Video formats can declare a range of encoder speed presets from the slowest to the fastest one. When the encode
+queue is long or old, conversions trade some compression efficiency for throughput and use faster presets.
+The deadline class of the format scales the queue load, so urgent formats speed up earlier than relaxed ones.
+"""
+import datetime
+
+from django.db.models import Count, Min
+from django.utils.timezone import now
+
+from avlogue import settings
+
+
+def get_queue_load(stream_cls):
+    """
+    Returns load of the encode queue: 0.0 if the queue is empty, 1.0 if the number of the queued streams is
+    AVLOGUE_SPEED_PRESETS_QUEUE_DEPTH or the oldest queued stream waits for AVLOGUE_SPEED_PRESETS_QUEUE_AGE seconds.
+
+    :param stream_cls: stream model
+    :rtype: float
+    """
+    # Streams, which have been waiting for more than a day, are considered lost and are not counted
+    queue = stream_cls.objects.filter(status=stream_cls.CONVERSION_PREPARATION,
+                                      created__gte=now() - datetime.timedelta(days=1)) \
+        .aggregate(depth=Count('pk'), oldest=Min('created'))
+    load = queue['depth'] / float(settings.SPEED_PRESETS_QUEUE_DEPTH)
+    if queue['oldest'] is not None:
+        age = (now() - queue['oldest']).total_seconds()
+        load = max(load, age / float(settings.SPEED_PRESETS_QUEUE_AGE))
+    return load
+
+
+def get_speed_presets(encode_format):
+    """
+    Returns speed presets of the format from the slowest to the fastest one.
+
+    :param encode_format:
+    :type encode_format: avlogue.models.VideoFormat
+    :rtype: list
+    """
+    return [preset.strip() for preset in (encode_format.video_speed_presets or '').split(',') if preset.strip()]
+
+
+def select_speed_preset(encode_format, load):
+    """
+    Returns speed preset of the format for the queue load or None if the format has no speed presets.
+
+    :param encode_format:
+    :type encode_format: avlogue.models.VideoFormat
+    :param load: encode queue load
+    :type load: float
+    :rtype: str
+    """
+    presets = get_speed_presets(encode_format)
+    if not presets:
+        return None
+    load *= settings.SPEED_PRESETS_DEADLINE_FACTORS.get(encode_format.deadline_class, 1.0)
+    index = min(len(presets) - 1, int(load * (len(presets) - 1)))
+    return presets[max(index, 0)]
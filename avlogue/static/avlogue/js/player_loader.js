@@ -0,0 +1,99 @@
+/*
+ * AVlogue player loader.
+ *
+ * Builds audio/video players from the stream manifests, so pages with players can be served without Django:
+ *
+ *     <div data-avlogue-manifest="{% avlogue_manifest_url video %}" data-formats="vp8 WebM, h264 360p"></div>
+ *     <script src="{% static 'avlogue/js/player_loader.js' %}"></script>
+ *
+ * Streams can be filtered by data-formats (comma separated format names), data-min-bitrate and data-max-bitrate
+ * attributes. Players are loaded on DOMContentLoaded, call avlogue.loadPlayers(root) for dynamically added elements.
+ */
+(function (window, document) {
+    'use strict';
+
+    function splitNames(names) {
+        if (!names) {
+            return null;
+        }
+        return names.split(',').map(function (name) {
+            return name.trim();
+        });
+    }
+
+    function filterStreams(streams, container) {
+        var formats = splitNames(container.getAttribute('data-formats')),
+            minBitrate = container.getAttribute('data-min-bitrate'),
+            maxBitrate = container.getAttribute('data-max-bitrate');
+
+        return streams.filter(function (stream) {
+            if (formats !== null && formats.indexOf(stream.format) === -1) {
+                return false;
+            }
+            if (minBitrate !== null && !(stream.bitrate >= parseInt(minBitrate, 10))) {
+                return false;
+            }
+            return maxBitrate === null || stream.bitrate <= parseInt(maxBitrate, 10);
+        });
+    }
+
+    function buildPlayer(manifest, container) {
+        var player = document.createElement(manifest.type),
+            streams = filterStreams(manifest.streams, container);
+
+        player.className = 'avlogue-player avlogue-' + manifest.type + ' avlogue-' + manifest.type + '-' + manifest.id;
+        player.controls = true;
+        if (manifest.preview) {
+            player.poster = manifest.preview;
+        }
+        if (streams.length) {
+            streams.forEach(function (stream) {
+                var source = document.createElement('source');
+                source.src = stream.url;
+                if (stream.content_type) {
+                    source.type = stream.content_type;
+                }
+                player.appendChild(source);
+            });
+        } else {
+            player.src = manifest.url;
+        }
+        return player;
+    }
+
+    function loadPlayer(container) {
+        var request = new XMLHttpRequest();
+
+        container.setAttribute('data-avlogue-loading', 'true');
+        request.open('GET', container.getAttribute('data-avlogue-manifest'));
+        request.onload = function () {
+            container.removeAttribute('data-avlogue-loading');
+            if (request.status === 200) {
+                container.appendChild(buildPlayer(JSON.parse(request.responseText), container));
+            }
+        };
+        request.send();
+    }
+
+    function loadPlayers(root) {
+        var containers = (root || document).querySelectorAll('[data-avlogue-manifest]:not([data-avlogue-loading])'),
+            i;
+
+        for (i = 0; i < containers.length; i++) {
+            if (!containers[i].querySelector('audio, video')) {
+                loadPlayer(containers[i]);
+            }
+        }
+    }
+
+    window.avlogue = window.avlogue || {};
+    window.avlogue.loadPlayers = loadPlayers;
+
+    if (document.readyState === 'loading') {
+        document.addEventListener('DOMContentLoaded', function () {
+            loadPlayers();
+        });
+    } else {
+        loadPlayers();
+    }
+}(window, document));
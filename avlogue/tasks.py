@@ -9,7 +9,11 @@ from django.core import files
 from django.db import DatabaseError
 from django.utils.text import slugify
 
+from avlogue import governor
+from avlogue import mezzanine
+from avlogue import scratch
 from avlogue import settings
+from avlogue import uploads
 from avlogue.encoders import default_encoder
 
 
@@ -18,6 +22,11 @@ def encode_stream(self, stream_cls, stream_pk):
     logger = logging.getLogger('avlogue')
     stream = stream_cls.objects.filter(pk=stream_pk).first()
 
+    from avlogue import batching
+    if stream is not None and batching.is_claimed(stream):
+        # Stream is being encoded by a batch
+        return
+
     if stream is not None:
         from avlogue.models import AudioStream
         if issubclass(stream_cls, AudioStream):
@@ -26,33 +35,61 @@ def encode_stream(self, stream_cls, stream_pk):
         else:
             stream_type = None
 
-        stream.conversion_task_id = self.request.id
-        stream.status = stream.CONVERSION_IN_PROGRESS
-        try:
-            stream.save(force_update=True)
-        except DatabaseError:
-            # Stream was deleted
-            return
-
+        encode_format = stream.get_encode_format()
+        estimated_size = scratch.estimate_output_size(stream.media_file, encode_format)
         output_filename = os.path.splitext(os.path.basename(stream.media_file.file.name))[0]
         output_filename = '{}_{}.{}'.format(output_filename, slugify(stream.format.name), stream.format.container)
-        output_file = os.path.join(settings.TEMP_PATH, output_filename)
 
         try:
-            default_encoder.encode(stream.media_file, output_file, stream.format)
-
-            stream.file = files.File(open(output_file, 'rb'))
-            stream_file_info = default_encoder.get_file_info(output_file, stream_type)
-            for field_name, value in stream_file_info.items():
-                setattr(stream, field_name, value)
-            stream.status = stream.CONVERSION_SUCCESSFUL
-            stream.conversion_task_id = None
-            try:
-                stream.save(force_update=True)
-            except DatabaseError:
-                # Stream was deleted
-                return
+            # Space for the output is reserved and conversion slots are acquired before the conversion is started
+            with scratch.scratch_directory(estimated_size) as scratch_dir, \
+                    governor.encode_slot(encode_format) as threads:
+                scratch.check_storage_space(settings.MEDIA_STREAMS_STORAGE, estimated_size)
+                input_file = mezzanine.get_input_file(stream.media_file, threads=threads)
+
+                stream.conversion_task_id = self.request.id
+                stream.status = stream.CONVERSION_IN_PROGRESS
+                try:
+                    stream.save(force_update=True)
+                except DatabaseError:
+                    # Stream was deleted
+                    return
+
+                output_file = os.path.join(scratch_dir, output_filename)
+                default_encoder.encode(stream.media_file, output_file, encode_format, input_file=input_file,
+                                       threads=threads)
+
+                stream_file_info = default_encoder.get_file_info(output_file, stream_type)
+                for field_name, value in stream_file_info.items():
+                    setattr(stream, field_name, value)
+                stream.status = stream.CONVERSION_SUCCESSFUL
+                stream.conversion_task_id = None
+                # File is closed before the scratch directory is deleted, so RAM backed space is freed
+                with open(output_file, 'rb') as f:
+                    stream.file = files.File(f)
+                    try:
+                        stream.save(force_update=True)
+                    except DatabaseError:
+                        # Stream was deleted
+                        return
         except Exception as e:
+            if isinstance(e, scratch.ScratchSpaceError):
+                # Conversion hasn't been started, it is requeued until other conversions free the space,
+                # however long it takes
+                logger.warning('Conversion of {} is postponed: {}'.format(repr(stream), str(e)))
+                encode_stream.apply_async((stream_cls, stream_pk), countdown=settings.SCRATCH_RETRY_DELAY)
+                return
+            if isinstance(e, governor.GovernorBusy):
+                # Conversion hasn't been started, it is requeued, so it waits for a free slot as long as it is needed
+                logger.info('Conversion of {} is postponed: {}'.format(repr(stream), str(e)))
+                encode_stream.apply_async((stream_cls, stream_pk), countdown=settings.GOVERNOR_RETRY_DELAY)
+                return
+            if isinstance(e, mezzanine.MezzanineBusy):
+                # Conversion hasn't been started, it is requeued instead of blocking the worker until the mezzanine
+                # file is created by another task
+                logger.info('Conversion of {} is postponed: {}'.format(repr(stream), str(e)))
+                encode_stream.apply_async((stream_cls, stream_pk), countdown=settings.MEZZANINE_RETRY_DELAY)
+                return
             logger.error('Conversion of {} failed.\nException:\n{}'.format(repr(stream), str(e)))
             stream.status = stream.CONVERSION_FAILURE
             try:
@@ -61,7 +98,103 @@ def encode_stream(self, stream_cls, stream_pk):
                 # Stream was deleted
                 return
             raise e
-        finally:
-            # remove temporary file
-            if output_file is not None and os.path.exists(output_file):
-                os.remove(output_file)
+
+
+@shared_task
+def analyse_complexity(video_pk, stream_pks):
+    """
+    Analyses complexity of the video once and converts the streams, which have been waiting for it.
+    """
+    from avlogue.models import Video, VideoStream
+    video = Video.objects.filter(pk=video_pk).first()
+    if video is None:
+        return
+    if video.complexity is None:
+        video.update_complexity()
+    for stream in VideoStream.objects.filter(pk__in=stream_pks, media_file=video):
+        stream.media_file = video
+        stream.convert()
+
+
+@shared_task(bind=True)
+def encode_audio_batch(self):
+    """
+    Encodes a batch of the queued short audio streams and queues the next batch if there can be more queued streams.
+    Run it periodically too, e.g. with celery beat, to encode streams of the lost batch tasks.
+    """
+    from avlogue import batching
+    claimed_count, postponed_count = batching.encode_batch(self.request.id)
+    if postponed_count:
+        encode_audio_batch.apply_async(countdown=settings.AUDIO_BATCH_RETRY_DELAY)
+    elif claimed_count == settings.AUDIO_BATCH_SIZE:
+        encode_audio_batch.delay()
+
+
+@shared_task
+def create_clip(media_file_cls, media_file_pk, start, end, title=None):
+    """
+    Creates a clip of the media file, the clip streams are converted by their own tasks.
+    """
+    media_file = media_file_cls.objects.filter(pk=media_file_pk).first()
+    if media_file is not None:
+        media_file.create_clip(start, end, title=title)
+
+
+@shared_task
+def delete_expired_mezzanines():
+    """
+    Deletes unused mezzanine files. The task should be run periodically, e.g. with celery beat.
+    """
+    mezzanine.delete_expired_mezzanines()
+
+
+@shared_task
+def finalize_chunked_upload(upload_pk):
+    """
+    Creates Audio or Video from the completed chunked upload.
+    """
+    logger = logging.getLogger('avlogue')
+    from avlogue.models import ChunkedUpload
+    upload = ChunkedUpload.objects.filter(pk=upload_pk).first()
+
+    if upload is not None:
+        try:
+            media_file = uploads.finalize(upload)
+        except Exception as e:
+            logger.error('Finalization of {} failed.\nException:\n{}'.format(repr(upload), str(e)))
+            upload.status = upload.UPLOAD_FAILURE
+            upload.error = str(e)
+            upload.save(update_fields=['status', 'error', 'modified'])
+        else:
+            upload.status = upload.UPLOAD_COMPLETED
+            upload.media_file_id = media_file.pk
+            upload.save(update_fields=['status', 'media_file_id', 'modified'])
+
+
+@shared_task
+def delete_expired_chunked_uploads():
+    """
+    Deletes expired chunked uploads. The task should be run periodically, e.g. with celery beat.
+    """
+    uploads.delete_expired_uploads()
+
+
+@shared_task
+def delete_pending_files():
+    """
+    Deletes files of the media files and streams, which have been deleted or changed.
+    The task is run after the commit, also run it periodically to retry failed deletions, e.g. with celery beat.
+    """
+    from avlogue import deletion
+    deletion.delete_pending_files()
+
+
+@shared_task
+def relocate_files(model, field_names, last_pk=0, batch_size=None):
+    """
+    Relocates files of a batch of the model rows to AVLOGUE_STORAGE_LAYOUT directories and queues the next batch.
+    """
+    from avlogue import relocation
+    last_pk = relocation.relocate_batch(model, field_names, last_pk, batch_size)[0]
+    if last_pk is not None:
+        relocate_files.delay(model, field_names, last_pk, batch_size)
@@ -1,16 +1,23 @@
 from django.template import Library
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
 
+from avlogue import client_hints
+from avlogue import manifests
+from avlogue import player_cache
+from avlogue import settings
+from avlogue import utils
 from avlogue.models import Audio, Video
 
 register = Library()
 
 
-@register.inclusion_tag('avlogue/player_tag.html')
 def avlogue_player(media_file, formats=None, format_sets=None, bitrate=None, min_bitrate=None, max_bitrate=None,
-                   **kwargs):
+                   constraints=None, **kwargs):
     """
-    Player template tag for audio and video. Streams can be filtered by comma separated formats/format_sets names
-    and bitrate value. Other kwargs params will be added to the template tag as attributes.
+    Player template tag for audio and video. Only successfully converted streams are played, they can be filtered
+    by comma separated formats/format_sets names and bitrate value. Other kwargs params will be added to the template tag as attributes.
+    Streams prefetched by with_playable_streams() queryset method are filtered without database queries.
 
     :param media_file: Video or Audio
     :type media_file: avlogue.models.MediaFile
@@ -24,21 +31,17 @@ def avlogue_player(media_file, formats=None, format_sets=None, bitrate=None, min
     :type min_bitrate: int
     :param max_bitrate: streams maximal bitrate
     :type max_bitrate: int
+    :param constraints: client constraints, streams are ordered by them, see avlogue.client_hints.get_constraints
+    :type constraints: tuple
     :param kwargs: additional attributes for html element
     :return:
     """
 
     def filter_streams_by_formats(streams, formats):
-        format_names = []
-        for format_name in formats.split(','):
-            format_names.append(format_name.strip())
-        return streams.filter(format__name__in=format_names)
+        return streams.filter(format__name__in=utils.split_names(formats))
 
     def filter_streams_by_format_sets(streams, format_sets):
-        format_set_names = []
-        for format_set_name in format_sets.split(','):
-            format_set_names.append(format_set_name.strip())
-        return streams.filter(format__format_sets__name__in=format_set_names)
+        return streams.filter(format__format_sets__name__in=utils.split_names(format_sets))
 
     def filter_streams_by_bitrate(streams, bitrate=None, min_bitrate=None, max_bitrate=None):
         if bitrate is not None:
@@ -49,6 +52,30 @@ def avlogue_player(media_file, formats=None, format_sets=None, bitrate=None, min
             streams = streams.filter(bitrate__lte=max_bitrate)
         return streams
 
+    def filter_prefetched_streams(streams):
+        """
+        Filters streams prefetched by with_playable_streams() without database queries.
+        """
+        format_names = utils.split_names(formats)
+        format_set_names = utils.split_names(format_sets)
+        filtered_streams = []
+        for stream in streams:
+            if format_names is not None and stream.format.name not in format_names:
+                continue
+            if format_set_names is not None and \
+                    not any(format_set.name in format_set_names for format_set in stream.format.format_sets.all()):
+                continue
+            if bitrate is not None:
+                if stream.bitrate != int(bitrate):
+                    continue
+            elif stream.bitrate is None and (min_bitrate is not None or max_bitrate is not None):
+                continue
+            elif (min_bitrate is not None and stream.bitrate < int(min_bitrate)) or \
+                    (max_bitrate is not None and stream.bitrate > int(max_bitrate)):
+                continue
+            filtered_streams.append(stream)
+        return filtered_streams
+
     context = {}
     if isinstance(media_file, Audio):
         context['tag'] = 'audio'
@@ -58,14 +85,20 @@ def avlogue_player(media_file, formats=None, format_sets=None, bitrate=None, min
         raise TypeError('media_file must be instance of Audio or Video')
     context['media_file'] = media_file
 
-    streams = media_file.streams
-    if formats is not None:
-        streams = filter_streams_by_formats(streams, formats)
-    if format_sets is not None:
-        streams = filter_streams_by_format_sets(streams, format_sets)
-    streams = filter_streams_by_bitrate(streams, bitrate, min_bitrate, max_bitrate)
-
-    context['streams'] = streams.all()
+    prefetched_streams = getattr(media_file, '_prefetched_objects_cache', {}).get('streams')
+    if prefetched_streams is not None:
+        context['streams'] = filter_prefetched_streams(prefetched_streams)
+    else:
+        # Sources are in the order of the streams creation, index scans don't give a stable order
+        streams = media_file.streams.playable().order_by('pk')
+        if formats is not None:
+            streams = filter_streams_by_formats(streams, formats)
+        if format_sets is not None:
+            streams = filter_streams_by_format_sets(streams, format_sets)
+        streams = filter_streams_by_bitrate(streams, bitrate, min_bitrate, max_bitrate)
+        context['streams'] = streams.all()
+    if constraints is not None:
+        context['streams'] = client_hints.order_streams(context['streams'], constraints)
 
     attrs = {
         'controls': 'controls',
@@ -76,3 +109,54 @@ def avlogue_player(media_file, formats=None, format_sets=None, bitrate=None, min
     context['attrs'] = attrs
 
     return context
+
+
+def render_player(media_file, **kwargs):
+    """
+    Renders player html. Rendered html is cached until the media file, its streams or formats are changed.
+    Params are the same as avlogue_player params.
+
+    :param media_file: Video or Audio
+    :type media_file: avlogue.models.MediaFile
+    :rtype: str
+    """
+    if not isinstance(media_file, (Audio, Video)):
+        raise TypeError('media_file must be instance of Audio or Video')
+
+    cache = player_cache.get_cache()
+    if cache is None:
+        return mark_safe(render_to_string('avlogue/player_tag.html', avlogue_player(media_file, **kwargs)))
+
+    # Streams prefetched by with_playable_streams() can be limited to some formats, html depends on them
+    prefetched_streams = getattr(media_file, '_prefetched_objects_cache', {}).get('streams')
+    stream_pks = [stream.pk for stream in prefetched_streams] if prefetched_streams is not None else None
+    cache_key = player_cache.get_cache_key(media_file, kwargs, stream_pks)
+    html = cache.get(cache_key)
+    if html is None:
+        html = render_to_string('avlogue/player_tag.html', avlogue_player(media_file, **kwargs))
+        cache.set(cache_key, html, settings.PLAYER_CACHE_TIMEOUT)
+    return mark_safe(html)
+
+
+@register.simple_tag(name='avlogue_player', takes_context=True)
+def avlogue_player_tag(context, media_file, **kwargs):
+    """
+    Player template tag for audio and video, see avlogue_player for params.
+    Sources are ordered by the client hints of the context request.
+    """
+    request = context.get('request')
+    if request is not None and settings.PLAYER_CLIENT_HINTS_ENABLED:
+        constraints = client_hints.get_constraints(request)
+        if constraints is not None:
+            kwargs['constraints'] = constraints
+    return render_player(media_file, **kwargs)
+
+
+@register.simple_tag
+def avlogue_manifest_url(media_file):
+    """
+    Returns url of the media file manifest to load the player by avlogue/js/player_loader.js.
+    """
+    if not isinstance(media_file, (Audio, Video)):
+        raise TypeError('media_file must be instance of Audio or Video')
+    return manifests.get_manifest_url(media_file)
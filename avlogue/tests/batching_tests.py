@@ -0,0 +1,106 @@
+"""
+AVlogue micro-batched encoding test cases.
+"""
+import mock
+from django.test import TestCase
+
+from avlogue import batching
+from avlogue import settings
+from avlogue import tasks
+from avlogue import utils
+from avlogue.encoders import default_encoder
+from avlogue.models import Audio, AudioFormat, AudioStream
+from avlogue.tests import mocks
+
+
+def encode(media_file, output_file, encode_format, input_file=None, threads=None):
+    if encode_format.container == 'wav':
+        raise Exception('Encoding failed.')
+    with open(output_file, 'wb') as f:
+        f.write(b'data')
+
+
+class BatchingTestCase(TestCase):
+    fixtures = ['media-formats.json']
+
+    def setUp(self):
+        self.audio = mocks.get_mock_media_file('batching.mp3', Audio, AudioFormat.objects.filter(
+            name__in=('mp3', 'ogg', 'wav')))
+        Audio.objects.filter(pk=self.audio.pk).update(duration=30)
+        self.audio.refresh_from_db()
+        AudioStream.objects.filter(media_file=self.audio).update(status=AudioStream.CONVERSION_PREPARATION,
+                                                                 file='')
+
+    def test_bulk_update(self):
+        """
+        Tests that fields of the instances are updated by CASE WHEN expressions.
+        """
+        streams = list(self.audio.streams.order_by('pk'))
+        for i, stream in enumerate(streams):
+            stream.size = i + 1
+            stream.status = AudioStream.CONVERSION_FAILURE
+        updated_count = utils.bulk_update(AudioStream.objects.exclude(pk=streams[0].pk), streams, ('size', 'status'))
+        self.assertEqual(updated_count, 2)
+        self.assertEqual(list(self.audio.streams.order_by('pk').values_list('size', flat=True))[1:], [2, 3])
+        self.assertEqual(self.audio.streams.filter(status=AudioStream.CONVERSION_FAILURE).count(), 2)
+
+    def test_convert(self):
+        """
+        Tests that short audio streams are not converted by their own tasks.
+        """
+        stream = self.audio.streams.all()[0]
+        # Django 1.8 queues the batch task right away
+        with mock.patch.object(tasks.encode_stream, 'delay') as encode_stream_mock, \
+                mock.patch.object(tasks.encode_audio_batch, 'delay'):
+            with mock.patch.object(settings, 'AUDIO_BATCH_ENABLED', True):
+                self.assertIsNone(stream.convert())
+                with mock.patch.object(settings, 'AUDIO_BATCH_MAX_DURATION', 10):
+                    stream.convert()
+        encode_stream_mock.assert_called_once_with(AudioStream, stream.pk)
+
+    @mock.patch.object(settings, 'AUDIO_BATCH_ENABLED', True)
+    def test_encode_batch(self):
+        """
+        Tests that a batch is claimed, encoded and recorded, and failed streams are marked as failed.
+        """
+        streams_version = self.audio.streams_version
+        with mock.patch.object(default_encoder, 'encode', encode), \
+                mock.patch.object(default_encoder, 'get_file_info', mocks.get_file_info):
+            self.assertEqual(batching.encode_batch('batch-task'), (3, 0))
+        self.assertEqual(batching.encode_batch('batch-task'), (0, 0))
+
+        streams = dict((stream.format.container, stream) for stream in self.audio.streams.select_related('format'))
+        for container in ('mp3', 'ogg'):
+            stream = streams[container]
+            self.addCleanup(stream.file.storage.delete, stream.file.name)
+            self.assertEqual(stream.status, AudioStream.CONVERSION_SUCCESSFUL)
+            self.assertIsNone(stream.conversion_task_id)
+            self.assertTrue(stream.file.storage.exists(stream.file.name))
+            self.assertIsNotNone(stream.duration)
+        self.assertEqual(streams['wav'].status, AudioStream.CONVERSION_FAILURE)
+        self.assertFalse(streams['wav'].file.name)
+        # Streams version is incremented by the claim and by the results
+        self.audio.refresh_from_db()
+        self.assertEqual(self.audio.streams_version, streams_version + 2)
+
+    @mock.patch.object(settings, 'AUDIO_BATCH_ENABLED', True)
+    def test_dropped_results(self):
+        """
+        Tests that results of the streams converted again meanwhile and postponed streams are not recorded.
+        """
+        streams = batching.claim_streams('batch-task')
+        self.assertEqual(len(streams), 3)
+        self.assertTrue(batching.is_claimed(streams[0]))
+        # Stream has been converted again, the batch is not run by it on Django 1.8 with eager tasks
+        with mock.patch.object(batching, 'schedule_batch'):
+            AudioStream.objects.get(pk=streams[0].pk).convert()
+
+        updated = batching.record_results('batch-task', streams,
+                                          [batching.FAILED, batching.FAILED, batching.POSTPONED])
+        self.assertEqual([stream.pk for stream in updated], [stream.pk for stream in streams[1:]])
+        statuses = dict(AudioStream.objects.filter(media_file=self.audio).values_list('pk', 'status'))
+        self.assertEqual([statuses[stream.pk] for stream in streams],
+                         [AudioStream.CONVERSION_PREPARATION, AudioStream.CONVERSION_FAILURE,
+                          AudioStream.CONVERSION_PREPARATION])
+        self.assertEqual(list(batching.get_queued_streams().values_list('pk', flat=True).order_by('pk')),
+                         [streams[0].pk, streams[2].pk])
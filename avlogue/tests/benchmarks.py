@@ -0,0 +1,138 @@
+"""
+AVlogue benchmarks.
+
+Benchmarks are not run with the tests, run them with:
+
+    python -m avlogue.tests.benchmarks [benchmark ...]
+"""
+import argparse
+import contextlib
+import os
+import timeit
+
+import django
+
+
+@contextlib.contextmanager
+def test_database():
+    """
+    Creates test database for the benchmark.
+    """
+    from django.db import connection
+
+    test_database_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(test_database_name, verbosity=0)
+
+
+def benchmark_file_info(repeat):
+    """
+    Compares get_file_info with native headers parsing and with ffprobe.
+    """
+    from avlogue import settings
+    from avlogue.encoders import FFMpegEncoder
+    from avlogue.encoders import headers
+    from avlogue.models import AudioFormat, VideoFormat
+    from avlogue.tests import factories
+
+    encoder = FFMpegEncoder()
+    file_factories = (
+        (factories.video_file_factory, VideoFormat(name='mp4', container='mp4', video_codec='h264',
+                                                   audio_codec='aac', video_width=640, video_height=360)),
+        (factories.video_file_factory, VideoFormat(name='webm', container='webm', video_codec='vp8',
+                                                   audio_codec='vorbis', video_width=640, video_height=360)),
+        (factories.audio_file_factory, AudioFormat(name='mp3', container='mp3', audio_codec='mp3')),
+    )
+    for file_factory, encode_format in file_factories:
+        with file_factory(file_name='benchmark_file_info', encode_format=encode_format,
+                          duration=60, output_dir=settings.TEMP_PATH) as path:
+            native_time = timeit.timeit(lambda: headers.get_file_info(path), number=repeat)
+            probe_time = timeit.timeit(lambda: encoder._probe(path), number=repeat)
+            print('{:<6} native: {:8.3f} ms, ffprobe: {:8.3f} ms, speedup: {:.1f}x'.format(
+                encode_format.name, native_time * 1000 / repeat, probe_time * 1000 / repeat,
+                probe_time / native_time))
+
+
+def benchmark_playable_streams(repeat, rows=1000000, formats_count=10):
+    """
+    Prints query plans and timings of the playable streams queries on a test database with a million streams.
+    """
+    from django.db import connection
+    from django.utils.text import slugify
+
+    from avlogue.models import Video, VideoFormat, VideoStream
+
+    with test_database():
+        formats = VideoFormat.objects.bulk_create(
+            VideoFormat(name='benchmark {}'.format(i), container='mp4', video_codec='h264', audio_codec='aac')
+            for i in range(formats_count))
+        formats = list(VideoFormat.objects.filter(name__in=[f.name for f in formats]))
+        Video.objects.bulk_create((Video(title='benchmark {}'.format(i), slug=slugify('benchmark {}'.format(i)))
+                                   for i in range(rows // formats_count)), batch_size=1000)
+        video_ids = list(Video.objects.values_list('id', flat=True))
+        statuses = (VideoStream.CONVERSION_SUCCESSFUL,) * 8 + (VideoStream.CONVERSION_FAILURE,
+                                                               VideoStream.CONVERSION_IN_PROGRESS)
+        VideoStream.objects.bulk_create((VideoStream(media_file_id=video_id, format=encode_format,
+                                                     status=statuses[(video_id + i) % len(statuses)],
+                                                     bitrate=(i + 1) * 100000)
+                                         for video_id in video_ids for i, encode_format in enumerate(formats)),
+                                        batch_size=1000)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+        video = Video.objects.get(pk=video_ids[len(video_ids) // 2])
+        queries = (
+            ('player', lambda: video.streams.playable().filter(bitrate__lte=500000)),
+            ('dashboard', lambda: VideoStream.objects.playable().order_by('-created')[:50]),
+        )
+        for name, get_queryset in queries:
+            queryset = get_queryset()
+            sql, params = queryset.query.sql_with_params()
+            with connection.cursor() as cursor:
+                cursor.execute('EXPLAIN {}'.format(sql) if connection.vendor != 'sqlite' else
+                               'EXPLAIN QUERY PLAN {}'.format(sql), params)
+                plan = '\n'.join(str(row[-1]) for row in cursor.fetchall())
+            query_time = timeit.timeit(lambda: list(get_queryset()), number=repeat)
+            print('{:<10} {:8.3f} ms\n{}'.format(name, query_time * 1000 / repeat, plan))
+
+
+def benchmark_model_loading(repeat, rows=100000):
+    """
+    Compares loading of media files with the lazy file change tracking and with FieldFile created
+    for every instance, as the change tracking did before.
+    """
+    from django.utils.text import slugify
+
+    from avlogue.models import Video
+
+    with test_database():
+        Video.objects.bulk_create((Video(title='benchmark {}'.format(i), slug=slugify('benchmark {}'.format(i)),
+                                         file='avlogue/video/benchmark_{}.mp4'.format(i))
+                                   for i in range(rows)), batch_size=1000)
+        queryset = Video.objects.all()
+        lazy_time = timeit.timeit(lambda: list(queryset.all()), number=repeat)
+        eager_time = timeit.timeit(lambda: [video.file for video in queryset.all()], number=repeat)
+        print('{} rows lazy: {:8.3f} ms, eager FieldFile: {:8.3f} ms, speedup: {:.2f}x'.format(
+            rows, lazy_time * 1000 / repeat, eager_time * 1000 / repeat, eager_time / lazy_time))
+
+
+BENCHMARKS = {
+    'file_info': benchmark_file_info,
+    'model_loading': benchmark_model_loading,
+    'playable_streams': benchmark_playable_streams,
+}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Runs AVlogue benchmarks.')
+    parser.add_argument('benchmarks', nargs='*', choices=sorted(BENCHMARKS.keys()), default=sorted(BENCHMARKS.keys()))
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'avlogue.tests.settings.tests')
+    django.setup()
+    for name in args.benchmarks:
+        print('Benchmark: {}'.format(name))
+        BENCHMARKS[name](args.repeat)
@@ -0,0 +1,106 @@
+"""
+AVlogue storage files deletion test cases.
+"""
+import datetime
+
+import mock
+from django.core.files.base import ContentFile
+from django.db import connection, transaction
+from django.test import TestCase
+from django.utils.timezone import now
+
+from avlogue import deletion
+from avlogue import settings
+from avlogue import tasks
+from avlogue.models import Audio, AudioFormat, PendingDeletion
+from avlogue.tests import mocks
+
+
+class DeletionTestCase(TestCase):
+    fixtures = ['media-formats.json']
+
+    def setUp(self):
+        patcher = mock.patch.object(settings, 'ASYNC_DELETION_ENABLED', True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # Django 1.8 queues the task right away, eager task would delete the files
+        patcher = mock.patch.object(tasks.delete_pending_files, 'delay')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.storage = settings.MEDIA_STREAMS_STORAGE
+
+    def save_files(self, count):
+        names = []
+        for i in range(count):
+            name = self.storage.save('avlogue/test_deletion_{}.txt'.format(i), ContentFile(b'data'))
+            self.addCleanup(self.storage.delete, name)
+            names.append(name)
+        return names
+
+    def test_delete_files(self):
+        names = self.save_files(3)
+        deletion.delete_files(self.storage, names)
+        # Files are deleted by the task after the commit
+        for name in names:
+            self.assertTrue(self.storage.exists(name))
+        self.assertEqual(set(PendingDeletion.objects.values_list('name', flat=True)), set(names))
+
+        with mock.patch.object(settings, 'ASYNC_DELETION_BATCH_SIZE', 2):
+            self.assertEqual(deletion.delete_pending_files(), 3)
+        for name in names:
+            self.assertFalse(self.storage.exists(name))
+        self.assertFalse(PendingDeletion.objects.exists())
+
+    def test_retry(self):
+        names = self.save_files(2)
+        deletion.delete_files(self.storage, names)
+
+        def delete(name):
+            if name == names[0]:
+                raise OSError('Storage is not available.')
+
+        with mock.patch.object(self.storage, 'delete', side_effect=delete):
+            self.assertEqual(deletion.delete_pending_files(), 1)
+        tombstone = PendingDeletion.objects.get()
+        self.assertEqual((tombstone.name, tombstone.attempts), (names[0], 1))
+        self.assertIn('Storage is not available.', tombstone.error)
+        self.assertGreater(tombstone.next_attempt, now())
+
+        # Tombstone is retried when it is due
+        self.assertEqual(deletion.delete_pending_files(), 0)
+        PendingDeletion.objects.update(next_attempt=now() - datetime.timedelta(seconds=1))
+        self.assertEqual(deletion.delete_pending_files(), 1)
+        self.assertFalse(self.storage.exists(names[0]))
+
+    def test_bulk_delete(self):
+        storage = mock.Mock(spec=['delete', 'delete_many'])
+        storage.delete_many.return_value = {}
+        with mock.patch.object(deletion, 'get_storages', return_value={'media': storage}):
+            deletion.delete_files(storage, ['file1', 'file2'])
+            self.assertEqual(deletion.delete_pending_files(), 2)
+        storage.delete_many.assert_called_once_with(['file1', 'file2'])
+        self.assertFalse(storage.delete.called)
+
+    def test_media_file_delete(self):
+        audio = mocks.get_mock_media_file('media_file.mp3', Audio, AudioFormat.objects.all()[0:2])
+        names = set([audio.file.name] + [stream.file.name for stream in audio.streams.all()])
+        audio.delete()
+
+        self.assertEqual(set(PendingDeletion.objects.values_list('name', flat=True)), names)
+        if hasattr(transaction, 'on_commit'):
+            # One task is run after the commit
+            self.assertEqual(len([func for savepoint_ids, func in connection.run_on_commit
+                                  if func == tasks.delete_pending_files.delay]), 1)
+
+    def test_referenced_again(self):
+        """
+        Tests that a file saved again under the name of a tombstone is not deleted.
+        """
+        audio = mocks.get_mock_media_file('media_file.mp3', Audio, AudioFormat.objects.all()[0:1])
+        name = audio.file.name
+        deletion.delete_files(audio.file.storage, [name])
+        storage = mock.Mock(spec=['delete'])
+        with mock.patch.object(deletion, 'get_storages', return_value={'media': storage}):
+            self.assertEqual(deletion.delete_pending_files(), 0)
+        self.assertFalse(storage.delete.called)
+        self.assertFalse(PendingDeletion.objects.exists())
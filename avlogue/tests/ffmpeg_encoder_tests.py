@@ -2,13 +2,19 @@
 FFMpegEncoder test cases.
 """
 import os
+import subprocess
+import sys
 from unittest import skip
 
 import mock
 from django.conf import settings
+from django.core.files.uploadedfile import InMemoryUploadedFile
 from django.test import TestCase
 
+from avlogue import settings as avlogue_settings
+from avlogue import utils
 from avlogue.encoders import FFMpegEncoder
+from avlogue.encoders import process
 from avlogue.encoders.exceptions import EncodeError, GetFileInfoError, CreatePreviewError
 from avlogue.models import Audio, AudioFormat, VideoFormat, Video
 from avlogue.tests import factories
@@ -114,3 +120,121 @@ class FFMpegEncoderTestCase(TestCase):
         input_format = VideoFormat.objects.first()
         with factories.audio_file_factory('mock_audio', input_format) as input_file:
             self.assertRaises(CreatePreviewError, encoder.get_file_preview, input_file, 'output')
+
+    def test_get_file_info_from_pipe(self):
+        """
+        Tests that in-memory uploads are probed through a pipe and temporary file is used as a fallback.
+        """
+        encoder = FFMpegEncoder()
+        for file_factory, media_format in ((factories.audio_file_factory, AudioFormat.objects.get(name='wav')),
+                                           (factories.video_file_factory, VideoFormat.objects.get(name='vp8 WebM'))):
+            with file_factory('mock_pipe_file', media_format) as input_file:
+                file_info = encoder.get_file_info(input_file)
+                uploaded_file = InMemoryUploadedFile(open(input_file, mode='rb'), None, 'uploaded_file', 'text',
+                                                     os.path.getsize(input_file), None)
+                with mock.patch.object(avlogue_settings, 'NATIVE_FILE_INFO_ENABLED', False), \
+                        mock.patch('avlogue.utils.get_local_file_path', wraps=utils.get_local_file_path) as local_path:
+                    pipe_file_info = utils.get_file_info(uploaded_file)
+                    self.assertFalse(local_path.called)
+
+                    # Truncated pipe input can't be probed
+                    with mock.patch.object(avlogue_settings, 'PIPE_PROBE_MAX_SIZE', 16):
+                        fallback_file_info = utils.get_file_info(uploaded_file)
+                    self.assertTrue(local_path.called)
+                uploaded_file.close()
+
+                for info in (pipe_file_info, fallback_file_info):
+                    for key in ('size', 'video_codec', 'audio_codec', 'audio_channels'):
+                        self.assertEqual(info.get(key), file_info.get(key))
+                    self.assertAlmostEqual(info['duration'], file_info['duration'], delta=0.1)
+
+    def test_extract_clip(self):
+        """
+        Tests that streams are copied between keyframes and only boundary segments are re-encoded.
+        """
+        encoder = FFMpegEncoder()
+        file_info = {'duration': 20.0, 'video_codec': 'h264', 'video_bitrate': 1000000}
+        probe_data = {'streams': [{'codec_type': 'video', 'profile': 'Constrained Baseline', 'pix_fmt': 'yuv420p',
+                                   'width': 640, 'height': 360}]}
+        with mock.patch.object(FFMpegEncoder, 'get_file_info', return_value=file_info), \
+                mock.patch.object(FFMpegEncoder, '_probe', return_value=probe_data):
+            with mock.patch.object(FFMpegEncoder, '_get_keyframes', return_value=[0.0, 4.0, 8.0, 12.0, 16.0]):
+                with mock.patch.object(FFMpegEncoder, '_execute') as mock_execute:
+                    encoder.extract_clip('video.mp4', 'clip.mp4', 4, 12)
+                    self.assertEqual(mock_execute.call_count, 1)
+                    cmd = mock_execute.call_args[0][0]
+                    self.assertIn('copy', cmd)
+                    self.assertNotIn('-c:v', cmd)
+
+                with mock.patch.object(FFMpegEncoder, '_execute') as mock_execute:
+                    encoder.extract_clip('video.mp4', 'clip.mp4', 3, 13)
+                    # head, copied middle, tail and concat
+                    self.assertEqual(mock_execute.call_count, 4)
+                    head, middle, tail, concat = (call[0][0] for call in mock_execute.call_args_list)
+                    self.assertIn('libx264', head)
+                    self.assertEqual(head[head.index('-ss') + 1], '3')
+                    # Boundary segments match the source stream, so they can be joined with the copied one
+                    self.assertEqual(head[head.index('-profile:v') + 1], 'baseline')
+                    self.assertEqual(head[head.index('-pix_fmt') + 1], 'yuv420p')
+                    self.assertEqual(head[head.index('-s') + 1], '640x360')
+                    self.assertNotIn('-c:v', middle)
+                    self.assertEqual(middle[middle.index('-ss') + 1], '4.0')
+                    self.assertIn('libx264', tail)
+                    self.assertEqual(tail[tail.index('-ss') + 1], '12.0')
+                    self.assertIn('concat', concat)
+
+            with mock.patch.object(FFMpegEncoder, '_get_keyframes', return_value=[0.0, 10.0, 20.0]):
+                with mock.patch.object(FFMpegEncoder, '_execute') as mock_execute:
+                    # The next keyframe is after the clip end
+                    encoder.extract_clip('video.mp4', 'clip.mp4', 3, 8)
+                    self.assertEqual(mock_execute.call_count, 1)
+                    cmd = mock_execute.call_args[0][0]
+                    self.assertIn('libx264', cmd)
+                    self.assertEqual(cmd[cmd.index('-ss') + 1], '3')
+                    self.assertEqual(cmd[cmd.index('-t') + 1], '5')
+
+                with mock.patch.object(FFMpegEncoder, '_execute') as mock_execute:
+                    # Unknown codec is copied from the keyframe preceding the clip start
+                    with mock.patch.dict(avlogue_settings.VIDEO_CODECS, clear=True):
+                        self.assertEqual(encoder.extract_clip('video.mp4', 'clip.mp4', 13, 18), (10.0, 18))
+                    cmd = mock_execute.call_args[0][0]
+                    self.assertIn('copy', cmd)
+                    self.assertEqual(cmd[cmd.index('-ss') + 1], '10.0')
+
+    def test_process_policies(self):
+        """
+        Tests that process policy of the operation is applied to the child process.
+        """
+        self.assertIsNone(process.get_preexec_fn(process.PROBE))
+
+        policies = {process.ENCODE: {'nice': 5, 'rlimit_cpu': 3600, 'cpu_affinity': [0]}}
+        with mock.patch.object(avlogue_settings, 'PROCESS_POLICIES', policies):
+            self.assertIsNone(process.get_preexec_fn(process.PROBE))
+            code = 'import os, resource; print(os.nice(0)); print(resource.getrlimit(resource.RLIMIT_CPU)[0])'
+            # Policy is applied by preexec_fn, or by the wrapper utilities when other threads are running
+            for thread_count in (1, 2):
+                with mock.patch.object(process.threading, 'active_count', return_value=thread_count):
+                    output = process.popen([sys.executable, '-c', code], process.ENCODE,
+                                           stdout=subprocess.PIPE).communicate()[0]
+                niceness, cpu_limit = output.decode('utf-8').split()
+                self.assertEqual(int(niceness), os.nice(0) + 5)
+                self.assertEqual(int(cpu_limit), 3600)
+
+            with mock.patch('subprocess.Popen') as mock_popen:
+                mock_popen.return_value.communicate.return_value = (b'', b'')
+                with mock.patch.object(process.threading, 'active_count', return_value=1):
+                    FFMpegEncoder()._execute(['ffmpeg'], EncodeError, 'ffmpeg')
+                    self.assertIn('preexec_fn', mock_popen.call_args[1])
+                    FFMpegEncoder()._execute(['ffprobe'], GetFileInfoError, 'ffprobe', process.PROBE)
+                    self.assertNotIn('preexec_fn', mock_popen.call_args[1])
+                with mock.patch.object(process.threading, 'active_count', return_value=2):
+                    FFMpegEncoder()._execute(['ffmpeg'], EncodeError, 'ffmpeg')
+                    self.assertNotIn('preexec_fn', mock_popen.call_args[1])
+                    self.assertEqual(mock_popen.call_args[0][0],
+                                     ['nice', '-n', '5', 'taskset', '-c', '0', 'prlimit', '--cpu=3600', 'ffmpeg'])
+
+            # Policies of the utilities, which are not installed, are skipped with a warning
+            with mock.patch.object(avlogue_settings, 'which', return_value=None):
+                with mock.patch.object(process.logger, 'warning') as mock_warning:
+                    self.assertEqual(process.get_wrapper_command(process.ENCODE), [])
+                self.assertEqual(mock_warning.call_count, 3)
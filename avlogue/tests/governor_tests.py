@@ -0,0 +1,71 @@
+"""
+AVlogue encode governor test cases.
+"""
+import shutil
+import tempfile
+
+import mock
+from django.core.cache import caches
+from django.test import TestCase
+
+from avlogue import governor
+from avlogue import settings
+from avlogue.models import VideoFormat
+
+
+class GovernorTestCase(TestCase):
+
+    def setUp(self):
+        governor_path = tempfile.mkdtemp(dir=settings.TEMP_PATH)
+        self.addCleanup(shutil.rmtree, governor_path, True)
+        for name, value in (('GOVERNOR_ENABLED', True), ('GOVERNOR_PATH', governor_path),
+                            ('GOVERNOR_GLOBAL_LIMIT', None), ('GOVERNOR_QUOTAS', {}),
+                            ('GOVERNOR_WORKER_CPUS', 8), ('GOVERNOR_WORKER_ENCODES', 2),
+                            ('GOVERNOR_CACHE_ALIAS', None)):
+            patcher = mock.patch.object(settings, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.encode_format = VideoFormat(name='h264 720p', video_codec='h264', audio_codec='aac')
+
+    def test_worker_slots(self):
+        """
+        Tests that conversions of a worker host are limited and get explicit number of threads.
+        """
+        with governor.encode_slot(self.encode_format) as threads1, \
+                governor.encode_slot(self.encode_format) as threads2:
+            self.assertEqual((threads1, threads2), (4, 4))
+            with self.assertRaises(governor.GovernorBusy):
+                with governor.encode_slot(self.encode_format):
+                    pass
+        with governor.encode_slot(self.encode_format) as threads:
+            self.assertEqual(threads, 4)
+
+        with mock.patch.object(settings, 'GOVERNOR_ENABLED', False):
+            with governor.encode_slot(self.encode_format) as threads:
+                self.assertIsNone(threads)
+
+    def test_quotas(self):
+        """
+        Tests global limit and quotas kept in the cache.
+        """
+        cache = caches['default']
+        cache.clear()
+        self.addCleanup(cache.clear)
+        with mock.patch.object(settings, 'GOVERNOR_CACHE_ALIAS', 'default'), \
+                mock.patch.object(settings, 'GOVERNOR_QUOTAS', {'codec:h264': 1}):
+            self.assertEqual(governor.get_quotas(self.encode_format), [('codec:h264', 1)])
+            with governor.encode_slot(self.encode_format):
+                with self.assertRaises(governor.GovernorBusy):
+                    with governor.encode_slot(self.encode_format):
+                        pass
+                # Other codecs are not limited by the quota
+                with governor.encode_slot(VideoFormat(name='vp8', video_codec='vp8', audio_codec='vorbis')):
+                    pass
+
+            with mock.patch.object(settings, 'GOVERNOR_GLOBAL_LIMIT', 0):
+                with self.assertRaises(governor.GovernorBusy):
+                    with governor.encode_slot(self.encode_format):
+                        pass
+            # Slots are released after the failed acquisition
+            with governor.encode_slot(self.encode_format):
+                pass
@@ -0,0 +1,71 @@
+"""
+Media container headers parser test cases.
+"""
+import os
+
+import mock
+from django.test import TestCase
+
+from avlogue import settings
+from avlogue.encoders import FFMpegEncoder
+from avlogue.encoders import headers
+from avlogue.models import AudioFormat, VideoFormat
+from avlogue.tests import factories
+
+
+class HeadersTestCase(TestCase):
+    fixtures = ['media-formats.json']
+
+    def assert_file_info_equal(self, file_path, stream_type=None):
+        """
+        Asserts that parsed headers are equal to ffprobe data.
+        """
+        info = headers.get_file_info(file_path, stream_type)
+        self.assertIsNotNone(info)
+        with mock.patch.object(settings, 'NATIVE_FILE_INFO_ENABLED', False):
+            probe_info = FFMpegEncoder().get_file_info(file_path, stream_type)
+
+        self.assertEqual(set(info.keys()), set(probe_info.keys()))
+        self.assertEqual(info['size'], probe_info['size'])
+        self.assertAlmostEqual(info['duration'], probe_info['duration'], delta=0.1)
+        self.assertAlmostEqual(info['bitrate'], probe_info['bitrate'], delta=probe_info['bitrate'] * 0.05)
+        for key in ('video_codec', 'video_width', 'video_height', 'audio_codec', 'audio_channels'):
+            self.assertEqual(info.get(key), probe_info.get(key))
+        for key in ('video_bitrate', 'audio_bitrate'):
+            if probe_info.get(key) is None:
+                self.assertIsNone(info.get(key))
+            else:
+                self.assertAlmostEqual(info[key], probe_info[key], delta=probe_info[key] * 0.05)
+
+    def test_get_file_info(self):
+        for format_name in ('h264 480p', 'vp8 WebM'):
+            encode_format = VideoFormat.objects.get(name=format_name)
+            with factories.video_file_factory(file_name='test_headers_video', encode_format=encode_format) as path:
+                self.assert_file_info_equal(path)
+                self.assert_file_info_equal(path, 'video')
+                self.assert_file_info_equal(path, 'audio')
+
+        encode_format = AudioFormat.objects.get(name='mp3')
+        with factories.audio_file_factory(file_name='test_headers_audio', encode_format=encode_format) as path:
+            self.assert_file_info_equal(path)
+            self.assert_file_info_equal(path, 'audio')
+
+    def test_unsupported_file(self):
+        """
+        Tests that None is returned for the files which should be probed by ffprobe.
+        """
+        self.assertIsNone(headers.get_file_info('invalid_file'))
+        self.assertIsNone(headers.parse_file_info(b'', 0))
+        self.assertIsNone(headers.parse_file_info(b'\x00\x00\x00\x18ftypisom', 12))
+        self.assertIsNone(headers.parse_file_info(b'\x1a\x45\xdf\xa3\x84\x42\x82\x81', 8))
+
+        encode_format = AudioFormat.objects.get(name='wav')
+        with factories.audio_file_factory(file_name='test_headers_audio', encode_format=encode_format) as path:
+            self.assertIsNone(headers.get_file_info(path))
+
+        encode_format = VideoFormat.objects.get(name='h264 480p')
+        with factories.video_file_factory(file_name='test_headers_video', encode_format=encode_format) as path:
+            with open(path, 'rb') as f:
+                data = f.read(os.path.getsize(path) // 2)
+            # moov box is placed after the truncated mdat box
+            self.assertIsNone(headers.parse_file_info(data, len(data)))
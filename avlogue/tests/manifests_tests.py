@@ -0,0 +1,68 @@
+"""
+AVlogue manifests test cases.
+"""
+import json
+
+import mock
+from django.test import TestCase
+
+from avlogue import manifests
+from avlogue import settings
+from avlogue.models import Video, VideoFormat, VideoStream
+from avlogue.templatetags.avlogue_tags import avlogue_manifest_url
+from avlogue.tests import mocks
+
+
+class ManifestsTestCase(TestCase):
+    fixtures = ['media-formats.json']
+
+    def test_write_manifest(self):
+        """
+        Tests that manifest lists playable streams of the media file.
+        """
+        format1, format2 = VideoFormat.objects.all()[0:2]
+        video = mocks.get_mock_media_file('media_file.mp4', Video, (format1, format2))
+        video.streams.filter(format=format2).update(status=VideoStream.CONVERSION_FAILURE)
+
+        name = manifests.write_manifest(video)
+        self.addCleanup(manifests.delete_manifest, video)
+        self.assertEqual(name, manifests.get_manifest_name(video))
+        self.assertEqual(avlogue_manifest_url(video), settings.MEDIA_STREAMS_STORAGE.url(name))
+        with settings.MEDIA_STREAMS_STORAGE.open(name) as f:
+            manifest = json.loads(f.read().decode('utf-8'))
+
+        self.assertEqual((manifest['id'], manifest['type'], manifest['title']), (video.pk, 'video', video.title))
+        self.assertEqual(len(manifest['streams']), 1)
+        stream = video.streams.get(format=format1)
+        self.assertEqual(manifest['streams'][0]['format'], format1.name)
+        self.assertEqual(manifest['streams'][0]['url'], stream.public_url)
+        self.assertEqual(manifest['streams'][0]['content_type'], 'video/mp4')
+        self.assertEqual(manifest['streams'][0]['width'], stream.video_width)
+
+        # Manifest is rewritten with the same name
+        self.assertEqual(manifests.write_manifest(video), name)
+
+    def test_update_manifest(self):
+        """
+        Tests that manifest is written when stream conversion is completed and is deleted with the media file.
+        """
+        with mock.patch.object(settings, 'MANIFESTS_ENABLED', True), \
+                mock.patch.object(manifests, 'write_manifest') as mock_write_manifest, \
+                mock.patch.object(manifests, 'delete_manifest') as mock_delete_manifest:
+            video = mocks.get_mock_media_file('media_file.mp4', Video, VideoFormat.objects.all()[0:1])
+            self.assertTrue(mock_write_manifest.called)
+
+            mock_write_manifest.reset_mock()
+            stream = video.streams.get()
+            stream.status = stream.CONVERSION_IN_PROGRESS
+            stream.save()
+            self.assertFalse(mock_write_manifest.called)
+            stream.status = stream.CONVERSION_SUCCESSFUL
+            stream.save()
+            mock_write_manifest.assert_called_once_with(video)
+
+            mock_write_manifest.reset_mock()
+            video.delete()
+            mock_delete_manifest.assert_called_once_with(video)
+            # Manifest is not rewritten by the cascaded deletion of the streams
+            self.assertFalse(mock_write_manifest.called)
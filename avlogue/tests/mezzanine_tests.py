@@ -0,0 +1,107 @@
+"""
+AVlogue mezzanine files test cases.
+"""
+import os
+import shutil
+import tempfile
+
+import mock
+from django.test import TestCase
+
+from avlogue import mezzanine
+from avlogue import scratch
+from avlogue import settings
+from avlogue.encoders import default_encoder
+from avlogue.encoders.exceptions import EncodeError
+from avlogue.models import Audio, Video
+
+
+class MezzanineTestCase(TestCase):
+    def setUp(self):
+        self.mezzanine_path = tempfile.mkdtemp(dir=settings.TEMP_PATH)
+        patchers = (mock.patch.object(settings, 'MEZZANINE_ENABLED', True),
+                    mock.patch.object(settings, 'MEZZANINE_PATH', self.mezzanine_path))
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.mezzanine_path)
+
+    def test_needs_mezzanine(self):
+        self.assertTrue(mezzanine.needs_mezzanine(Video(video_codec='prores', video_width=1920, video_height=1080)))
+        self.assertTrue(mezzanine.needs_mezzanine(Video(video_codec='h264', video_width=3840, video_height=2160)))
+        self.assertFalse(mezzanine.needs_mezzanine(Video(video_codec='h264', video_width=1920, video_height=1080)))
+        self.assertFalse(mezzanine.needs_mezzanine(Audio(audio_codec='aac')))
+        with mock.patch.object(settings, 'MEZZANINE_ENABLED', False):
+            self.assertFalse(mezzanine.needs_mezzanine(Video(video_codec='prores')))
+
+    def test_get_input_file(self):
+        """
+        Tests that mezzanine file is created once and is deleted after retention period.
+        """
+        def mock_create_mezzanine(input_file, output_file, threads=None):
+            open(output_file, 'wb').close()
+
+        video = Video(pk=1, file='avlogue/video/source.mov', video_codec='prores')
+        with mock.patch.object(default_encoder, 'create_mezzanine',
+                               side_effect=mock_create_mezzanine) as create_mezzanine:
+            input_file = mezzanine.get_input_file(video)
+            self.assertEqual(input_file, mezzanine.get_mezzanine_path(video))
+            self.assertTrue(os.path.exists(input_file))
+            self.assertEqual(mezzanine.get_input_file(video), input_file)
+            self.assertEqual(create_mezzanine.call_count, 1)
+
+        self.assertEqual(mezzanine.delete_expired_mezzanines(), [])
+        with mock.patch.object(settings, 'MEZZANINE_RETENTION', -1):
+            self.assertEqual(mezzanine.delete_expired_mezzanines(), [input_file])
+        self.assertFalse(os.path.exists(input_file))
+
+        video.video_codec = 'h264'
+        self.assertEqual(mezzanine.get_input_file(video), video.file.path)
+
+    def test_mezzanine_busy(self):
+        """
+        Tests that tasks don't wait for a mezzanine file being created by another task
+        and use the source file after a failed creation.
+        """
+        video = Video(pk=1, file='avlogue/video/source.mov', video_codec='prores')
+        lock_path = '{}.lock'.format(mezzanine.get_mezzanine_path(video))
+        open(lock_path, 'w').close()
+        with self.assertRaises(mezzanine.MezzanineBusy):
+            mezzanine.get_input_file(video)
+        with mock.patch.object(settings, 'MEZZANINE_LOCK_TIMEOUT', -1):
+            # Lock of a crashed task
+            self.assertEqual(mezzanine.get_input_file(video), video.file.path)
+        os.remove(lock_path)
+
+        with mock.patch.object(default_encoder, 'create_mezzanine',
+                               side_effect=EncodeError('Failed.')) as create_mezzanine:
+            self.assertEqual(mezzanine.get_input_file(video), video.file.path)
+            self.assertEqual(mezzanine.get_input_file(video), video.file.path)
+            self.assertEqual(create_mezzanine.call_count, 1)
+
+    def test_reserve_space(self):
+        """
+        Tests that the mezzanine file size is reserved in the scratch ledger while the file is created.
+        """
+        video = Video(pk=1, file='avlogue/video/source.mov', video_codec='prores', video_width=1920,
+                      video_height=1080, duration=10)
+        estimated_size = mezzanine.estimate_size(video)
+        self.assertGreater(estimated_size, 0)
+
+        def mock_create_mezzanine(input_file, output_file, threads=None):
+            with scratch.locked_ledger(settings.TEMP_PATH) as reservations:
+                self.assertIn(estimated_size, [size for pid, size in reservations.values()])
+            open(output_file, 'wb').close()
+
+        with mock.patch.object(scratch, 'reserve_space', side_effect=scratch.ScratchSpaceError('No space.')):
+            with self.assertRaises(scratch.ScratchSpaceError):
+                mezzanine.get_input_file(video)
+        # Creation is retried by the next task
+        self.assertEqual(os.listdir(self.mezzanine_path), [])
+
+        with mock.patch.object(default_encoder, 'create_mezzanine', side_effect=mock_create_mezzanine):
+            self.assertEqual(mezzanine.get_input_file(video), mezzanine.get_mezzanine_path(video))
+        with scratch.locked_ledger(settings.TEMP_PATH) as reservations:
+            self.assertNotIn(estimated_size, [size for pid, size in reservations.values()])
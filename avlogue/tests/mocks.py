@@ -221,6 +221,7 @@ def get_mock_media_file(file_name, media_file_cls, formats=None):
                                 stream_info['audio_codec'] = format.audio_codec
 
                             stream = media_file.streams.model(media_file=media_file, file=file_mock, format=format,
+                                                              status=media_file.streams.model.CONVERSION_SUCCESSFUL,
                                                               **stream_info)
                             stream.save()
                             media_file.streams.add(stream)
@@ -2,21 +2,40 @@
 AVlogue models test cases.
 """
 import os
+from unittest import skipUnless
 
 import mock
 from django.core.exceptions import ValidationError
 from django.core.files.base import File
 from django.core.files.storage import FileSystemStorage
 from django.core.files.uploadedfile import InMemoryUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.db.models.fields.files import FieldFile
 from django.test import TestCase
+from django.utils.six import StringIO
 
+from avlogue import settings
+from avlogue import speed_presets
+from avlogue import tasks
 from avlogue.encoders import default_encoder
+from avlogue.encoders.exceptions import EncodeError
 from avlogue.models import Video, VideoFormat, AudioFormat, Audio, VideoFormatSet, AudioFormatSet, VideoStream, \
     video_file_validator, audio_file_validator
 from avlogue.tests import factories
 from avlogue.tests import mocks
 
 
+def get_query_plan(queryset):
+    """
+    Returns sqlite query plan of the queryset.
+    """
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN QUERY PLAN {}'.format(sql), params)
+        return '\n'.join(str(row[-1]) for row in cursor.fetchall())
+
+
 class ModelsTestCase(TestCase):
     """
     AVlogue model tests.
@@ -53,6 +72,78 @@ class ModelsTestCase(TestCase):
         stream = VideoStream()
         self.assertIsNone(stream.content_type)
 
+    def test_file_changed(self):
+        """
+        Tests file change tracking of the loaded and deferred instances.
+        """
+        file_name = mocks.get_mock_media_file('media_file.mp4', Video).file.name
+
+        video = Video.objects.get(title='media_file.mp4')
+        # FieldFile is not created on load
+        self.assertNotIsInstance(video.__dict__['file'], FieldFile)
+        self.assertFalse(video.file_changed)
+        video.file = 'avlogue/video/other_file.mp4'
+        self.assertTrue(video.file_changed)
+        self.assertEqual(video.old_file_name, file_name)
+
+        video = Video.objects.defer('file').get(title='media_file.mp4')
+        self.assertFalse(video.file_changed)
+        video.file = 'avlogue/video/other_file.mp4'
+        self.assertTrue(video.file_changed)
+        self.assertEqual(video.old_file_name, file_name)
+
+    def test_stored_file_fields(self):
+        """
+        Tests that content type and url are stored on save.
+        """
+        video = mocks.get_mock_media_file('media_file.mp4', Video, VideoFormat.objects.all()[0:1])
+        stream = video.streams.get()
+        self.assertEqual(VideoStream.objects.filter(content_type='video/mp4').get(), stream)
+        self.assertIsNone(stream.url)
+        self.assertEqual(stream.public_url, stream.file.url)
+
+        with mock.patch('avlogue.settings.STORE_FILE_URLS', True):
+            video = mocks.get_mock_media_file('stored_url.mp4', Video, VideoFormat.objects.all()[0:1])
+        video.refresh_from_db()
+        self.assertEqual(video.content_type, 'video/mp4')
+        self.assertEqual(video.url, video.file.url)
+        stream = video.streams.get()
+        with mock.patch.object(FileSystemStorage, 'url') as mock_url:
+            self.assertEqual(stream.public_url, stream.url)
+            self.assertFalse(mock_url.called)
+
+        stream.clear_fields()
+        stream.save()
+        stream.refresh_from_db()
+        self.assertIsNone(stream.content_type)
+        self.assertIsNone(stream.url)
+
+        # Urls of the existing files are stored by the command
+        with mock.patch('avlogue.settings.STORE_FILE_URLS', True):
+            out = StringIO()
+            call_command('avlogue_store_urls', stdout=out)
+        self.assertIn('videostream: updated 1 urls.', out.getvalue())
+        self.assertEqual(VideoStream.objects.exclude(url=None).count(), VideoStream.objects.exclude(file='').count())
+        call_command('avlogue_store_urls', stdout=StringIO())
+        self.assertFalse(VideoStream.objects.exclude(url=None).exists())
+
+    def test_streams_version(self):
+        """
+        Tests that streams version changed by a stream is not overwritten by a save of a stale media file.
+        """
+        video = mocks.get_mock_media_file('media_file.mp4', Video, VideoFormat.objects.all()[0:1])
+        stale_video = Video.objects.get(pk=video.pk)
+        streams_version = stale_video.streams_version
+        video.streams.get().save()
+        stale_video.save()
+        stale_video.refresh_from_db()
+        self.assertEqual(stale_video.streams_version, streams_version + 1)
+
+        # Deleted media file is inserted again
+        Video.objects.filter(pk=video.pk).delete()
+        stale_video.save()
+        self.assertTrue(Video.objects.filter(pk=video.pk).exists())
+
     def test_audio_video_file_crud(self):
         """
         Tests CRUD for Audio/Video.
@@ -153,9 +244,11 @@ class ModelsTestCase(TestCase):
                 mock_rv.communicate.return_value = [None, None]
                 mock_popen.return_value = mock_rv
 
-                mock_file = mock.MagicMock(spec=mock.sentinel.file_spec)
+                mock_file = mock.MagicMock()
                 mock_file.size = 1
                 mock_file.name = file_name
+                # Output file is opened as a context manager
+                mock_file.__enter__.return_value = mock_file
                 mock_open = mock.MagicMock(return_value=mock_file)
 
                 with mock.patch('avlogue.tasks.open', mock_open):
@@ -209,6 +302,108 @@ class ModelsTestCase(TestCase):
         self.assertEqual(len(streams), 0)
         self.assertEqual(media_file.streams.count(), 0)
 
+    def test_create_clip(self):
+        """
+        Tests creation of a clip from a video.
+        """
+        video = mocks.get_mock_media_file('media_file.mp4', Video, VideoFormat.objects.all()[0:2])
+        self.assertRaises(ValueError, video.create_clip, 5, 1)
+
+        def mock_save(self, name, content, *args, **kwargs):
+            return name
+
+        mock_file = mock.MagicMock(spec=mock.sentinel.file_spec)
+        mock_file.size = 1
+        mock_file.name = 'clip.mp4'
+        mock_open = mock.MagicMock(return_value=mock_file)
+
+        with mock.patch.object(FileSystemStorage, 'save', mock_save), \
+                mock.patch('avlogue.managers.open', mock_open), \
+                mock.patch('avlogue.models.open', mock_open), \
+                mock.patch.object(default_encoder, 'get_file_info', mocks.get_file_info), \
+                mock.patch.object(default_encoder, 'get_file_preview'), \
+                mock.patch.object(default_encoder, 'extract_clip') as mock_extract_clip, \
+                mock.patch.object(Video, 'convert') as mock_convert:
+            mock_extract_clip.return_value = (1, 3)
+            clip = video.create_clip(1, 3)
+
+        self.assertEqual(mock_extract_clip.call_args[0][2:], (1, 3))
+        self.assertEqual(clip.parent, video)
+        self.assertEqual((clip.clip_start, clip.clip_end), (1, 3))
+        self.assertEqual(list(video.clips.all()), [clip])
+        self.assertEqual(set(mock_convert.call_args[0][0]), set(s.format for s in video.streams.all()))
+
+    def test_prune_formats(self):
+        """
+        Tests that formats with higher resolution and duplicated formats are skipped.
+        """
+        video = Video(video_width=854, video_height=480, video_bitrate=2000000, audio_bitrate=192000)
+        format_720p, format_480p = VideoFormat.objects.get(name='h264 720p'), VideoFormat.objects.get(name='h264 480p')
+        self.assertFalse(video.format_has_lower_quality(format_720p))
+        self.assertTrue(video.format_has_lower_quality(format_480p))
+        self.assertEqual(video.get_output_resolution(format_480p), (854, 480))
+
+        duplicated_format = VideoFormat.objects.get(name='h264 480p')
+        duplicated_format.pk = None
+        duplicated_format.name = 'h264 854x480'
+        duplicated_format.video_width = 854
+        duplicated_format.save()
+
+        formats = video.prune_formats(VideoFormat.objects.order_by('pk'))
+        self.assertIn(format_480p, formats)
+        self.assertNotIn(duplicated_format, formats)
+        self.assertNotIn(format_720p, formats)
+        self.assertNotIn(VideoFormat.objects.get(name='theora 720p'), formats)
+        self.assertIn(VideoFormat.objects.get(name='vp8 WebM'), formats)
+
+    def test_complexity(self):
+        """
+        Tests that video bitrate of streams is adapted to the video complexity.
+        """
+        video = mocks.get_mock_media_file('media_file.mp4', Video)
+        encode_format = VideoFormat.objects.get(name='h264 720p')
+        self.assertEqual(video.get_target_video_bitrate(encode_format), encode_format.video_bitrate)
+
+        # Failed analysis doesn't fail the conversion
+        with mock.patch.object(default_encoder, 'get_complexity', side_effect=EncodeError('Failed.')):
+            video.update_complexity()
+        self.assertIsNone(video.complexity)
+        with mock.patch.object(default_encoder, 'get_file_info', return_value={'duration': 0}):
+            self.assertIsNone(default_encoder.get_complexity('media_file.mp4'))
+
+        with mock.patch.object(default_encoder, 'get_complexity', return_value=0.1):
+            video.update_complexity()
+        video.refresh_from_db()
+        self.assertEqual(video.complexity, 0.1)
+        # Bitrate is scaled down to the min factor
+        self.assertEqual(video.get_target_video_bitrate(encode_format), encode_format.video_bitrate // 2)
+
+        stream = VideoStream(media_file=video, format=encode_format,
+                             target_video_bitrate=video.get_target_video_bitrate(encode_format))
+        self.assertEqual(stream.get_encode_format().video_bitrate, encode_format.video_bitrate // 2)
+        self.assertEqual(stream.get_encode_format().name, encode_format.name)
+        self.assertEqual(VideoFormat.objects.get(pk=encode_format.pk).video_bitrate, encode_format.video_bitrate)
+
+        video.complexity = 3
+        self.assertEqual(video.get_target_video_bitrate(encode_format), encode_format.video_bitrate)
+
+    def test_complexity_analysed_once(self):
+        """
+        Tests that complexity is analysed once by a task before the stream conversions are queued.
+        """
+        video = mocks.get_mock_media_file('media_file.mp4', Video)
+        encode_formats = list(VideoFormat.objects.filter(video_bitrate__isnull=False)[0:2])
+        with mock.patch.object(settings, 'COMPLEXITY_ANALYSIS_ENABLED', True), \
+                mock.patch.object(video, 'prune_formats', side_effect=lambda formats: formats), \
+                mock.patch.object(default_encoder, 'get_complexity', return_value=0.1) as get_complexity, \
+                mock.patch.object(tasks.encode_stream, 'delay') as encode_stream:
+            streams = video.convert(encode_formats)
+        self.assertEqual(get_complexity.call_count, 1)
+        self.assertEqual(encode_stream.call_count, len(encode_formats))
+        for stream in streams:
+            stream.refresh_from_db()
+            self.assertEqual(stream.target_video_bitrate, stream.format.video_bitrate // 2)
+
     def test_conversion_failure(self):
         video = mocks.get_mock_media_file('media_file.mp3', Video, VideoFormat.objects.all())
 
@@ -221,6 +416,53 @@ class ModelsTestCase(TestCase):
         video_stream.refresh_from_db()
         self.assertEqual(video_stream.status, video_stream.CONVERSION_FAILURE)
 
+    def test_speed_presets(self):
+        """
+        Tests that faster speed presets are used when the encode queue is long.
+        """
+        encode_format = VideoFormat.objects.get(name='h264 720p')
+        video = mocks.get_mock_media_file('media_file.mp4', Video, [encode_format])
+        stream = video.streams.get()
+        self.assertIsNone(stream.get_encode_format().speed_preset)
+
+        encode_format.video_speed_presets = 'slow, medium, fast'
+        encode_format.save()
+        VideoStream.objects.filter(pk=stream.pk).update(status=VideoStream.CONVERSION_SUCCESSFUL)
+        stream = video.streams.get()
+        # Queue is empty
+        self.assertEqual(stream.get_encode_format().speed_preset, 'slow')
+        self.assertEqual(stream.speed_preset, 'slow')
+        self.assertEqual(speed_presets.select_speed_preset(encode_format, 0.5), 'medium')
+        self.assertEqual(speed_presets.select_speed_preset(encode_format, 3), 'fast')
+        encode_format.deadline_class = 'urgent'
+        self.assertEqual(speed_presets.select_speed_preset(encode_format, 0.5), 'fast')
+
+        with mock.patch.object(settings, 'SPEED_PRESETS_QUEUE_DEPTH', 1):
+            VideoStream.objects.filter(pk=stream.pk).update(status=VideoStream.CONVERSION_PREPARATION)
+            self.assertEqual(speed_presets.get_queue_load(VideoStream), 1.0)
+            encode_format = stream.get_encode_format()
+            self.assertEqual(encode_format.speed_preset, 'fast')
+            params = default_encoder._get_video_params(encode_format)
+            self.assertEqual(params[params.index('-preset') + 1], 'fast')
+
+    @skipUnless(connection.vendor == 'sqlite', 'Query plans are checked with sqlite EXPLAIN QUERY PLAN.')
+    def test_playable_streams_indexes(self):
+        """
+        Tests that playable streams queries use the stream indexes.
+        """
+        video = mocks.get_mock_media_file('media_file.mp4', Video, VideoFormat.objects.all())
+        with connection.cursor() as cursor:
+            indexes = dict((tuple(constraint['columns']), name) for name, constraint in
+                           connection.introspection.get_constraints(cursor, VideoStream._meta.db_table).items()
+                           if constraint['index'])
+
+        queries = (
+            (('media_file_id', 'status', 'bitrate'), video.streams.playable().filter(bitrate__gte=1)),
+            (('status', 'created'), VideoStream.objects.playable().order_by('-created')),
+        )
+        for columns, queryset in queries:
+            self.assertIn('INDEX {}'.format(indexes[columns]), get_query_plan(queryset))
+
     def test_validators(self):
         video_file = mock.MagicMock()
         video_file.name = 'video.mp4'
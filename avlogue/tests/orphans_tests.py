@@ -0,0 +1,73 @@
+"""
+AVlogue orphaned files garbage collector test cases.
+"""
+import os
+
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils.encoding import force_text
+from django.utils.six import StringIO
+
+from avlogue import orphans
+from avlogue import settings
+from avlogue.models import Audio, AudioFormat, AudioStream
+from avlogue.tests import mocks
+
+
+class OrphansTestCase(TestCase):
+    fixtures = ['media-formats.json']
+
+    def save_file(self, file_name):
+        storage = settings.MEDIA_STREAMS_STORAGE
+        name = storage.save(os.path.join(settings.AUDIO_STREAMS_DIR, file_name), ContentFile(b'data'))
+        self.addCleanup(storage.delete, name)
+        return name
+
+    def test_collect_storage_orphans(self):
+        """
+        Tests that only files, which are not referenced, are deleted.
+        """
+        referenced_name = self.save_file('gc_referenced.mp3')
+        orphan_name = self.save_file('gc_orphan.mp3')
+        audio = mocks.get_mock_media_file('gc.mp3', Audio, AudioFormat.objects.all()[0:1])
+        AudioStream.objects.filter(media_file=audio).update(file=referenced_name)
+
+        # Files are too young
+        self.assertNotIn(orphan_name, dict(orphans.collect_storage_orphans(60 * 60, dry_run=True)))
+
+        found = dict(orphans.collect_storage_orphans(0, dry_run=True, chunk_size=1))
+        self.assertEqual(found[orphan_name], 4)
+        self.assertNotIn(referenced_name, found)
+        self.assertTrue(settings.MEDIA_STREAMS_STORAGE.exists(orphan_name))
+
+        out = StringIO()
+        call_command('avlogue_gc', min_age=0, skip_temp=True, verbosity=2, stdout=out)
+        # Output is written as utf-8 encoded bytes on Python 2
+        output = force_text(out.getvalue())
+        self.assertIn(orphan_name, output)
+        self.assertIn('Deleted storage files', output)
+        self.assertFalse(settings.MEDIA_STREAMS_STORAGE.exists(orphan_name))
+        self.assertTrue(settings.MEDIA_STREAMS_STORAGE.exists(referenced_name))
+
+    def test_collect_temp_orphans(self):
+        """
+        Tests that old temporary files are deleted and mezzanine files are skipped.
+        """
+        paths = []
+        for directory in (settings.TEMP_PATH, settings.MEZZANINE_PATH):
+            if not os.path.exists(directory):
+                os.makedirs(directory)
+            path = os.path.join(directory, 'gc_temp.txt')
+            with open(path, 'wb') as f:
+                f.write(b'data')
+            self.addCleanup(lambda p=path: os.path.exists(p) and os.remove(p))
+            paths.append(path)
+        temp_path, mezzanine_path = paths
+
+        self.assertNotIn(temp_path, dict(orphans.collect_temp_orphans(60 * 60)))
+        found = dict(orphans.collect_temp_orphans(0))
+        self.assertIn(temp_path, found)
+        self.assertNotIn(mezzanine_path, found)
+        self.assertFalse(os.path.exists(temp_path))
+        self.assertTrue(os.path.exists(mezzanine_path))
@@ -0,0 +1,64 @@
+"""
+AVlogue storage layout and files relocation test cases.
+"""
+import hashlib
+import os
+
+import mock
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils.six import StringIO
+
+from avlogue import relocation
+from avlogue import settings
+from avlogue.models import Audio, AudioFormat, AudioStream
+from avlogue.tests import mocks
+from avlogue.utils import UploadTo
+
+
+class RelocationTestCase(TestCase):
+    fixtures = ['media-formats.json']
+
+    def test_upload_to(self):
+        """
+        Tests file names of the storage layouts.
+        """
+        upload_to = UploadTo('avlogue/audio/streams')
+        stream = AudioStream(media_file_id=12345)
+        self.assertEqual(upload_to(stream, '/tmp/avlogue/file mp3.mp3'), 'avlogue/audio/streams/file_mp3.mp3')
+
+        with mock.patch.object(settings, 'STORAGE_LAYOUT', 'pk'):
+            self.assertEqual(upload_to(stream, 'file.mp3'), 'avlogue/audio/streams/000/012/12345/file.mp3')
+        with mock.patch.object(settings, 'STORAGE_LAYOUT', 'hash'):
+            digest = hashlib.md5(b'12345').hexdigest()
+            self.assertEqual(upload_to(stream, 'file.mp3'),
+                             'avlogue/audio/streams/{}/{}/12345/file.mp3'.format(digest[0:2], digest[2:4]))
+            # Media file pk is not known before the file is saved
+            digest = hashlib.md5(b'file.mp3').hexdigest()
+            self.assertEqual(UploadTo('avlogue/audio')(Audio(), 'file.mp3'),
+                             'avlogue/audio/{}/{}/file.mp3'.format(digest[0:2], digest[2:4]))
+
+    def test_relocate(self):
+        """
+        Tests that stream files are moved to the layout directories and relocated files are skipped.
+        """
+        storage = settings.MEDIA_STREAMS_STORAGE
+        audio = mocks.get_mock_media_file('relocation.mp3', Audio, AudioFormat.objects.all()[0:1])
+        stream = audio.streams.get()
+        old_name = storage.save(os.path.join(settings.AUDIO_STREAMS_DIR, 'relocation.mp3'), ContentFile(b'data'))
+        self.addCleanup(storage.delete, old_name)
+        AudioStream.objects.filter(pk=stream.pk).update(file=old_name)
+
+        with mock.patch.object(settings, 'STORAGE_LAYOUT', 'pk'):
+            out = StringIO()
+            call_command('avlogue_relocate', model='audiostream', stdout=out)
+            self.assertIn('audiostream: relocated 1 files.', out.getvalue())
+            stream.refresh_from_db()
+            self.addCleanup(storage.delete, stream.file.name)
+            self.assertEqual(os.path.dirname(stream.file.name),
+                             os.path.join(settings.AUDIO_STREAMS_DIR, '000', '000', str(audio.pk)))
+            self.assertTrue(storage.exists(stream.file.name))
+            self.assertFalse(storage.exists(old_name))
+
+            self.assertEqual(relocation.relocate_batch(AudioStream, ('file',)), (None, 0))
@@ -0,0 +1,113 @@
+"""
+AVlogue scratch directories test cases.
+"""
+import os
+import shutil
+import tempfile
+
+import mock
+from django.test import TestCase
+
+from avlogue import scratch
+from avlogue import settings
+from avlogue import tasks
+from avlogue.models import Audio, AudioFormat, AudioStream, Video, VideoFormat
+from avlogue.tests import mocks
+
+
+class ScratchTestCase(TestCase):
+    fixtures = ['media-formats.json']
+
+    def setUp(self):
+        self.ram_path = tempfile.mkdtemp(dir=settings.TEMP_PATH)
+        self.addCleanup(shutil.rmtree, self.ram_path, True)
+        for name, value in (('SCRATCH_RAM_PATH', self.ram_path), ('SCRATCH_RAM_MAX_SIZE', 1000),
+                            ('SCRATCH_MIN_FREE_SPACE', 100), ('SCRATCH_SPACE_BUDGET', None)):
+            patcher = mock.patch.object(settings, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_estimate_output_size(self):
+        """
+        Tests output size estimation by the format bitrates.
+        """
+        audio = Audio(duration=10, audio_channels=1)
+        self.assertEqual(scratch.estimate_output_size(audio, AudioFormat(audio_codec='mp3', audio_bitrate=128000)),
+                         int(10 * 128000 / 8 * scratch.SIZE_MARGIN))
+        # Lossless audio
+        self.assertEqual(scratch.estimate_output_size(audio, AudioFormat(audio_codec='pcm_s16le')),
+                         int(10 * scratch.PCM_CHANNEL_BITRATE / 8 * scratch.SIZE_MARGIN))
+        self.assertIsNone(scratch.estimate_output_size(Audio(), AudioFormat(audio_codec='mp3', audio_bitrate=128000)))
+
+        video_format = VideoFormat(audio_codec='aac', audio_bitrate=128000, video_codec='h264')
+        self.assertEqual(scratch.estimate_output_size(Video(duration=10, bitrate=1000000), video_format),
+                         int(10 * 1128000 / 8 * scratch.SIZE_MARGIN))
+        self.assertIsNone(scratch.estimate_output_size(Video(duration=10), video_format))
+
+    def test_get_scratch_path(self):
+        """
+        Tests that small outputs are written to the RAM path and free space is checked.
+        """
+        with mock.patch.object(scratch, 'get_free_space', return_value=10000):
+            self.assertEqual(scratch.get_scratch_path(1000), self.ram_path)
+            self.assertEqual(scratch.get_scratch_path(1001), settings.TEMP_PATH)
+            self.assertEqual(scratch.get_scratch_path(None), settings.TEMP_PATH)
+            self.assertRaises(scratch.ScratchSpaceError, scratch.get_scratch_path, 9901)
+
+        free_space = {self.ram_path: 500, settings.TEMP_PATH: 10000}
+        with mock.patch.object(scratch, 'get_free_space', side_effect=free_space.get):
+            # RAM path is full
+            self.assertEqual(scratch.get_scratch_path(1000), settings.TEMP_PATH)
+
+    def test_scratch_directory(self):
+        """
+        Tests that scratch directories are isolated and deleted on exit.
+        """
+        with mock.patch.object(scratch, 'get_free_space', return_value=10000):
+            with scratch.scratch_directory(10) as path1, scratch.scratch_directory(10) as path2:
+                self.assertNotEqual(path1, path2)
+                self.assertEqual(os.path.dirname(path1), self.ram_path)
+                with open(os.path.join(path1, 'output.mp3'), 'wb') as f:
+                    f.write(b'data')
+            self.assertFalse(os.path.exists(path1))
+            self.assertFalse(os.path.exists(path2))
+
+    def test_reserve_space(self):
+        """
+        Tests that reserved space is taken into account by the admission and is released.
+        """
+        with mock.patch.object(settings, 'SCRATCH_RAM_PATH', None), \
+                mock.patch.object(settings, 'TEMP_PATH', self.ram_path), \
+                mock.patch.object(scratch, 'get_free_space', return_value=10000):
+            path, reservation_id = scratch.reserve_space(6000)
+            self.assertEqual(path, self.ram_path)
+            self.assertRaises(scratch.ScratchSpaceError, scratch.reserve_space, 6000)
+            with scratch.scratch_directory(3000):
+                self.assertRaises(scratch.ScratchSpaceError, scratch.get_scratch_path, 1000)
+            scratch.release_space(path, reservation_id)
+            self.assertEqual(scratch.get_scratch_path(6000), self.ram_path)
+
+            with mock.patch.object(settings, 'SCRATCH_SPACE_BUDGET', 5000):
+                self.assertRaises(scratch.ScratchSpaceError, scratch.reserve_space, 6000)
+
+            # Reservations of the dead processes are dropped
+            scratch.reserve_space(6000)
+            with mock.patch.object(scratch, '_is_alive', return_value=False):
+                self.assertEqual(scratch.get_scratch_path(6000), self.ram_path)
+            with scratch.locked_ledger(path) as reservations:
+                self.assertEqual(reservations, {})
+
+    def test_encode_stream_postponed(self):
+        """
+        Tests that a conversion without scratch space is requeued instead of failing, whatever number of times.
+        """
+        audio = mocks.get_mock_media_file('media_file.mp3', Audio, AudioFormat.objects.all()[0:1])
+        stream = audio.streams.get()
+        AudioStream.objects.filter(pk=stream.pk).update(status=AudioStream.CONVERSION_PREPARATION)
+        with mock.patch.object(scratch, 'reserve_space', side_effect=scratch.ScratchSpaceError('No space.')), \
+                mock.patch.object(tasks.encode_stream, 'apply_async') as apply_async:
+            for i in range(5):
+                tasks.encode_stream(AudioStream, stream.pk)
+        self.assertEqual(apply_async.call_count, 5)
+        apply_async.assert_called_with((AudioStream, stream.pk), countdown=settings.SCRATCH_RETRY_DELAY)
+        self.assertEqual(AudioStream.objects.get(pk=stream.pk).status, AudioStream.CONVERSION_PREPARATION)
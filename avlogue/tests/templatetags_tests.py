@@ -1,10 +1,17 @@
 """
 AVlogue template tags test cases.
 """
+import mock
+from django.http import HttpResponse
+from django.template import Context, Template
+from django.test import RequestFactory, TestCase
+from django.utils import translation
 
-from django.test import TestCase
-
-from avlogue.models import AudioFormat, Audio, AudioFormatSet
+from avlogue import client_hints
+from avlogue import player_cache
+from avlogue import settings
+from avlogue.middleware import ClientHintsMiddleware
+from avlogue.models import AudioFormat, Audio, AudioFormatSet, AudioStream
 from avlogue.templatetags.avlogue_tags import avlogue_player
 from avlogue.tests import mocks
 
@@ -38,4 +45,109 @@ class TemplateTagsTestCase(TestCase):
         context = avlogue_player(media_file, format_sets=audio_format_set.name)
         self.assertEqual(list(s.format.id for s in context['streams']),
                          list(f.id for f in audio_format_set.formats.all()))
+
+        media_file.streams.filter(format=format1).update(status=AudioStream.CONVERSION_FAILURE)
+        context = avlogue_player(media_file, formats=','.join((format1.name, format2.name)))
+        self.assertEqual(list(s.format for s in context['streams']), [format2])
         self.assertRaises(TypeError, avlogue_player, 'Invalid type')
+
+    def test_player_tag_with_prefetched_streams(self):
+        """
+        Tests that avlogue player template tag filters prefetched streams without queries.
+        """
+        audio_format_set = AudioFormatSet.objects.first()
+        media_file = mocks.get_mock_media_file('media_file.mp3', Audio, audio_format_set.formats.all())
+        format1, format2 = AudioFormat.objects.all()[0:2]
+        formats = ','.join((format1.name, format2.name))
+
+        with self.assertNumQueries(3):
+            # media file, streams with formats, format sets
+            prefetched_media_file = Audio.objects.with_playable_streams().get(pk=media_file.pk)
+            list(prefetched_media_file.streams.all())
+
+        for kwargs in ({'formats': formats},
+                       {'formats': formats, 'bitrate': format2.audio_bitrate},
+                       {'formats': formats, 'min_bitrate': format2.audio_bitrate,
+                        'max_bitrate': format2.audio_bitrate},
+                       {'format_sets': audio_format_set.name}):
+            with self.assertNumQueries(0):
+                context = avlogue_player(prefetched_media_file, **kwargs)
+            self.assertEqual(set(s.pk for s in context['streams']),
+                             set(s.pk for s in avlogue_player(media_file, **kwargs)['streams']))
+
+        prefetched_media_file = Audio.objects.with_playable_streams(formats=[format1.name]).get(pk=media_file.pk)
+        self.assertEqual([s.format for s in avlogue_player(prefetched_media_file)['streams']], [format1])
+
+    def test_player_tag_cache(self):
+        """
+        Tests that rendered player html is cached until the media file streams are changed.
+        """
+        audio_format_set = AudioFormatSet.objects.first()
+        media_file = mocks.get_mock_media_file('media_file.mp3', Audio, audio_format_set.formats.all())
+        template = Template('{% load avlogue_tags %}{% avlogue_player media_file format_sets=format_sets %}')
+        context = Context({'media_file': media_file, 'format_sets': audio_format_set.name})
+
+        html = template.render(context)
+        self.assertEqual(html.count('<source'), audio_format_set.formats.count())
+        html_block = media_file.html_block()
+        with self.assertNumQueries(0):
+            self.assertEqual(template.render(context), html)
+            self.assertEqual(media_file.html_block(), html_block)
+
+        streams_count = media_file.streams.count()
+        media_file.streams.first().delete()
+        self.assertEqual(template.render(context).count('<source'), streams_count - 1)
+
+        audio_format_set.formats.remove(media_file.streams.first().format)
+        self.assertEqual(template.render(context).count('<source'), streams_count - 2)
+
+        # Streams prefetched for some formats are rendered to a separate html
+        template = Template('{% load avlogue_tags %}{% avlogue_player media_file %}')
+        html = template.render(Context({'media_file': media_file}))
+        prefetched_media_file = Audio.objects.with_playable_streams(
+            formats=media_file.streams.first().format.name).get(pk=media_file.pk)
+        self.assertEqual(template.render(Context({'media_file': prefetched_media_file})).count('<source'), 1)
+        self.assertEqual(template.render(Context({'media_file': media_file})), html)
+
+        # Translated html is cached by languages
+        with translation.override('en'):
+            self.assertEqual(player_cache.get_cache_key(media_file, {}), player_cache.get_cache_key(media_file, {}))
+            en_key = player_cache.get_cache_key(media_file, {})
+        with translation.override('de'):
+            self.assertNotEqual(player_cache.get_cache_key(media_file, {}), en_key)
+
+    def test_player_tag_client_hints(self):
+        """
+        Tests that player sources are ordered by the client hints.
+        """
+        format1, format2 = AudioFormat.objects.filter(name__in=('ac3', 'mp3')).order_by('audio_bitrate')
+        media_file = mocks.get_mock_media_file('media_file.mp3', Audio, (format1, format2))
+        factory = RequestFactory()
+
+        self.assertIsNone(client_hints.get_constraints(factory.get('/')))
+        self.assertIsNone(client_hints.get_constraints(factory.get('/', HTTP_DOWNLINK='10')))
+        self.assertEqual(client_hints.get_constraints(factory.get('/', HTTP_SAVE_DATA='on', HTTP_DOWNLINK='10')),
+                         (400000, None))
+        self.assertEqual(client_hints.get_constraints(factory.get('/', HTTP_ECT='2g', HTTP_VIEWPORT_WIDTH='360')),
+                         (150000, 480))
+
+        def get_formats(**kwargs):
+            return [s.format for s in avlogue_player(media_file, **kwargs)['streams']]
+
+        self.assertEqual(get_formats(constraints=(1000000, None)), [format2, format1])
+        self.assertEqual(get_formats(constraints=(150000, None)), [format1, format2])
+        with mock.patch.object(settings, 'PLAYER_LIMIT_SOURCES', True):
+            self.assertEqual(get_formats(constraints=(150000, None)), [format1])
+            self.assertEqual(get_formats(constraints=(100000, None)), [format1])
+
+        template = Template('{% load avlogue_tags %}{% avlogue_player media_file %}')
+        request = factory.get('/', HTTP_ECT='2g')
+        with mock.patch.object(client_hints, 'order_streams', wraps=client_hints.order_streams) as mock_order:
+            template.render(Context({'media_file': media_file, 'request': request}))
+        self.assertEqual(mock_order.call_args[0][1], (150000, None))
+
+        response = ClientHintsMiddleware().process_response(request, HttpResponse())
+        self.assertEqual(response['Accept-CH'], 'Save-Data, Downlink, ECT, Viewport-Width')
+        self.assertIn('ECT', response['Vary'])
+        response = ClientHintsMiddleware().process_response(factory.get('/'), HttpResponse())
+        self.assertFalse(response.has_header('Vary'))
@@ -13,6 +13,7 @@ django_version = django.get_version()
 urls = [
     url(r'^admin/', include(admin.site.urls)),
     url(r'^example-page', include('avlogue.tests.example_app.urls')),
+    url(r'^avlogue/', include('avlogue.urls', namespace='avlogue')),
 ]
 
 if StrictVersion(django_version) < StrictVersion('1.9'):
@@ -0,0 +1,243 @@
+"""
+AVlogue views test cases.
+"""
+import base64
+import json
+
+import mock
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.core.urlresolvers import reverse
+from django.test import TestCase
+
+from avlogue import settings
+from avlogue.models import Audio, AudioFormat, AudioStream, ChunkedUpload, Video, VideoFormat
+from avlogue.tests import factories
+from avlogue.tests import mocks
+
+
+class ChunkedUploadTestCase(TestCase):
+    fixtures = ['media-formats.json']
+
+    def setUp(self):
+        User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.login(username='admin', password='password')
+        patcher = mock.patch.object(settings, 'CHUNKED_UPLOAD_PROBE_SIZE', 32 * 1024)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def create_upload(self, media_type, file_name, size, **metadata):
+        metadata['filename'] = file_name
+        upload_metadata = ','.join('{} {}'.format(key, base64.b64encode(value.encode('utf-8')).decode('ascii'))
+                                   for key, value in metadata.items())
+        return self.client.post(reverse('avlogue:chunked_upload_create', kwargs={'media_type': media_type}),
+                                HTTP_TUS_RESUMABLE='1.0.0', HTTP_UPLOAD_LENGTH=str(size),
+                                HTTP_UPLOAD_METADATA=upload_metadata)
+
+    def patch_upload(self, location, offset, data):
+        return self.client.generic('PATCH', location, data, content_type='application/offset+octet-stream',
+                                   HTTP_TUS_RESUMABLE='1.0.0', HTTP_UPLOAD_OFFSET=str(offset))
+
+    def test_upload(self):
+        chunk_size = 16 * 1024
+        encode_format = AudioFormat.objects.get(name='mp3')
+        with factories.audio_file_factory(file_name='test_chunked_upload', encode_format=encode_format) as path:
+            with open(path, 'rb') as f:
+                content = f.read()
+
+        response = self.create_upload('audio', 'audio.mp3', len(content), title='chunked upload')
+        self.assertEqual(response.status_code, 201)
+        location = response['Location']
+
+        for offset in range(0, len(content), chunk_size):
+            if offset == chunk_size:
+                # Resumes the upload from the server offset
+                response = self.client.head(location, HTTP_TUS_RESUMABLE='1.0.0')
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(int(response['Upload-Offset']), offset)
+                self.assertEqual(self.patch_upload(location, 0, content[:chunk_size]).status_code, 409)
+            response = self.patch_upload(location, offset, content[offset:offset + chunk_size])
+            self.assertEqual(response.status_code, 204)
+            self.assertEqual(int(response['Upload-Offset']), min(offset + chunk_size, len(content)))
+
+        upload = ChunkedUpload.objects.get()
+        self.assertEqual(upload.status, upload.UPLOAD_COMPLETED)
+        self.assertTrue(upload.headers_checked)
+        audio = Audio.objects.get(pk=upload.media_file_id)
+        self.assertEqual(audio.title, 'chunked upload')
+        self.assertEqual(audio.size, len(content))
+        for name in upload.get_chunk_names():
+            self.assertFalse(settings.MEDIA_STORAGE.exists(name))
+        response = self.client.head(location, HTTP_TUS_RESUMABLE='1.0.0')
+        self.assertEqual(int(response['Media-File-Id']), audio.pk)
+        audio.delete()
+
+    def test_invalid_upload(self):
+        self.assertEqual(self.create_upload('audio', 'document.pdf', 1024).status_code, 415)
+
+        data = b'not a media file' * 4096
+        response = self.create_upload('video', 'video.mp4', len(data))
+        location = response['Location']
+        self.assertEqual(self.patch_upload(location, 0, data[:len(data) // 2]).status_code, 415)
+        upload = ChunkedUpload.objects.get()
+        self.assertEqual(upload.status, upload.UPLOAD_FAILURE)
+        for name in upload.get_chunk_names():
+            self.assertFalse(settings.MEDIA_STORAGE.exists(name))
+        self.assertEqual(self.patch_upload(location, len(data) // 2, data[len(data) // 2:]).status_code, 409)
+
+        response = self.client.delete(location, HTTP_TUS_RESUMABLE='1.0.0')
+        self.assertEqual(response.status_code, 204)
+        self.assertFalse(ChunkedUpload.objects.exists())
+
+    def test_permissions(self):
+        response = self.create_upload('audio', 'audio.mp3', 1024)
+        self.assertEqual(response.status_code, 201)
+        location = response['Location']
+
+        self.client.logout()
+        self.assertEqual(self.create_upload('audio', 'audio.mp3', 1024).status_code, 403)
+        self.assertEqual(self.client.head(location, HTTP_TUS_RESUMABLE='1.0.0').status_code, 404)
+        self.assertEqual(self.patch_upload(location, 0, b'data').status_code, 404)
+
+        response = self.client.post(reverse('avlogue:chunked_upload_create', kwargs={'media_type': 'audio'}),
+                                    HTTP_UPLOAD_LENGTH='1024')
+        self.assertEqual(response.status_code, 412)
+
+
+class MediaFileStreamsTestCase(TestCase):
+    fixtures = ['media-formats.json']
+
+    def test_streams(self):
+        format1, format2 = AudioFormat.objects.all()[0:2]
+        audio = mocks.get_mock_media_file('media_file.mp3', Audio, (format1, format2))
+        stream = audio.streams.get(format=format2)
+        stream.status = stream.CONVERSION_IN_PROGRESS
+        stream.save()
+
+        url = reverse('avlogue:media_file_streams', kwargs={'media_type': 'audio', 'pk': audio.pk})
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.content.decode('utf-8'))
+        self.assertEqual(data['id'], audio.pk)
+        self.assertEqual([(s['format'], s['status']) for s in data['streams']],
+                         [(format1.name, AudioStream.CONVERSION_SUCCESSFUL),
+                          (format2.name, AudioStream.CONVERSION_IN_PROGRESS)])
+        self.assertEqual(data['streams'][0]['content_type'], 'audio/mpeg')
+        self.assertNotIn('url', data['streams'][1])
+        etag = response['ETag']
+
+        # Not modified response is returned without loading the streams
+        with self.assertNumQueries(1):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+        # Title change doesn't change the streams version, stream change does
+        audio.title = 'new title'
+        audio.save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        stream.status = stream.CONVERSION_SUCCESSFUL
+        stream.save()
+        audio.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+        self.assertEqual(self.client.get(reverse('avlogue:media_file_streams',
+                                                 kwargs={'media_type': 'video', 'pk': audio.pk})).status_code, 404)
+
+    def test_batch_streams(self):
+        formats = VideoFormat.objects.all()[0:1]
+        video1 = mocks.get_mock_media_file('media_file1.mp4', Video, formats)
+        video2 = mocks.get_mock_media_file('media_file2.mp4', Video, formats)
+
+        url = reverse('avlogue:media_files_streams', kwargs={'media_type': 'video'})
+        response = self.client.get(url, {'ids': '{},{},0'.format(video2.pk, video1.pk)})
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.content.decode('utf-8'))
+        self.assertEqual([(m['id'], len(m['streams'])) for m in data['media_files']], [(video1.pk, 1), (video2.pk, 1)])
+        etag = response['ETag']
+
+        with self.assertNumQueries(1):
+            response = self.client.get(url, {'ids': '{},{},0'.format(video2.pk, video1.pk)},
+                                       HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        video1.streams.get().delete()
+        response = self.client.get(url, {'ids': '{},{},0'.format(video2.pk, video1.pk)}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+        self.assertEqual(self.client.get(url).status_code, 400)
+        self.assertEqual(self.client.get(url, {'ids': 'a,b'}).status_code, 400)
+
+
+class MediaFileServeTestCase(TestCase):
+    fixtures = ['media-formats.json']
+
+    def setUp(self):
+        audio = mocks.get_mock_media_file('media_file.mp3', Audio, AudioFormat.objects.all()[0:1])
+        self.stream = audio.streams.get()
+        self.content = bytes(bytearray(i % 256 for i in range(100000)))
+        storage = settings.MEDIA_STREAMS_STORAGE
+        self.assertEqual(storage.save(self.stream.file.name, ContentFile(self.content)), self.stream.file.name)
+        self.addCleanup(storage.delete, self.stream.file.name)
+        self.url = reverse('avlogue:stream_serve', kwargs={'media_type': 'audio', 'pk': self.stream.pk})
+
+    def test_serve(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+        self.assertEqual(response['Content-Type'], 'audio/mpeg')
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(int(response['Content-Length']), len(self.content))
+        etag = response['ETag']
+
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        self.stream.status = self.stream.CONVERSION_IN_PROGRESS
+        self.stream.save()
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+    def test_source_permission(self):
+        """
+        Tests that source files are not served to anonymous users.
+        """
+        media_file = self.stream.media_file
+        storage = settings.MEDIA_STORAGE
+        self.assertEqual(storage.save(media_file.file.name, ContentFile(self.content)), media_file.file.name)
+        self.addCleanup(storage.delete, media_file.file.name)
+        url = reverse('avlogue:media_file_serve', kwargs={'media_type': 'audio', 'pk': media_file.pk})
+        self.assertEqual(self.client.get(url).status_code, 403)
+        User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.login(username='admin', password='password')
+        self.assertNotEqual(self.client.get(url).status_code, 403)
+
+    def test_range(self):
+        for range_header, start, end in (('bytes=10-19', 10, 19), ('bytes=99990-', 99990, 99999),
+                                         ('bytes=-5', 99995, 99999), ('bytes=50000-200000', 50000, 99999)):
+            response = self.client.get(self.url, HTTP_RANGE=range_header)
+            self.assertEqual(response.status_code, 206, range_header)
+            self.assertEqual(response['Content-Range'], 'bytes {}-{}/{}'.format(start, end, len(self.content)))
+            self.assertEqual(int(response['Content-Length']), end - start + 1)
+            self.assertEqual(b''.join(response.streaming_content), self.content[start:end + 1])
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=200000-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */{}'.format(len(self.content)))
+
+        # Multiple ranges are not supported, the full file is served
+        self.assertEqual(self.client.get(self.url, HTTP_RANGE='bytes=0-1,5-6').status_code, 200)
+
+        etag = self.client.head(self.url)['ETag']
+        self.assertEqual(self.client.get(self.url, HTTP_RANGE='bytes=0-1', HTTP_IF_RANGE=etag).status_code, 206)
+        self.assertEqual(self.client.get(self.url, HTTP_RANGE='bytes=0-1', HTTP_IF_RANGE='"old"').status_code, 200)
+
+    def test_web_server_headers(self):
+        with mock.patch.object(settings, 'SERVE_FILES_HEADER', 'X-Accel-Redirect'):
+            response = self.client.get(self.url)
+        self.assertEqual(response['X-Accel-Redirect'], '/protected/{}'.format(self.stream.file.name))
+        self.assertEqual(response.content, b'')
+
+        with mock.patch.object(settings, 'SERVE_FILES_HEADER', 'X-Sendfile'):
+            response = self.client.get(self.url)
+        self.assertEqual(response['X-Sendfile'], self.stream.file.path)
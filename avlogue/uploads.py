@@ -0,0 +1,166 @@
+"""
+AVlogue resumable chunked uploads.
+
+Every received chunk is saved as a separate object in the media files storage, so uploads can be resumed
+from any process. The beginning of the upload is probed as soon as it is received to reject invalid files early.
+After the last chunk the chunks are joined into a local file, which is used to create Audio or Video.
+"""
+import datetime
+import logging
+import os
+import shutil
+import uuid
+
+from django.core.files.base import ContentFile
+from django.db import models
+from django.db.models.functions import Concat
+from django.utils.text import get_valid_filename
+from django.utils.timezone import now
+
+from avlogue import settings
+from avlogue.encoders import default_encoder
+from avlogue.encoders.exceptions import GetFileInfoError
+
+logger = logging.getLogger('avlogue')
+
+
+class InvalidUploadError(Exception):
+    """
+    Uploaded file is not a valid media file.
+    """
+    pass
+
+
+def get_chunks_dir(upload):
+    """
+    Returns storage directory of the upload chunks.
+
+    :param upload:
+    :type upload: avlogue.models.ChunkedUpload
+    :rtype: str
+    """
+    return os.path.join(settings.CHUNKED_UPLOADS_DIR, upload.upload_id.hex)
+
+
+def save_chunk(upload, data):
+    """
+    Saves chunk at the current upload offset.
+    Returns False if the offset was changed by a concurrent request, the chunk is not saved then.
+
+    :param upload:
+    :type upload: avlogue.models.ChunkedUpload
+    :param data: chunk content
+    :type data: bytes
+    :rtype: bool
+    """
+    from avlogue.models import ChunkedUpload
+
+    offset = upload.offset
+    name = os.path.join(get_chunks_dir(upload), '{:016d}_{}'.format(offset, uuid.uuid4().hex))
+    name = settings.MEDIA_STORAGE.save(name, ContentFile(data))
+
+    updated = ChunkedUpload.objects.filter(pk=upload.pk, offset=offset, status=ChunkedUpload.UPLOAD_IN_PROGRESS) \
+        .update(offset=offset + len(data), modified=now(),
+                chunks=Concat('chunks', models.Value('{}\n'.format(name)), output_field=models.TextField()))
+    if not updated:
+        settings.MEDIA_STORAGE.delete(name)
+        return False
+    upload.offset = offset + len(data)
+    upload.chunks += '{}\n'.format(name)
+    return True
+
+
+def read_beginning(upload, size):
+    """
+    Returns the beginning of the uploaded file.
+
+    :param upload:
+    :type upload: avlogue.models.ChunkedUpload
+    :param size: max size of the beginning in bytes
+    :type size: int
+    :rtype: bytes
+    """
+    data = []
+    data_size = 0
+    for name in upload.get_chunk_names():
+        if data_size >= size:
+            break
+        with settings.MEDIA_STORAGE.open(name) as chunk:
+            data.append(chunk.read(size - data_size))
+        data_size += len(data[-1])
+    return b''.join(data)
+
+
+def check_headers(upload):
+    """
+    Probes the beginning of the upload.
+    Raises InvalidUploadError if it is not a beginning of a media file of the upload media type.
+
+    :param upload:
+    :type upload: avlogue.models.ChunkedUpload
+    """
+    data = read_beginning(upload, settings.CHUNKED_UPLOAD_PROBE_SIZE)
+    try:
+        stream_types = default_encoder.probe_headers(ContentFile(data, name=upload.file_name))
+    except GetFileInfoError as e:
+        raise InvalidUploadError("Can't get information about media file: {}".format(e))
+    if stream_types is not None and upload.media_type not in stream_types:
+        raise InvalidUploadError('File has no {} stream.'.format(upload.media_type))
+
+
+def delete_chunks(upload):
+    """
+    Deletes the upload chunks from the storage.
+
+    :param upload:
+    :type upload: avlogue.models.ChunkedUpload
+    """
+    for name in upload.get_chunk_names():
+        settings.MEDIA_STORAGE.delete(name)
+
+
+def finalize(upload):
+    """
+    Joins the upload chunks and creates Audio or Video from the result file.
+    Chunks are deleted after the media file is created.
+
+    :param upload:
+    :type upload: avlogue.models.ChunkedUpload
+    :return: created media file
+    :rtype: avlogue.models.MediaFile
+    """
+    temp_dir = os.path.join(settings.TEMP_PATH, 'upload_{}'.format(upload.upload_id.hex))
+    os.mkdir(temp_dir)
+    try:
+        file_path = os.path.join(temp_dir, get_valid_filename(os.path.basename(upload.file_name)))
+        with open(file_path, 'wb') as output_file:
+            for name in upload.get_chunk_names():
+                with settings.MEDIA_STORAGE.open(name) as chunk:
+                    shutil.copyfileobj(chunk, output_file)
+        media_file = upload.get_media_file_model().objects.create_from_file(file_path, title=upload.title or None)
+    finally:
+        shutil.rmtree(temp_dir)
+    delete_chunks(upload)
+    return media_file
+
+
+def delete_expired_uploads():
+    """
+    Deletes uploads, which were not changed during the expiration period, with their chunks.
+
+    :return: number of deleted uploads
+    :rtype: int
+    """
+    from avlogue.models import ChunkedUpload
+
+    expired_uploads = ChunkedUpload.objects \
+        .filter(modified__lt=now() - datetime.timedelta(seconds=settings.CHUNKED_UPLOAD_EXPIRATION)) \
+        .exclude(status=ChunkedUpload.UPLOAD_PROCESSING)
+    deleted = 0
+    for upload in expired_uploads:
+        delete_chunks(upload)
+        upload.delete()
+        deleted += 1
+    if deleted:
+        logger.info('Deleted {} expired chunked uploads.'.format(deleted))
+    return deleted
@@ -0,0 +1,21 @@
+"""
+AVlogue urls. Include them with the 'avlogue' namespace.
+"""
+from django.conf.urls import url
+
+from avlogue import views
+
+app_name = 'avlogue'
+
+urlpatterns = [
+    url(r'^uploads/(?P<media_type>audio|video)/$', views.ChunkedUploadCreateView.as_view(),
+        name='chunked_upload_create'),
+    url(r'^uploads/(?P<upload_id>[0-9a-f]{32})/$', views.ChunkedUploadView.as_view(), name='chunked_upload'),
+    url(r'^streams/(?P<media_type>audio|video)/$', views.MediaFileStreamsView.as_view(), name='media_files_streams'),
+    url(r'^streams/(?P<media_type>audio|video)/(?P<pk>\d+)/$', views.MediaFileStreamsView.as_view(),
+        name='media_file_streams'),
+    url(r'^files/(?P<media_type>audio|video)/(?P<pk>\d+)/$', views.MediaFileServeView.as_view(),
+        name='media_file_serve'),
+    url(r'^files/(?P<media_type>audio|video)/streams/(?P<pk>\d+)/$', views.MediaFileServeView.as_view(streams=True),
+        name='stream_serve'),
+]
@@ -1,3 +1,5 @@
+import hashlib
+import logging
 import os
 import re
 from contextlib import contextmanager
@@ -6,12 +8,21 @@ from django.core.exceptions import ValidationError
 from django.core.files import File
 from django.core.files.temp import NamedTemporaryFile
 from django.core.files.uploadedfile import InMemoryUploadedFile, TemporaryUploadedFile
+from django.db import connections, transaction
+from django.db.models import Case, Value, When
+from django.utils import six
 from django.utils.deconstruct import deconstructible
+from django.utils.encoding import force_bytes
+from django.utils.text import get_valid_filename
 from django.utils.translation import ugettext_lazy as _
 
 from avlogue import settings
+from avlogue.encoders import default_encoder
+from avlogue.encoders.exceptions import GetFileInfoError
 from avlogue.mime import mimetypes
 
+logger = logging.getLogger('avlogue')
+
 
 @deconstructible
 class ContentTypeValidator(object):
@@ -51,6 +62,47 @@ class ContentTypeValidator(object):
         )
 
 
+def get_shard_path(instance, filename):
+    """
+    Returns subdirectory of the file by AVLOGUE_STORAGE_LAYOUT setting.
+    Streams of a media file are kept together in a directory of the media file pk. Primary key of a new
+    media file is not known when its file is saved, so media files and previews are sharded by the file name hash.
+
+    :param instance: media file or stream
+    :param filename: file name
+    :rtype: str
+    """
+    if settings.STORAGE_LAYOUT == 'flat':
+        return ''
+    media_file_pk = getattr(instance, 'media_file_id', None)
+    if media_file_pk is None:
+        digest = hashlib.md5(force_bytes(filename)).hexdigest()
+        return os.path.join(digest[0:2], digest[2:4])
+    if settings.STORAGE_LAYOUT == 'pk':
+        return os.path.join('{:03d}'.format(media_file_pk // 1000000 % 1000),
+                            '{:03d}'.format(media_file_pk // 1000 % 1000), str(media_file_pk))
+    digest = hashlib.md5(force_bytes(media_file_pk)).hexdigest()
+    return os.path.join(digest[0:2], digest[2:4], str(media_file_pk))
+
+
+@deconstructible
+class UploadTo(object):
+    """
+    Returns name of the uploaded file in the directory by AVLOGUE_STORAGE_LAYOUT setting.
+    The layout is read when a file is saved, so migrations don't depend on it.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def __call__(self, instance, filename):
+        filename = get_valid_filename(os.path.basename(filename))
+        return os.path.normpath(os.path.join(self.directory, get_shard_path(instance, filename), filename))
+
+    def __eq__(self, other):
+        return isinstance(other, self.__class__) and self.directory == other.directory
+
+
 @contextmanager
 def get_local_file_path(file):
     """
@@ -78,6 +130,84 @@ def get_local_file_path(file):
         raise TypeError('file must be instance of File, TemporaryUploadedFile or InMemoryUploadedFile')
 
 
+def get_file_info(file, stream_type=None):
+    """
+    Returns information about media file.
+    In-memory uploads are probed through a pipe, temporary file is created only if the file format needs seeking.
+
+    :param file:
+    :param stream_type: returns only data for specified stream type, can be 'video' or 'audio'
+    :return: Dictionary populated with Audio or Video fields
+    """
+    if settings.PIPE_PROBE_ENABLED and isinstance(file, InMemoryUploadedFile):
+        try:
+            return default_encoder.get_file_info(file, stream_type=stream_type)
+        except (GetFileInfoError, KeyError, ValueError) as e:
+            logger.debug('Pipe probe of {} failed, temporary file is used instead: {}'.format(file.name, e))
+    with get_local_file_path(file) as file_path:
+        return default_encoder.get_file_info(file_path, stream_type=stream_type)
+
+
+def split_names(names):
+    """
+    Returns list of names from comma separated string or None if names is None.
+
+    :param names: list of names or comma separated string
+    :return:
+    """
+    if names is None:
+        return None
+    if isinstance(names, six.string_types):
+        names = names.split(',')
+    return [name.strip() for name in names]
+
+
+def on_commit_once(func):
+    """
+    Calls the function after the commit of the current transaction, once whatever number of times it is scheduled
+    in the transaction. Django 1.8 has no transaction.on_commit, the function is called right away there.
+
+    :param func: function without arguments, e.g. delay method of a task
+    """
+    if not hasattr(transaction, 'on_commit'):
+        func()
+        return
+    for savepoint_ids, scheduled_func in transaction.get_connection().run_on_commit:
+        if scheduled_func == func:
+            return
+    transaction.on_commit(func)
+
+
+def bulk_update(queryset, instances, field_names):
+    """
+    Updates fields of the instances with CASE WHEN expressions, Django < 2.2 has no QuerySet.bulk_update.
+    Only rows of the queryset are updated, signals are not sent.
+
+    :param queryset: queryset of the updated rows
+    :param instances: model instances with the new field values
+    :param field_names: names of the updated fields
+    :return: number of the updated rows
+    :rtype: int
+    """
+    instances = list(instances)
+    fields = [queryset.model._meta.get_field(field_name) for field_name in field_names]
+    batch_size = len(instances)
+    if connections[queryset.db].vendor == 'sqlite':
+        # Number of query parameters is limited in SQLite
+        batch_size = max(1, 999 // (2 * len(fields) + 1))
+
+    updated_count = 0
+    for i in range(0, len(instances), batch_size):
+        batch = instances[i:i + batch_size]
+        updates = {}
+        for field in fields:
+            updates[field.name] = Case(*[When(pk=instance.pk, then=Value(
+                field.get_prep_value(getattr(instance, field.attname)), output_field=field)) for instance in batch],
+                output_field=field)
+        updated_count += queryset.filter(pk__in=[instance.pk for instance in batch]).update(**updates)
+    return updated_count
+
+
 def media_file_convert_action(format_set, model_admin, request, queryset):
     """
     Model admin abstract action for making streams.
@@ -0,0 +1,285 @@
+"""
+AVlogue views.
+"""
+import base64
+import binascii
+import calendar
+import hashlib
+
+from django.core.exceptions import ValidationError
+from django.core.files.base import File
+from django.core.urlresolvers import reverse
+from django.http import Http404, HttpResponse, HttpResponseNotModified, JsonResponse
+from django.utils.decorators import method_decorator
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+from django.views.decorators.csrf import csrf_exempt
+from django.views.generic import View
+
+from avlogue import serving
+from avlogue import settings
+from avlogue import tasks
+from avlogue import uploads
+from avlogue.models import Audio, ChunkedUpload, Video
+
+TUS_VERSION = '1.0.0'
+
+
+def parse_upload_metadata(value):
+    """
+    Parses tus Upload-Metadata header: comma separated pairs of a key and a base64 encoded value.
+
+    :param value:
+    :type value: str
+    :rtype: dict
+    """
+    metadata = {}
+    for pair in value.split(','):
+        key, _, encoded_value = pair.strip().partition(' ')
+        if key:
+            metadata[key] = base64.b64decode(encoded_value.strip()).decode('utf-8')
+    return metadata
+
+
+class BaseChunkedUploadView(View):
+    """
+    Base view of the resumable chunked upload API.
+    API implements tus protocol 1.0.0 with the creation and termination extensions.
+    """
+
+    @method_decorator(csrf_exempt)
+    def dispatch(self, request, *args, **kwargs):
+        if request.method != 'OPTIONS' and request.META.get('HTTP_TUS_RESUMABLE') != TUS_VERSION:
+            response = self.response(status=412)
+            response['Tus-Version'] = TUS_VERSION
+            return response
+        return super(BaseChunkedUploadView, self).dispatch(request, *args, **kwargs)
+
+    def response(self, status=204, content=b'', **headers):
+        response = HttpResponse(content, status=status, content_type='text/plain')
+        response['Tus-Resumable'] = TUS_VERSION
+        for name, value in headers.items():
+            response[name.replace('_', '-')] = value
+        return response
+
+    def has_permission(self, request, media_type):
+        return request.user.has_perm('avlogue.add_{}'.format(media_type))
+
+    def options(self, request, *args, **kwargs):
+        response = self.response(Tus_Version=TUS_VERSION, Tus_Extension='creation,termination')
+        response['Allow'] = ', '.join(method.upper() for method in self._allowed_methods())
+        if settings.CHUNKED_UPLOAD_MAX_SIZE is not None:
+            response['Tus-Max-Size'] = settings.CHUNKED_UPLOAD_MAX_SIZE
+        return response
+
+
+class ChunkedUploadCreateView(BaseChunkedUploadView):
+    """
+    Creates chunked upload of audio or video.
+    """
+    http_method_names = ['options', 'post']
+
+    def post(self, request, media_type):
+        if not self.has_permission(request, media_type):
+            return self.response(status=403)
+
+        try:
+            size = int(request.META['HTTP_UPLOAD_LENGTH'])
+            metadata = parse_upload_metadata(request.META.get('HTTP_UPLOAD_METADATA', ''))
+        except (KeyError, TypeError, ValueError, binascii.Error):
+            return self.response(status=400, content=b'Invalid Upload-Length or Upload-Metadata.')
+        if size < 0:
+            return self.response(status=400, content=b'Invalid Upload-Length.')
+        if settings.CHUNKED_UPLOAD_MAX_SIZE is not None and size > settings.CHUNKED_UPLOAD_MAX_SIZE:
+            return self.response(status=413)
+
+        upload = ChunkedUpload(user=request.user, media_type=media_type, size=size,
+                               file_name=metadata.get('filename', 'upload')[:255],
+                               title=metadata.get('title', '')[:50])
+        # Rejects files with invalid content type before receiving the content
+        try:
+            upload.get_media_file_model()._meta.get_field('file').run_validators(File(None, name=upload.file_name))
+        except ValidationError as e:
+            return self.response(status=415, content=' '.join(e.messages).encode('utf-8'))
+        upload.save()
+
+        location = request.build_absolute_uri(reverse('avlogue:chunked_upload',
+                                                      kwargs={'upload_id': upload.upload_id.hex}))
+        return self.response(status=201, Location=location)
+
+
+class ChunkedUploadView(BaseChunkedUploadView):
+    """
+    Returns offset of the chunked upload, appends chunks or terminates the upload.
+    """
+    http_method_names = ['options', 'head', 'patch', 'delete']
+
+    def get_upload(self, request, upload_id):
+        upload = ChunkedUpload.objects.filter(upload_id=upload_id, user_id=request.user.pk).first()
+        if upload is not None and self.has_permission(request, upload.media_type):
+            return upload
+
+    def head(self, request, upload_id):
+        upload = self.get_upload(request, upload_id)
+        if upload is None:
+            return self.response(status=404)
+        response = self.response(status=200, Upload_Offset=upload.offset, Upload_Length=upload.size,
+                                 Cache_Control='no-store', Upload_Status=upload.status)
+        if upload.media_file_id is not None:
+            response['Media-File-Id'] = upload.media_file_id
+        return response
+
+    def patch(self, request, upload_id):
+        upload = self.get_upload(request, upload_id)
+        if upload is None:
+            return self.response(status=404)
+        if request.META.get('CONTENT_TYPE', '').split(';')[0] != 'application/offset+octet-stream':
+            return self.response(status=415)
+        try:
+            offset = int(request.META['HTTP_UPLOAD_OFFSET'])
+        except (KeyError, ValueError):
+            return self.response(status=400, content=b'Invalid Upload-Offset.')
+        if upload.status != upload.UPLOAD_IN_PROGRESS or offset != upload.offset:
+            return self.response(status=409, Upload_Offset=upload.offset)
+
+        data = request.read(settings.CHUNKED_UPLOAD_CHUNK_MAX_SIZE + 1)
+        if len(data) > settings.CHUNKED_UPLOAD_CHUNK_MAX_SIZE or offset + len(data) > upload.size:
+            return self.response(status=413)
+        if data and not uploads.save_chunk(upload, data):
+            # Chunk was appended by a concurrent request
+            return self.response(status=409)
+
+        probe_size = min(settings.CHUNKED_UPLOAD_PROBE_SIZE, upload.size)
+        if not upload.headers_checked and upload.offset >= probe_size:
+            try:
+                uploads.check_headers(upload)
+            except uploads.InvalidUploadError as e:
+                uploads.delete_chunks(upload)
+                upload.status = upload.UPLOAD_FAILURE
+                upload.error = str(e)
+                upload.save(update_fields=['status', 'error', 'modified'])
+                return self.response(status=415, content=upload.error.encode('utf-8'))
+            upload.headers_checked = True
+            upload.save(update_fields=['headers_checked', 'modified'])
+
+        if upload.offset == upload.size:
+            upload.status = upload.UPLOAD_PROCESSING
+            upload.save(update_fields=['status', 'modified'])
+            tasks.finalize_chunked_upload.delay(upload.pk)
+        return self.response(Upload_Offset=upload.offset)
+
+    def delete(self, request, upload_id):
+        upload = self.get_upload(request, upload_id)
+        if upload is None:
+            return self.response(status=404)
+        if upload.status == upload.UPLOAD_PROCESSING:
+            return self.response(status=409)
+        uploads.delete_chunks(upload)
+        upload.delete()
+        return self.response()
+
+
+class MediaFileStreamsView(View):
+    """
+    Read-only JSON API of the media file streams and their conversion status.
+    Streams of many media files are returned by a request with the comma separated ids GET param.
+    ETag and Last-Modified are derived from the streams versions of the media files, so conditional requests
+    are answered with 304 without loading the streams.
+    """
+    http_method_names = ['get', 'head', 'options']
+
+    def get_media_file_ids(self, request, pk):
+        if pk is not None:
+            return [int(pk)]
+        ids = [int(media_file_id) for media_file_id in request.GET['ids'].split(',') if media_file_id.strip()]
+        if not 0 < len(ids) <= settings.STREAMS_API_MAX_IDS:
+            raise ValueError('Number of ids must be from 1 to {}.'.format(settings.STREAMS_API_MAX_IDS))
+        return ids
+
+    def get_etag(self, media_type, versions):
+        etag = ','.join('{}-{}'.format(pk, streams_version) for pk, streams_version, _ in versions)
+        if len(versions) > 1:
+            etag = hashlib.md5(etag.encode('utf-8')).hexdigest()
+        return '{}-{}'.format(media_type, etag)
+
+    def is_not_modified(self, request, etag, last_modified):
+        if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+        if if_none_match is not None:
+            etags = serving.parse_etags(if_none_match)
+            return etag in etags or '*' in etags
+        if_modified_since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+        return if_modified_since is not None and last_modified is not None and last_modified <= if_modified_since
+
+    def get_stream_data(self, stream):
+        data = {
+            'id': stream.pk,
+            'format': stream.format.name,
+            'status': stream.status,
+            'status_text': str(stream.get_status_text()),
+        }
+        if stream.status == stream.CONVERSION_SUCCESSFUL:
+            data.update(url=stream.public_url, content_type=stream.content_type, bitrate=stream.bitrate,
+                        size=stream.size, duration=stream.duration)
+        return data
+
+    def get(self, request, media_type, pk=None):
+        media_file_model = Audio if media_type == 'audio' else Video
+        try:
+            ids = self.get_media_file_ids(request, pk)
+        except (KeyError, ValueError) as e:
+            return HttpResponse(str(e), status=400, content_type='text/plain')
+
+        versions = list(media_file_model.objects.filter(pk__in=ids).order_by('pk')
+                        .values_list('pk', 'streams_version', 'streams_modified'))
+        if pk is not None and not versions:
+            return JsonResponse({'error': 'Not found.'}, status=404)
+
+        etag = quote_etag(self.get_etag(media_type, versions))
+        modified = [calendar.timegm(streams_modified.utctimetuple())
+                    for _, _, streams_modified in versions if streams_modified is not None]
+        last_modified = max(modified) if modified else None
+        if self.is_not_modified(request, etag, last_modified):
+            response = HttpResponseNotModified()
+        else:
+            stream_model = media_file_model._meta.get_field('streams').related_model
+            streams = {}
+            for stream in stream_model.objects.filter(media_file__in=[v[0] for v in versions]) \
+                    .select_related('format').order_by('pk'):
+                streams.setdefault(stream.media_file_id, []).append(self.get_stream_data(stream))
+            media_files = [{'id': media_file_id, 'type': media_type, 'streams_version': streams_version,
+                            'streams': streams.get(media_file_id, [])}
+                           for media_file_id, streams_version, _ in versions]
+            if pk is not None:
+                response = JsonResponse(media_files[0])
+            else:
+                response = JsonResponse({'media_files': media_files})
+        response['ETag'] = etag
+        if last_modified is not None:
+            response['Last-Modified'] = http_date(last_modified)
+        response['Cache-Control'] = 'no-cache'
+        return response
+
+
+class MediaFileServeView(View):
+    """
+    Serves the source file of a media file or the file of a playable stream with byte ranges support.
+    """
+    http_method_names = ['get', 'head']
+    streams = False
+
+    def has_permission(self, request, media_type):
+        # Playable streams are public, source files are served to the users who can change the media files
+        return self.streams or request.user.has_perm('avlogue.change_{}'.format(media_type))
+
+    def get(self, request, media_type, pk):
+        if not self.has_permission(request, media_type):
+            return HttpResponse(status=403)
+        model = Audio if media_type == 'audio' else Video
+        if self.streams:
+            model = model._meta.get_field('streams').related_model
+            queryset = model.objects.playable()
+        else:
+            queryset = model.objects.all()
+        obj = queryset.filter(pk=pk).only('id', 'file', 'content_type').first()
+        if obj is None or not obj.file.name:
+            raise Http404
+        return serving.serve_file(request, obj.file, obj.content_type)